@@ -0,0 +1,1495 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 Adam Britton
+#
+# This file is part of Minae Chess GUI.
+#
+# Minae Chess GUI is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Minae Chess GUI is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Minae Chess GUI.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Headless benchmarks for Minae Chess GUI.
+
+Runs under the Qt offscreen platform, so no display is needed. Results are
+written as JSON, and can be compared against the results of an earlier run
+to catch regressions:
+
+    ./benchmark.py --output new.json [name ...]
+    ./benchmark.py --compare old.json [name ...]
+
+A session recorded with minae.py --record can be replayed the same way, as
+a load test and, through its final board, history and game state, as a
+regression test:
+
+    ./benchmark.py --replay session.log [--realtime] --output replay.json
+    ./benchmark.py --replay session.log --compare replay.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import PySide2  # noqa: E402
+from PySide2.QtCore import (QEvent, QEventLoop, QObject,  # noqa: E402
+                            QPointF, Slot, qVersion)
+from PySide2.QtSvg import QGraphicsSvgItem  # noqa: E402
+from PySide2.QtTest import QTest  # noqa: E402
+from PySide2.QtWidgets import (QApplication, QGraphicsScene,  # noqa: E402
+                               QGraphicsSceneMouseEvent, QGraphicsView)
+
+import minae  # noqa: E402
+
+
+START_POSITION = {
+    'a1': 'R', 'b1': 'N', 'c1': 'B', 'd1': 'Q',
+    'e1': 'K', 'f1': 'B', 'g1': 'N', 'h1': 'R',
+    'a2': 'P', 'b2': 'P', 'c2': 'P', 'd2': 'P',
+    'e2': 'P', 'f2': 'P', 'g2': 'P', 'h2': 'P',
+    'a7': 'p', 'b7': 'p', 'c7': 'p', 'd7': 'p',
+    'e7': 'p', 'f7': 'p', 'g7': 'p', 'h7': 'p',
+    'a8': 'r', 'b8': 'n', 'c8': 'b', 'd8': 'q',
+    'e8': 'k', 'f8': 'b', 'g8': 'n', 'h8': 'r',
+}
+
+# Closed Ruy Lopez, as (source, target) pairs. Castling lists the rook move
+# as a second pair.
+GAME = [
+    [('e2', 'e4')], [('e7', 'e5')], [('g1', 'f3')], [('b8', 'c6')],
+    [('f1', 'b5')], [('a7', 'a6')], [('b5', 'a4')], [('g8', 'f6')],
+    [('e1', 'g1'), ('h1', 'f1')], [('f8', 'e7')], [('f1', 'e1')],
+    [('b7', 'b5')], [('a4', 'b3')], [('d7', 'd6')], [('c2', 'c3')],
+    [('e8', 'g8'), ('h8', 'f8')], [('h2', 'h3')], [('c6', 'a5')],
+    [('b3', 'c2')], [('c7', 'c5')], [('d2', 'd4')], [('d8', 'c7')],
+    [('b1', 'd2')], [('c5', 'd4')], [('c3', 'd4')], [('a5', 'c6')],
+]
+
+# GAME in standard algebraic notation
+GAME_SAN = [
+    'e4', 'e5', 'Nf3', 'Nc6', 'Bb5', 'a6', 'Ba4', 'Nf6', 'O-O', 'Be7',
+    'Re1', 'b5', 'Bb3', 'd6', 'c3', 'O-O', 'h3', 'Na5', 'Bc2', 'c5',
+    'd4', 'Qc7', 'Nbd2', 'cxd4', 'cxd4', 'Nc6',
+]
+
+BENCHMARKS = []
+
+# Metric name fragments telling which direction is an improvement. Metrics
+# matching neither, such as workload sizes, are not compared.
+HIGHER_IS_BETTER = ('per second', 'hit rate')
+LOWER_IS_BETTER = ('ns per', 'us per', 'ms per', 'seconds', 'KiB',
+                   'created per update', 'misses after', 'late frames',
+                   'rasterized', 'passes per ply', 'paints per ply',
+                   'torn paints')
+
+
+def benchmark(function):
+    """Registers a benchmark function."""
+    BENCHMARKS.append(function)
+    return function
+
+
+def game_positions():
+    """
+    Plays through GAME from the starting position.
+
+    :return: List of populated square dictionaries, one per ply, beginning
+             with the starting position
+    """
+    position = dict(START_POSITION)
+    positions = [dict(position)]
+    for ply in GAME:
+        for (src, dst) in ply:
+            position[dst] = position.pop(src)
+        positions += [dict(position)]
+    return positions
+
+
+@benchmark
+def set_position_items():
+    """Items created and time taken per BoardScene.set_position()."""
+    positions = game_positions()
+    scene = minae.BoardScene()
+    scene.set_position(positions[0])
+
+    created_before = scene.piece_items_created
+    start = time.perf_counter()
+    for position in positions[1:]:
+        scene.set_position(position)
+    elapsed = time.perf_counter() - start
+    updates = len(positions) - 1
+
+    return {
+        'updates': updates,
+        'items created per update': (
+            scene.piece_items_created - created_before) / updates,
+        'items created per update (full rebuild)': sum(
+            len(position) for position in positions[1:]) / updates,
+        'ms per update': 1000 * elapsed / updates,
+    }
+
+
+@benchmark
+def svg_renderer_cache():
+    """SVG renderer and pixmap cache misses before and after warm-up."""
+    positions = game_positions()
+    scene = minae.BoardScene()
+    scene.set_position(positions[0])
+    square_mask = minae.LegalMoves.square_mask
+    scene.highlight_squares(square_mask(['e2', 'e4']))
+    warm = minae.SvgRendererCache.stats()
+    warm_pixmaps = minae.PixmapCache.stats()
+
+    for position in positions[1:]:
+        scene.set_position(position)
+        scene.highlight_squares(square_mask(['e2', 'e3', 'e4']))
+    stats = minae.SvgRendererCache.stats()
+    pixmap_stats = minae.PixmapCache.stats()
+
+    return {
+        'renderers': stats['renderers'],
+        'pixmaps': pixmap_stats['pixmaps'],
+        'misses during warm-up': warm['misses'],
+        'misses after warm-up': stats['misses'] - warm['misses'],
+        'pixmap misses after warm-up':
+            pixmap_stats['misses'] - warm_pixmaps['misses'],
+    }
+
+
+@benchmark
+def board_resize():
+    """Resizing and repainting the board, against per-paint SVG items."""
+    app = QApplication.instance()
+    positions = game_positions()
+    view = minae.BoardView(None)
+    view.set_position(positions[-1])
+    view.set_analysis(minae.Analysis(
+        [(minae.SQUARE_INDICES['e4'], minae.SQUARE_INDICES['d5'])], 35))
+    paints = []
+    view.painted_signal.connect(lambda: paints.append(None))
+    view.show()
+    if not QTest.qWaitForWindowExposed(view):
+        raise ValueError('The board was never exposed')
+
+    def wait_for_paint(painted):
+        # Images are rasterized for a new size when the board is painted,
+        # so a resize only counts once that paint has happened
+        deadline = time.perf_counter() + 1
+        while len(paints) == painted:
+            if time.perf_counter() > deadline:
+                raise ValueError('The board was not painted')
+            app.processEvents()
+
+    def resize(sizes):
+        start = time.perf_counter()
+        for size in sizes:
+            painted = len(paints)
+            view.resize(size, size)
+            wait_for_paint(painted)
+        return (time.perf_counter() - start) / len(sizes)
+
+    def repaint(view, repaints=100):
+        start = time.perf_counter()
+        for _ in range(repaints):
+            view.viewport().repaint()
+        return (time.perf_counter() - start) / repaints
+
+    # The first pass rasterizes every image at each size, later passes find
+    # them cached
+    sizes = [360, 480, 720, 960, 1440, 960, 720, 480]
+    before = minae.PixmapCache.stats()
+    cold = resize(sizes)
+    after_cold = minae.PixmapCache.stats()
+    warm = resize(sizes * 5)
+    after_warm = minae.PixmapCache.stats()
+    cold_misses = after_cold['misses'] - before['misses']
+    warm_misses = after_warm['misses'] - after_cold['misses']
+    if cold_misses == 0:
+        raise ValueError('The cold resizes rasterized no pixmaps')
+    if warm_misses != 0 or after_warm['hits'] == after_cold['hits']:
+        raise ValueError(f'The warm resizes missed the pixmap cache '
+                         f'{warm_misses} times')
+
+    view.resize(960, 960)
+    wait_for_paint(len(paints))
+    painted = len(paints)
+    pixmap_repaint = repaint(view)
+    if len(paints) == painted:
+        raise ValueError('Repainting the board painted nothing')
+
+    # The same board drawn by SVG items, which render vectors on every paint
+    svg_view = QGraphicsView()
+    svg_scene = QGraphicsScene()
+    svg_view.setScene(svg_scene)
+    scene = view.scene
+    for (pos, (x, y)) in scene.square_x_y.items():
+        keys = ['l' if pos in scene.LIGHT_SQUARES else 'd']
+        if pos in scene.pieces:
+            keys += [scene.pieces[pos]]
+        for key in keys:
+            item = QGraphicsSvgItem()
+            item.setSharedRenderer(
+                minae.SvgRendererCache.renderer(scene.IMAGES[key]))
+            item.setPos(x, y)
+            svg_scene.addItem(item)
+    svg_view.resize(960, 960)
+    svg_view.show()
+    if not QTest.qWaitForWindowExposed(svg_view):
+        raise ValueError('The SVG board was never exposed')
+    svg_view.fitInView(scene.sceneRect())
+    svg_repaint = repaint(svg_view)
+
+    svg_view.close()
+    view.close()
+    return {
+        'ms per resize to paint (cold)': 1000 * cold,
+        'ms per resize to paint (warm)': 1000 * warm,
+        'pixmaps rasterized (cold)': cold_misses,
+        'pixmap misses after warm-up': warm_misses,
+        'pixmap hits (warm)': after_warm['hits'] - after_cold['hits'],
+        'ms per repaint at 960px (pixmaps)': 1000 * pixmap_repaint,
+        'ms per repaint at 960px (svg items)': 1000 * svg_repaint,
+    }
+
+
+def placement(populated_squares):
+    """
+    Converts populated squares to the piece placement field of a FEN.
+
+    :param populated_squares: Dictionary in format {pos:piece}
+    :return: Piece placement, e.g. 'rnbqkbnr/pppppppp/8/...'
+    """
+    ranks = []
+    for rank in '87654321':
+        text = ''
+        empty = 0
+        for file in 'abcdefgh':
+            piece = populated_squares.get(file + rank)
+            if piece is None:
+                empty += 1
+            else:
+                text += (str(empty) if empty else '') + piece
+                empty = 0
+        ranks += [text + (str(empty) if empty else '')]
+    return '/'.join(ranks)
+
+
+def fen_corpus(size, distinct, seed=0):
+    """
+    Builds a corpus of FENs in which a small set of positions repeats
+    heavily, as in an engine analysis feed.
+
+    :param size: Number of FENs in the corpus
+    :param distinct: Number of distinct positions to draw from
+    :param seed: Random seed, so runs are comparable
+    :return: List of FEN strings
+    """
+    rng = random.Random(seed)
+    squares = [file + rank for file in 'abcdefgh' for rank in '12345678']
+    fens = [placement(position) + ' w KQkq - 0 1'
+            for position in game_positions()]
+    while len(fens) < distinct:
+        position = dict(zip(rng.sample(squares, 24),
+                            rng.choices('PRNBQKprnbqk', k=24)))
+        fens += [f'{placement(position)} {rng.choice("wb")} - - '
+                 f'{rng.randrange(50)} {rng.randrange(1, 200)}']
+    # Skew towards the first positions, like a search revisiting its
+    # principal variation
+    weights = [1 / (n + 1) for n in range(len(fens))]
+    return rng.choices(fens, weights, k=size)
+
+
+@benchmark
+def fen_parsing():
+    """FEN parsing throughput, with and without the placement cache."""
+    corpus = fen_corpus(100000, 5000)
+    results = {'fens': len(corpus)}
+    for (label, cache_size) in (('uncached', 0), ('cached', 4096)):
+        parser = minae.FenParser(cache_size)
+        start = time.perf_counter()
+        for fen in corpus:
+            parser.parse(fen)
+        elapsed = time.perf_counter() - start
+        results[f'fens per second ({label})'] = len(corpus) / elapsed
+        if cache_size:
+            results['cache hit rate'] = parser.hits / len(corpus)
+    return results
+
+
+@benchmark
+def update_coalescing():
+    """Updates applied and dropped for a burst of positions at 60 FPS."""
+    app = QApplication.instance()
+    positions = game_positions()
+    main_window = minae.MainWindow()
+    coalescer = minae.UpdateCoalescer(main_window, max_fps=60)
+
+    start = time.perf_counter()
+    for n in range(2000):
+        coalescer.set_position('', positions[n % len(positions)])
+        if n % 20 == 0:
+            app.processEvents()
+    while coalescer.pending or coalescer.timer.isActive():
+        app.processEvents()
+    elapsed = time.perf_counter() - start
+
+    main_window.close()
+    return {
+        'updates posted': 2000,
+        'updates applied': coalescer.applied['set_position'],
+        'updates dropped': coalescer.dropped['set_position'],
+        'seconds until idle': elapsed,
+    }
+
+
+def time_history_appends(view, plies, samples=50):
+    """
+    Times appending half moves to a move history view once it holds a
+    given number of plies, including the repaint.
+
+    :param view: MoveHistoryView
+    :param plies: Number of plies in the history before timing
+    :param samples: Number of appends to time
+    :return: Mean seconds per append
+    """
+    app = QApplication.instance()
+    view.set_move_history(['Nf3', 'Nf6', 'Ng1', 'Ng8'] * (plies // 4)
+                          + ['e4'] * (plies % 4))
+    app.processEvents()
+
+    start = time.perf_counter()
+    for n in range(samples):
+        view.append_move_history(['Nc3' if n % 2 == 0 else 'Nc6'])
+        view.viewport().repaint()
+    return (time.perf_counter() - start) / samples
+
+
+@benchmark
+def move_history_append():
+    """Cost of appending a ply to the move history at various lengths."""
+    view = minae.MoveHistoryView(None)
+    view.resize(180, 400)
+    results = {}
+    for plies in (10, 100, 1000, 10000):
+        results[f'us per append at ply {plies}'] = \
+            1e6 * time_history_appends(view, plies)
+    view.close()
+    return results
+
+
+START_LEGAL_MOVES = [
+    'a2a3', 'a2a4', 'b2b3', 'b2b4', 'c2c3', 'c2c4', 'd2d3', 'd2d4',
+    'e2e3', 'e2e4', 'f2f3', 'f2f4', 'g2g3', 'g2g4', 'h2h3', 'h2h4',
+    'b1a3', 'b1c3', 'g1f3', 'g1h3',
+]
+
+
+@benchmark
+def command_protocols():
+    """Throughput of the JSON and binary command protocols, per ply."""
+    fens = fen_corpus(20000, 2000)
+    protocol = minae.BinaryProtocol
+    json_lines = [json.dumps({
+        'set fen': fen,
+        'set legal moves': START_LEGAL_MOVES,
+        'append history': ['e4'],
+    }).encode() + b'\n' for fen in fens]
+    binary_data = b''.join(
+        protocol.encode_fen(fen)
+        + protocol.encode_legal_moves(START_LEGAL_MOVES)
+        + protocol.encode_history(protocol.APPEND_HISTORY, ['e4'])
+        for fen in fens)
+
+    results = {'plies': len(fens)}
+
+    # Both are decoded from whole reads and handled as one batch each, as
+    # CommandReader and the IO thread do
+    read_size = minae.CommandReader.READ_SIZE
+    json_data = b''.join(json_lines)
+    io_thread = minae.IOThread(None)
+    start = (time.perf_counter(), time.process_time())
+    buffered = b''
+    for offset in range(0, len(json_data), read_size):
+        lines = (buffered + json_data[offset:offset + read_size]).split(b'\n')
+        buffered = lines.pop()
+        io_thread.processor.handle_batch(
+            [json.loads(line) for line in lines])
+    results['plies per second (json)'] = \
+        len(fens) / (time.perf_counter() - start[0])
+    results['cpu us per ply (json)'] = \
+        1e6 * (time.process_time() - start[1]) / len(fens)
+
+    io_thread = minae.IOThread(None)
+    start = (time.perf_counter(), time.process_time())
+    buffered = b''
+    for offset in range(0, len(binary_data), read_size):
+        (frames, buffered) = protocol.split_frames(
+            buffered + binary_data[offset:offset + read_size])
+        io_thread.processor.handle_batch(
+            [(opcode, payload, 1) for (opcode, payload) in frames])
+    results['plies per second (binary)'] = \
+        len(fens) / (time.perf_counter() - start[0])
+    results['cpu us per ply (binary)'] = \
+        1e6 * (time.process_time() - start[1]) / len(fens)
+
+    results['bytes per ply (json)'] = \
+        sum(len(line) for line in json_lines) / len(fens)
+    results['bytes per ply (binary)'] = len(binary_data) / len(fens)
+    return results
+
+
+@benchmark
+def malformed_commands():
+    """Commands of the wrong shape, which must be rejected, not raised."""
+    commands = [
+        {'set legal moves': 5},
+        {'set legal moves': {'e2': 'e4'}},
+        {'append history': 3},
+        {'append history': 'e4'},
+        {'append history': [1, 2]},
+        {'set history': None},
+        {'set history': {'ply': 'e4'}},
+        {'set analysis': 'e2e4'},
+        {'set analysis': [5, {'pv': 7}]},
+        {'set fen': 42},
+        {'open pgn': 0},
+        {'open pgn': ['games.pgn']},
+        {'open game': 'one'},
+        {'game': 7, 'set fen': minae.PgnFile.START_FEN},
+    ]
+    processor = minae.CommandProcessor(lambda update, *args: None)
+    # A line of invalid UTF-8 from one client, ahead of a valid one
+    (read_fd, write_fd) = os.pipe()
+    os.write(write_fd, b'{"set history": ["\xff"]}\n{"undo history": 1}\n')
+    os.close(write_fd)
+    reader = minae.CommandReader(stdin_fd=read_fd)
+
+    with contextlib.redirect_stderr(io.StringIO()):
+        start = time.perf_counter()
+        for cmds in commands:
+            try:
+                processor.handle_commands(cmds)
+            except Exception as err:
+                raise ValueError(f'{cmds} raised {err!r}') from err
+        elapsed = time.perf_counter() - start
+        try:
+            batch = reader.read()
+        except ValueError as err:
+            raise ValueError(f'Invalid UTF-8 stopped the reader: {err!r}') \
+                from err
+    reader.close()
+    os.close(read_fd)
+    if batch != [{'undo history': 1}]:
+        raise ValueError(f'Read {batch} around an invalid UTF-8 line')
+
+    return {
+        'malformed commands': len(commands),
+        'us per malformed command': 1e6 * elapsed / len(commands),
+    }
+
+
+def connect_update(io_thread, update, slot):
+    """
+    Connects a slot to one kind of update in the snapshots of an IO thread.
+
+    :param io_thread: IOThread
+    :param update: Name of the update, e.g. 'set_legal_moves'
+    :param slot: Callable taking the update's arguments
+    """
+    io_thread.apply_updates_signal.connect(
+        lambda updates: [slot(*args) for (name, args) in updates
+                         if name == update])
+
+
+@benchmark
+def legal_move_highlights():
+    """Parsing 218 legal moves, then selecting and highlighting a square."""
+    rng = random.Random(0)
+    moves = set()
+    while len(moves) < 218:
+        moves.add(rng.choice(minae.SQUARES) + rng.choice(minae.SQUARES))
+    moves = ' '.join(sorted(moves))
+    (src, _) = max(((pos, moves.count(pos + ' ')) for pos in minae.SQUARES),
+                   key=lambda count: count[1])
+
+    scene = minae.BoardScene()
+    io_thread = minae.IOThread(None)
+    masks = []
+    connect_update(io_thread, 'set_legal_moves',
+                   lambda game_id, legal_moves: scene.set_legal_moves(
+                       legal_moves))
+    connect_update(io_thread, 'set_legal_moves',
+                   lambda game_id, legal_moves: masks.append(legal_moves))
+    repeats = 200
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        io_thread.handle_commands({'set legal moves': moves})
+    parse_elapsed = time.perf_counter() - start
+
+    square = minae.SQUARE_INDICES[src]
+    start = time.perf_counter()
+    for _ in range(repeats):
+        scene.highlight_squares(masks[-1].masks[square] | 1 << square)
+        scene.highlight_squares(0)
+    highlight_elapsed = time.perf_counter() - start
+
+    return {
+        'legal moves': 218,
+        'us per parse': 1e6 * parse_elapsed / repeats,
+        'targets highlighted': len(masks[-1].targets(src)) + 1,
+        'us per highlight': 1e6 * highlight_elapsed / repeats,
+    }
+
+
+def click(scene, pos):
+    """
+    Sends a synthetic mouse press on a square to a board scene.
+
+    :param scene: BoardScene
+    :param pos: Square position in algebraic notation, e.g. 'e2'
+    """
+    (x, y) = scene.square_x_y[pos]
+    event = QGraphicsSceneMouseEvent(QEvent.GraphicsSceneMousePress)
+    event.setScenePos(QPointF(x + 1, y + 1))
+    scene.mousePressEvent(event)
+
+
+@benchmark
+def click_stress():
+    """Scene items and memory across thousands of synthetic clicks."""
+    scene = minae.BoardScene()
+    scene.set_position(START_POSITION)
+    io_thread = minae.IOThread(None)
+    connect_update(io_thread, 'set_legal_moves',
+                   lambda game_id, legal_moves: scene.set_legal_moves(
+                       legal_moves))
+    io_thread.handle_commands({'set legal moves': START_LEGAL_MOVES})
+    # Only click sources and an empty square, never completing a move, so
+    # the legal moves stay in place
+    sources = sorted({move[:2] for move in START_LEGAL_MOVES})
+    clicks = 5000
+    max_memory_growth = 64 * 1024
+
+    for n in range(100):
+        click(scene, sources[n % len(sources)])
+    items_before = len(scene.items())
+    tracemalloc.start()
+    memory_before = tracemalloc.get_traced_memory()[0]
+
+    start = time.perf_counter()
+    for n in range(clicks):
+        click(scene, sources[n % len(sources)] if n % 3 else 'e5')
+    elapsed = time.perf_counter() - start
+
+    memory_after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    items_after = len(scene.items())
+
+    # Clicking only shows and hides pooled items, so neither may grow
+    if items_after != items_before:
+        raise ValueError(f'Scene items went from {items_before} to '
+                         f'{items_after} over {clicks} clicks')
+    if memory_after - memory_before > max_memory_growth:
+        raise ValueError(f'Python memory grew by '
+                         f'{memory_after - memory_before} bytes over '
+                         f'{clicks} clicks')
+
+    return {
+        'clicks': clicks,
+        'us per click': 1e6 * elapsed / clicks,
+        'scene items before': items_before,
+        'scene items after': items_after,
+        'python memory growth (KiB)': (memory_after - memory_before) / 1024,
+    }
+
+
+@benchmark
+def tracing_overhead():
+    """IO thread cost per command with latency tracing off and on."""
+    fens = fen_corpus(20000, 2000)
+    results = {}
+    for (label, tracer) in (('off', None), ('on', minae.LatencyTracer())):
+        io_thread = minae.IOThread(None, tracer)
+        start = time.perf_counter()
+        for fen in fens:
+            io_thread.handle_commands({'set fen': fen})
+        results[f'us per command (tracing {label})'] = \
+            1e6 * (time.perf_counter() - start) / len(fens)
+    return results
+
+
+@benchmark
+def monitor_boards():
+    """CPU cost of watching 100 games updating a few times per second."""
+    app = QApplication.instance()
+    main_window = minae.MainWindow(monitor=True)
+    main_window.resize(1280, 800)
+    coalescer = minae.UpdateCoalescer(main_window, max_fps=60)
+    io_thread = minae.IOThread(None)
+    io_thread.apply_updates_signal.connect(coalescer.apply_updates)
+
+    games = [f'board {n + 1}' for n in range(100)]
+    fens = [f'{placement(position)} w KQkq - 0 1'
+            for position in game_positions()]
+    for game_id in games:
+        io_thread.handle_commands({'game': game_id, 'set fen': fens[0]})
+    while coalescer.pending or coalescer.timer.isActive():
+        app.processEvents()
+
+    # Every game makes a move about 5 times per second
+    seconds = 3
+    rate = 5
+    updates = 0
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    for tick in range(seconds * rate):
+        tick_end = wall_start + (tick + 1) / rate
+        for (n, game_id) in enumerate(games):
+            io_thread.handle_commands({
+                'game': game_id,
+                'set fen': fens[(tick + n) % len(fens)],
+                'append history': ['e4'],
+            })
+            updates += 1
+        while time.perf_counter() < tick_end:
+            app.processEvents()
+    while coalescer.pending or coalescer.timer.isActive():
+        app.processEvents()
+    cpu_elapsed = time.process_time() - cpu_start
+    wall_elapsed = time.perf_counter() - wall_start
+
+    main_window.close()
+    return {
+        'games': len(games),
+        'board updates per second': updates / wall_elapsed,
+        'cpu share (seconds/second)': cpu_elapsed / wall_elapsed,
+    }
+
+
+@benchmark
+def game_navigation():
+    """Stepping back and forth through a 500 ply game, cold and warm."""
+    app = QApplication.instance()
+    store = minae.PositionStore()
+    main_window = minae.MainWindow(position_store=store)
+    io_thread = minae.IOThread(None, position_store=store)
+    io_thread.apply_updates_signal.connect(main_window.apply_updates)
+
+    # Distinct positions, so the snapshots are not shared between plies
+    plies = 500
+    rng = random.Random(0)
+    fens = [placement(dict(zip(rng.sample(minae.SQUARES, 24),
+                               rng.choices('PRNBQKprnbqk', k=24))))
+            + f' {"wb"[n % 2]} - - 0 1' for n in range(plies)]
+    io_thread.handle_commands({'set fen': fens[0]})
+    for fen in fens[1:]:
+        io_thread.handle_commands({'set fen': fen, 'append history': ['e4']})
+    app.processEvents()
+
+    def scrub(steps):
+        start = time.perf_counter()
+        for ply in steps:
+            main_window.view_ply(ply)
+            main_window.board_view.viewport().repaint()
+        return (time.perf_counter() - start) / len(steps)
+
+    # Back to the start of the game, then back and forth over the opening,
+    # which is then in the snapshot cache
+    cold = scrub(range(plies - 2, -1, -1))
+    window = list(range(100)) + list(range(99, -1, -1))
+    warm = scrub(window * 5)
+
+    # The same steps applied to the live board, as when the engine resends
+    # every position
+    fen_parser = minae.FenParser()
+    start = time.perf_counter()
+    for fen in reversed(fens):
+        main_window.set_position('', fen_parser.parse(fen)[0])
+        main_window.board_view.viewport().repaint()
+    resend = (time.perf_counter() - start) / plies
+
+    main_window.close()
+    return {
+        'positions stored': len(store.positions),
+        'ms per step (cold)': 1000 * cold,
+        'ms per step (warm)': 1000 * warm,
+        'ms per step (engine resends fen)': 1000 * resend,
+        'snapshot hit rate': main_window.snapshots.hits
+        / (main_window.snapshots.hits + main_window.snapshots.misses),
+    }
+
+
+def write_pgn(path, games):
+    """
+    Writes a PGN archive of copies of GAME.
+
+    :param path: Path of the PGN file
+    :param games: Number of games
+    """
+    move_text = ' '.join(
+        (f'{n // 2 + 1}. ' if n % 2 == 0 else '') + move
+        for (n, move) in enumerate(GAME_SAN))
+    with open(path, 'w') as pgn_file:
+        for n in range(games):
+            pgn_file.write(
+                f'[Event "Benchmark"]\n[Site "?"]\n[Date "2020.01.01"]\n'
+                f'[Round "{n + 1}"]\n[White "White"]\n[Black "Black"]\n'
+                f'[Result "*"]\n\n{move_text} {{a comment}} *\n\n')
+
+
+@benchmark
+def pgn_index():
+    """Indexing, reopening and random access of a large PGN archive."""
+    games = 200000
+    results = {'games': games}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'archive.pgn')
+        write_pgn(path, games)
+        results['archive size (MB)'] = os.path.getsize(path) / 1e6
+
+        start = time.perf_counter()
+        minae.PgnFile(path).close()
+        results['seconds to index'] = time.perf_counter() - start
+
+        # Again without the index, as tracing allocations skews the timing
+        os.remove(path + minae.PgnFile.INDEX_SUFFIX)
+        tracemalloc.start()
+        minae.PgnFile(path).close()
+        results['python memory peak while indexing (KiB)'] = \
+            tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        pgn_file = minae.PgnFile(path)
+        results['ms to reopen'] = 1000 * (time.perf_counter() - start)
+
+        rng = random.Random(0)
+        numbers = [rng.randrange(1, games + 1) for _ in range(1000)]
+        start = time.perf_counter()
+        for number in numbers:
+            pgn_file.game(number)
+        results['us per game open'] = \
+            1e6 * (time.perf_counter() - start) / len(numbers)
+        pgn_file.close()
+    return results
+
+
+# Reference positions with their published perft counts, by depth
+PERFT_POSITIONS = [
+    ('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+     [20, 400, 8902, 197281]),
+    ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+     [48, 2039, 97862]),
+    ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+     [14, 191, 2812, 43238]),
+    ('r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+     [6, 264, 9467]),
+    ('rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+     [44, 1486, 62379]),
+    ('r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - '
+     '0 10',
+     [46, 2079, 89890]),
+]
+
+
+@benchmark
+def move_generation():
+    """Perft of the reference positions, checked against published counts."""
+    fen_parser = minae.FenParser()
+    positions = [(fen, minae.Position(*fen_parser.parse(fen)), counts)
+                 for (fen, counts) in PERFT_POSITIONS]
+
+    nodes = 0
+    start = time.perf_counter()
+    for (fen, position, counts) in positions:
+        for (depth, count) in enumerate(counts, 1):
+            perft = position.perft(depth)
+            if perft != count:
+                raise ValueError(f'perft({depth}) of {fen} is {perft}, '
+                                 f'expected {count}')
+            nodes += perft
+    elapsed = time.perf_counter() - start
+
+    # The cost --movegen adds to every position set
+    start = time.perf_counter()
+    for _ in range(100):
+        for (_, position, _) in positions:
+            position.legal_move_masks()
+    legal_moves_elapsed = time.perf_counter() - start
+
+    return {
+        'perft nodes': nodes,
+        'perft nodes per second': nodes / elapsed,
+        'us per legal move set': 1e6 * legal_moves_elapsed
+        / (100 * len(positions)),
+    }
+
+
+@benchmark
+def stalled_event_reader():
+    """GUI responsiveness while the consumer of user moves stops reading."""
+    app = QApplication.instance()
+    (read_fd, write_fd) = os.pipe()
+    writer = minae.EventWriter(os.fdopen(write_fd, 'w'), max_events=1024)
+    scene = minae.BoardScene()
+    scene.set_position(START_POSITION)
+    scene.move_signal.connect(lambda move: writer.user_move('', move))
+    # Every square may move to e4
+    legal_moves = minae.LegalMoves([1 << minae.SQUARE_INDICES['e4']] * 64)
+
+    # Nothing reads the pipe, so it fills and the writer thread blocks,
+    # while the event loop keeps making moves and must stay responsive
+    moves = 0
+    longest_click = 0
+    longest_iteration = 0
+    (max_move_time, max_iteration_time) = (0.05, 0.1)
+    last_iteration = time.perf_counter()
+    end = last_iteration + 2
+    while time.perf_counter() < end:
+        scene.set_legal_moves(legal_moves)
+        start = time.perf_counter()
+        click(scene, 'e2')
+        click(scene, 'e4')
+        longest_click = max(longest_click, time.perf_counter() - start)
+        moves += 1
+        app.processEvents()
+        now = time.perf_counter()
+        longest_iteration = max(longest_iteration, now - last_iteration)
+        last_iteration = now
+
+    writer_blocked = writer.thread.is_alive() and len(writer.events) > 0
+    # Closing the read end breaks the pipe, which releases the writer
+    os.close(read_fd)
+    writer.close()
+
+    # A blocked consumer must never stall the event loop
+    if longest_click > max_move_time:
+        raise ValueError(f'Making a move took up to '
+                         f'{1000 * longest_click:.1f} ms')
+    if longest_iteration > max_iteration_time:
+        raise ValueError(f'An event loop iteration took up to '
+                         f'{1000 * longest_iteration:.1f} ms')
+    return {
+        'moves': moves,
+        'writer blocked': int(writer_blocked),
+        'events dropped': writer.dropped,
+        'ms per move made (max)': 1000 * longest_click,
+        'ms per event loop iteration (max)': 1000 * longest_iteration,
+    }
+
+
+def position_latency(analysis_rate, seconds=2, position_rate=30):
+    """
+    Measures set fen latency, from command to painted board, while analysis
+    streams in alongside.
+
+    :param analysis_rate: Analysis updates per second, or 0 for none
+    :param seconds: Seconds to run for
+    :param position_rate: Positions per second
+    :return: Tuple containing the 'total' latency percentiles from
+             LatencyTracer.stats() and the number of analysis updates applied
+    """
+    app = QApplication.instance()
+    tracer = minae.LatencyTracer()
+    main_window = minae.MainWindow(tracer)
+    coalescer = minae.UpdateCoalescer(main_window, max_fps=60)
+    analysis_coalescer = minae.UpdateCoalescer(
+        main_window, max_fps=10, report_drops=False)
+    io_thread = minae.IOThread(None, tracer)
+    io_thread.apply_updates_signal.connect(coalescer.apply_updates)
+    io_thread.set_analysis_signal.connect(analysis_coalescer.set_analysis)
+
+    fens = [f'{placement(position)} w KQkq - 0 1'
+            for position in game_positions()]
+    rng = random.Random(0)
+    start = time.perf_counter()
+    (positions, analyses) = (0, 0)
+    while time.perf_counter() - start < seconds:
+        now = time.perf_counter()
+        if positions < (now - start) * position_rate:
+            io_thread.processor.read_time = now
+            io_thread.handle_commands({'set fen': fens[positions % len(fens)]})
+            positions += 1
+        while analyses < (now - start) * analysis_rate:
+            io_thread.handle_commands({'set analysis': [
+                {'pv': rng.choice(START_LEGAL_MOVES), 'score': rng.randrange(
+                    -300, 300)} for _ in range(3)]})
+            analyses += 1
+        app.processEvents()
+
+    main_window.close()
+    return (tracer.stats()['latency ms']['total'],
+            analysis_coalescer.applied['set_analysis'])
+
+
+@benchmark
+def analysis_overlay():
+    """Set fen latency with and without 500 analysis updates per second."""
+    seconds = 2
+    (without, _) = position_latency(0, seconds)
+    (with_analysis, applied) = position_latency(500, seconds)
+    results = {'analysis updates applied per second': applied / seconds}
+    for percentile in ('p50', 'p99'):
+        results[f'ms per position {percentile} (no analysis)'] = \
+            without[percentile]
+        results[f'ms per position {percentile} (with analysis)'] = \
+            with_analysis[percentile]
+    return results
+
+
+# Sends a file of commands to a Unix domain socket over and over, as fast as
+# the reader takes them, from a process of its own
+FEEDER = """
+import socket, sys
+payload = open(sys.argv[2], 'rb').read()
+client = socket.socket(socket.AF_UNIX)
+client.connect(sys.argv[1])
+try:
+    while True:
+        client.sendall(payload)
+except OSError:
+    pass
+"""
+
+
+def game_commands():
+    """
+    Plays through GAME_SAN from the starting position.
+
+    :return: Newline-delimited JSON commands setting every position and
+             move of the game, in order, as bytes
+    """
+    fen_parser = minae.FenParser()
+    position = minae.Position(*fen_parser.parse(minae.PgnFile.START_FEN))
+    commands = [{'set history': [], 'set fen': minae.PgnFile.START_FEN}]
+    for san in GAME_SAN:
+        position = position.make_move(position.san_move(san))
+        fields = ' '.join(position.game_state().values())
+        fen = f'{placement(position.populated_squares())} {fields}'
+        commands += [{'append history': [san], 'set fen': fen}]
+    return ''.join(json.dumps(command) + '\n' for command in commands).encode()
+
+
+def saturated_frame_times(worker_process, seconds=3):
+    """
+    Measures GUI frame times while a feeder saturates the command input.
+
+    :param worker_process: True to handle commands in a worker process,
+                           False on the GUI process's IO thread
+    :param seconds: Seconds to run for
+    :return: Dictionary of results
+    """
+    app = QApplication.instance()
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'minae.sock')
+    payload_path = os.path.join(directory, 'commands.jsonl')
+    with open(payload_path, 'wb') as payload:
+        payload.write(game_commands())
+
+    reader_options = {'stdin': False, 'unix_path': path}
+    position_store = minae.PositionStore()
+    if worker_process:
+        # Minae forks before Qt starts; here the worker never touches Qt,
+        # so forking after is safe enough
+        worker = minae.WorkerIOThread.start_worker(
+            reader_options, movegen=True)
+        io_thread = minae.WorkerIOThread(*worker, None, position_store)
+    else:
+        io_thread = minae.IOThread(
+            minae.CommandReader(**reader_options), None, position_store,
+            movegen=True)
+    main_window = minae.MainWindow(position_store=position_store)
+    main_window.show()
+    coalescer = minae.UpdateCoalescer(main_window, max_fps=60)
+    io_thread.apply_updates_signal.connect(coalescer.apply_updates)
+    positions = []
+    connect_update(io_thread, 'set_position',
+                   lambda game_id, position: positions.append(None))
+    painted = []
+    main_window.board_view.painted_signal.connect(
+        lambda: painted.append(time.perf_counter()))
+    io_thread.start()
+
+    # The socket exists once the reader, in either process, is listening
+    while not os.path.exists(path):
+        time.sleep(0.01)
+    feeder = subprocess.Popen(
+        [sys.executable, '-c', FEEDER, path, payload_path])
+    longest_iteration = 0
+    last_iteration = time.perf_counter()
+    end = last_iteration + seconds
+    while last_iteration < end:
+        app.processEvents()
+        now = time.perf_counter()
+        longest_iteration = max(longest_iteration, now - last_iteration)
+        last_iteration = now
+
+    feeder.kill()
+    feeder.wait()
+    io_thread.stop()
+    main_window.close()
+    for name in os.listdir(directory):
+        os.unlink(os.path.join(directory, name))
+    os.rmdir(directory)
+
+    frame_times = sorted(
+        later - earlier for (earlier, later) in zip(painted, painted[1:]))
+    if not frame_times:
+        frame_times = [seconds]
+    return {
+        'frames': len(painted),
+        'positions delivered per second': len(positions) / seconds,
+        'ms per frame (p50)': 1000 * frame_times[len(frame_times) // 2],
+        'ms per frame (p99)':
+            1000 * frame_times[int(len(frame_times) * 0.99)],
+        'ms per frame (max)': 1000 * frame_times[-1],
+        'ms per event loop iteration (max)': 1000 * longest_iteration,
+    }
+
+
+@benchmark
+def worker_process():
+    """GUI frame times under saturating input, with and without a worker."""
+    results = {}
+    for (mode, worker) in (('io thread', False), ('worker process', True)):
+        for (metric, value) in saturated_frame_times(worker).items():
+            results[f'{metric} ({mode})'.replace(') (', ', ')] = value
+    return results
+
+
+# Starts Minae as minae.py would, then reports whether every board image
+# loaded and quits once the board is first painted
+STARTUP = """
+import sys
+sys.path.insert(0, sys.argv[1])
+import minae
+app = minae.Minae(minae.parse_options(['--no-stdin']))
+def painted():
+    renderers = minae.SvgRendererCache.renderers.values()
+    print(int(all(renderer.isValid() for renderer in renderers)), flush=True)
+    app.app.quit()
+app.main_window.board_view.painted_signal.connect(painted)
+app.start()
+"""
+
+
+class SnapshotCounter(QObject):
+    """Counts the snapshots reaching the GUI thread, then applies them."""
+
+    def __init__(self, main_window):
+        QObject.__init__(self)
+        self.main_window = main_window
+        self.deliveries = 0
+        self.done = False
+
+    @Slot(object)
+    def apply_updates(self, updates):
+        """Applies a snapshot. An empty one marks the end of the run."""
+        if not updates:
+            self.done = True
+            return
+        self.deliveries += 1
+        self.main_window.apply_updates(updates)
+
+
+def ply_updates(split, cycles=8, plies_per_second=200):
+    """
+    Measures the GUI work of plies sent as one command object each, with
+    'set fen', 'append history' and 'set legal moves', applied straight to
+    the main window.
+
+    :param split: True to deliver every update of a ply as a signal of its
+                  own, as before snapshots, False to deliver one snapshot
+    :param cycles: Number of times to play through GAME_SAN
+    :param plies_per_second: Rate the plies are sent at
+    :return: Dictionary of results
+    """
+    app = QApplication.instance()
+    main_window = minae.MainWindow()
+    counter = SnapshotCounter(main_window)
+    io_thread = minae.IOThread(None)
+    io_thread.apply_updates_signal.connect(counter.apply_updates)
+    if split:
+        def deliver(update, *args):
+            if update != 'apply_updates':
+                io_thread.emit_update(update, *args)
+                return
+            for single_update in args[0]:
+                io_thread.emit_update(update, (single_update,))
+        io_thread.processor.deliver = deliver
+
+    # The legal moves of each position, to tell whether a paint showed a
+    # position with the legal moves of another
+    fen_parser = minae.FenParser()
+    position = minae.Position(*fen_parser.parse(minae.PgnFile.START_FEN))
+    commands = [{'set history': [], 'set fen': minae.PgnFile.START_FEN}]
+    expected = {}
+    for san in GAME_SAN:
+        position = position.make_move(position.san_move(san))
+        masks = position.legal_move_masks().masks
+        fields = ' '.join(position.game_state().values())
+        board = placement(position.populated_squares())
+        expected[board] = masks
+        commands += [{
+            'set fen': f'{board} {fields}',
+            'append history': [san],
+            'set legal moves': [
+                minae.SQUARES[source] + minae.SQUARES[target]
+                for source in range(64) for target in range(64)
+                if masks[source] >> target & 1],
+        }]
+    commands = commands * cycles
+
+    paints = [0, 0]
+
+    def painted():
+        scene = main_window.board_view.scene
+        if counter.deliveries and scene.pieces:
+            paints[0] += 1
+            masks = expected.get(placement(scene.pieces))
+            paints[1] += masks is not None \
+                and scene.legal_moves.masks != masks
+    main_window.board_view.painted_signal.connect(painted)
+    app.processEvents()
+
+    def feed():
+        start = time.perf_counter()
+        for (n, command) in enumerate(commands):
+            delay = start + n / plies_per_second - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            io_thread.handle_commands(command)
+        io_thread.emit_update('apply_updates', ())
+
+    feeder = threading.Thread(target=feed)
+    cpu_start = time.thread_time()
+    feeder.start()
+    while not counter.done:
+        app.processEvents(QEventLoop.WaitForMoreEvents)
+    app.processEvents()
+    cpu_elapsed = time.thread_time() - cpu_start
+    feeder.join()
+
+    main_window.close()
+    plies = len(commands)
+    return {
+        'GUI passes per ply': counter.deliveries / plies,
+        'paints per ply': paints[0] / plies,
+        'torn paints': paints[1],
+        'GUI cpu ms per ply': 1000 * cpu_elapsed / plies,
+    }
+
+
+@benchmark
+def atomic_updates():
+    """GUI work per ply with one signal per update and one per snapshot."""
+    results = {}
+    for (mode, split) in (('per update', True), ('snapshot', False)):
+        for (metric, value) in ply_updates(split).items():
+            results[f'{metric} ({mode})'] = value
+    return results
+
+
+@benchmark
+def startup_to_first_paint():
+    """Time from process start, or main window creation, to first paint."""
+    app = QApplication.instance()
+    minae.SvgRendererCache.renderers.clear()
+    minae.PixmapCache.pixmaps.clear()
+
+    painted = []
+    start = time.perf_counter()
+    main_window = minae.MainWindow()
+    main_window.board_view.painted_signal.connect(
+        lambda: painted.append(time.perf_counter()))
+    while not painted:
+        app.processEvents()
+    main_window.close()
+
+    # Fresh processes, started from another directory than the module's
+    process_times = []
+    images_loaded = 1
+    package = os.path.dirname(os.path.abspath(minae.__file__))
+    with tempfile.TemporaryDirectory() as directory:
+        for _ in range(5):
+            process_start = time.perf_counter()
+            process = subprocess.Popen(
+                [sys.executable, '-c', STARTUP, package], cwd=directory,
+                stdout=subprocess.PIPE)
+            line = process.stdout.readline()
+            process_times += [time.perf_counter() - process_start]
+            images_loaded &= line.strip() == b'1'
+            process.stdout.close()
+            process.wait()
+
+    return {
+        'ms to first paint': 1000 * (painted[0] - start),
+        'ms from process start to first paint (median)':
+            1000 * sorted(process_times)[len(process_times) // 2],
+        'images loaded from another directory': int(images_loaded),
+    }
+
+
+def regex_pos_to_x_y(pos):
+    """The per-call regex lookup BoardScene used before its square tables."""
+    pos_match = re.compile(r'([a-h])([1-8])').match(pos)
+    if not pos_match or pos_match.group() != pos:
+        raise ValueError
+    x = minae.BoardScene.SQUARE_WIDTH * (ord(pos_match.group(1)) - ord('a'))
+    y = minae.BoardScene.BOARD_WIDTH \
+        - minae.BoardScene.SQUARE_WIDTH * int(pos_match.group(2))
+    return (x, y)
+
+
+def regex_is_light_square(pos):
+    """The per-call regex test BoardScene used before its square tables."""
+    pos_match = re.compile(r'([a-h])([1-8])').match(pos)
+    if not pos_match or pos_match.group() != pos:
+        raise ValueError
+    if pos_match.group(1) in 'aceg':
+        return int(pos_match.group(2)) % 2 == 0
+    else:
+        return int(pos_match.group(2)) % 2 == 1
+
+
+@benchmark
+def square_lookup():
+    """Square geometry lookups, per-call regex against the square tables."""
+    scene = minae.BoardScene()
+    squares = list(scene.square_x_y) * 1000
+
+    start = time.perf_counter()
+    for pos in squares:
+        regex_pos_to_x_y(pos)
+        regex_is_light_square(pos)
+    regex_elapsed = time.perf_counter() - start
+
+    square_x_y = scene.square_x_y
+    light_squares = scene.LIGHT_SQUARES
+    start = time.perf_counter()
+    for pos in squares:
+        square_x_y[pos]
+        pos in light_squares
+    table_elapsed = time.perf_counter() - start
+
+    return {
+        'lookups': len(squares),
+        'ns per lookup (regex)': 1e9 * regex_elapsed / len(squares),
+        'ns per lookup (table)': 1e9 * table_elapsed / len(squares),
+        'speedup': regex_elapsed / table_elapsed,
+    }
+
+
+def replay(path, realtime=False, max_fps=60):
+    """
+    Replays a session recorded by minae.py --record through the IO thread
+    and a monitor mode main window, as minae.py would run it.
+
+    :param path: Path of the recording
+    :param realtime: True to replay at the recorded pace, False to replay
+                     as fast as the IO thread takes commands
+    :param max_fps: Frame rate cap of the update coalescer
+    :return: Dictionary of results, with the final board, move history and
+             game state of each game
+    """
+    app = QApplication.instance()
+    tracer = minae.LatencyTracer(samples=1 << 20)
+    main_window = minae.MainWindow(tracer, monitor=True)
+    coalescer = minae.UpdateCoalescer(main_window, max_fps)
+    analysis_coalescer = minae.UpdateCoalescer(
+        main_window, max_fps=10, report_drops=False)
+    io_thread = minae.IOThread(
+        minae.CommandLogReader(path, realtime), tracer,
+        minae.PositionStore())
+    io_thread.apply_updates_signal.connect(coalescer.apply_updates)
+    io_thread.set_analysis_signal.connect(analysis_coalescer.set_analysis)
+
+    start = time.perf_counter()
+    io_thread.start()
+    while not io_thread.isFinished():
+        app.processEvents()
+    elapsed = time.perf_counter() - start
+
+    # Deliver what the IO thread queued last, then its final frame
+    app.processEvents()
+    while any(c.pending or c.timer.isActive()
+              for c in (coalescer, analysis_coalescer)):
+        app.processEvents()
+    app.processEvents()
+    io_thread.stop()
+
+    stats = tracer.stats()
+    latencies = tracer.latencies['total']
+    results = {
+        'commands': sum(stats['commands'].values()),
+        'seconds': elapsed,
+        'commands per second': sum(stats['commands'].values()) / elapsed,
+        'positions painted': len(latencies),
+        'positions dropped': stats['positions superseded'],
+        'updates dropped': sum(coalescer.dropped.values()),
+        # Painted more than a frame after the frame it was due in
+        'late frames': sum(latency > 2 / max_fps for latency in latencies),
+    }
+    for (percentile, latency) in \
+            stats['latency ms'].get('total', {}).items():
+        results[f'ms per position ({percentile})'] = latency
+
+    for game_id in sorted(main_window.board_grid.boards):
+        board = main_window.board(game_id)
+        history_model = main_window.history_models.get(game_id)
+        suffix = f' ({game_id})' if game_id else ''
+        results[f'board{suffix}'] = \
+            placement(board.pending_position or board.scene.pieces)
+        results[f'history{suffix}'] = ' '.join(
+            history_model.half_moves if history_model is not None else [])
+        results[f'game state{suffix}'] = ' '.join(
+            main_window.game_states.get(game_id, {}).values())
+    main_window.close()
+    return results
+
+
+def environment():
+    """
+    :return: Dictionary describing the versions and platform the results
+             were gathered on, with an empty 'benchmarks' dictionary
+    """
+    return {
+        'python': platform.python_version(),
+        'pyside2': PySide2.__version__,
+        'qt': qVersion(),
+        'platform': platform.platform(),
+        'benchmarks': {},
+    }
+
+
+def run(names):
+    """
+    Runs benchmarks.
+
+    :param names: List of benchmark names to run, or an empty list for all
+    :return: Dictionary of results, ready to be written as JSON
+    """
+    results = environment()
+    for function in BENCHMARKS:
+        if names and function.__name__ not in names:
+            continue
+        print(f'Running {function.__name__}', file=sys.stderr)
+        results['benchmarks'][function.__name__] = function()
+
+    # Linux reports the peak resident set size in KiB
+    results['benchmarks']['process'] = {
+        'peak RSS (KiB)': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    return results
+
+
+def compare(baseline, results, threshold):
+    """
+    Prints how results differ from a baseline.
+
+    :param baseline: Results of an earlier run
+    :param results: Results of this run
+    :param threshold: Relative change counted as a regression, e.g. 0.1
+    :return: Number of regressions found
+    """
+    regressions = 0
+    for (name, metrics) in results['benchmarks'].items():
+        for (metric, value) in metrics.items():
+            old_value = baseline['benchmarks'].get(name, {}).get(metric)
+            if isinstance(value, str):
+                # Final states of a replay must match exactly
+                if old_value is not None and value != old_value:
+                    regressions += 1
+                    print(f'{name}: {metric}: {old_value!r} -> {value!r} '
+                          f'REGRESSION')
+                continue
+            if any(fragment in metric for fragment in HIGHER_IS_BETTER):
+                sign = -1
+            elif any(fragment in metric for fragment in LOWER_IS_BETTER):
+                sign = 1
+            else:
+                continue
+            if not old_value:
+                print(f'{name}: {metric}: {value:.6g} (new)')
+                continue
+
+            change = (value - old_value) / abs(old_value)
+            regressed = sign * change > threshold
+            regressions += regressed
+            print(f'{name}: {metric}: {old_value:.6g} -> {value:.6g} '
+                  f'({change:+.1%}){" REGRESSION" if regressed else ""}')
+    return regressions
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        'names', nargs='*', metavar='name',
+        help='benchmarks to run (default: all)')
+    parser.add_argument(
+        '--output', metavar='FILE',
+        help='write the results to FILE instead of stdout')
+    parser.add_argument(
+        '--compare', metavar='FILE',
+        help='compare the results with an earlier run, exiting with status 1 '
+             'on regressions')
+    parser.add_argument(
+        '--threshold', type=float, default=0.1,
+        help='relative change counted as a regression (default: 0.1)')
+    parser.add_argument(
+        '--replay', metavar='FILE',
+        help='replay a session recorded with minae.py --record instead of '
+             'running benchmarks')
+    parser.add_argument(
+        '--realtime', action='store_true',
+        help='replay at the recorded pace instead of as fast as possible')
+    options = parser.parse_args(argv[1:])
+
+    app = QApplication()  # noqa: F841
+    if options.replay:
+        results = environment()
+        results['benchmarks']['replay'] = \
+            replay(options.replay, options.realtime)
+    else:
+        results = run(options.names)
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    elif not options.compare:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if options.compare:
+        with open(options.compare) as baseline:
+            if compare(json.load(baseline), results, options.threshold):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+
+    main(sys.argv)
@@ -17,99 +17,473 @@
 # You should have received a copy of the GNU General Public License
 # along with Minae Chess GUI.  If not, see <https://www.gnu.org/licenses/>.
 
+import argparse
+import array
+import itertools
 import json
+import math
+import mmap
+import multiprocessing
+import os
+import random
 import re
+import selectors
+import signal
+import socket
+import stat
+import struct
 import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
 
-from PySide2.QtCore import QPointF, Qt, QThread, Signal, Slot
-from PySide2.QtSvg import QGraphicsSvgItem
-from PySide2.QtWidgets import (QAction, QApplication, QDockWidget,
+from PySide2.QtCore import (QAbstractTableModel, QModelIndex, QObject,
+                            QPointF, QRectF, Qt, QThread, QTimer, Signal,
+                            Slot)
+from PySide2.QtGui import (QBrush, QColor, QKeySequence, QPainter,
+                           QPainterPath, QPen, QPixmap, QPolygonF)
+from PySide2.QtSvg import QSvgRenderer
+from PySide2.QtWidgets import (QAbstractItemView, QAction, QApplication,
+                               QDockWidget, QGraphicsItem, QGraphicsPathItem,
+                               QGraphicsPixmapItem, QGraphicsRectItem,
                                QGraphicsScene, QGraphicsSimpleTextItem,
-                               QGraphicsView, QMainWindow, QMenuBar,
-                               QStatusBar)
+                               QGraphicsView,
+                               QGridLayout, QGroupBox, QHeaderView,
+                               QMainWindow, QMenuBar, QScrollArea, QStatusBar,
+                               QTableView, QVBoxLayout, QWidget)
+
+# Squares in index order, from a1 (0) to h8 (63)
+SQUARES = [file + rank for rank in '12345678' for file in 'abcdefgh']
+SQUARE_INDICES = {pos: index for (index, pos) in enumerate(SQUARES)}
+
+# Board images ship next to this module, wherever it is started from
+GRAPHICS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'graphics')
+
+
+class SvgRendererCache:
+    """
+    A process-wide cache of SVG renderers, one per image file.
+
+    Items drawing the same image share its renderer, so each file is read
+    and parsed only once.
+    """
+
+    renderers = {}
+    hits = 0
+    misses = 0
+
+    @classmethod
+    def renderer(cls, path):
+        """
+        Returns the shared renderer for an SVG file, loading it on first use.
+
+        :param path: Path to the SVG file
+        :return: QSvgRenderer for the file
+        """
+        renderer = cls.renderers.get(path)
+        if renderer is None:
+            cls.misses += 1
+            renderer = QSvgRenderer(path)
+            cls.renderers[path] = renderer
+        else:
+            cls.hits += 1
+        return renderer
+
+    @classmethod
+    def stats(cls):
+        """
+        Returns the cache counters.
+
+        :return: Dictionary in format {'hits':int, 'misses':int,
+                 'renderers':int}
+        """
+        return {
+            'hits': cls.hits,
+            'misses': cls.misses,
+            'renderers': len(cls.renderers),
+        }
+
+
+class PixmapCache:
+    """
+    A process-wide cache of board images rasterized at the size they are
+    shown at, so painting only ever draws pixmaps rather than vectors.
+
+    Images are kept per size and device pixel ratio. Resizing a board
+    rasterizes its images afresh, so the least recently used are evicted.
+    """
+
+    pixmaps = OrderedDict()
+    max_pixmaps = 128
+    hits = 0
+    misses = 0
+
+    @classmethod
+    def pixmap(cls, path, size, device_pixel_ratio):
+        """
+        Returns an SVG image rasterized to a square, rasterizing it on first
+        use.
+
+        :param path: Path to the SVG file
+        :param size: Side of the square in device independent pixels
+        :param device_pixel_ratio: Device pixels per device independent pixel
+        :return: QPixmap with the given device pixel ratio
+        """
+        key = (path, size, device_pixel_ratio)
+        pixmap = cls.pixmaps.get(key)
+        if pixmap is not None:
+            cls.hits += 1
+            cls.pixmaps.move_to_end(key)
+            return pixmap
+
+        cls.misses += 1
+        pixels = max(1, round(size * device_pixel_ratio))
+        pixmap = QPixmap(pixels, pixels)
+        pixmap.fill(Qt.transparent)
+        painter = QPainter(pixmap)
+        SvgRendererCache.renderer(path).render(painter)
+        painter.end()
+        pixmap.setDevicePixelRatio(device_pixel_ratio)
+
+        cls.pixmaps[key] = pixmap
+        if len(cls.pixmaps) > cls.max_pixmaps:
+            cls.pixmaps.popitem(last=False)
+        return pixmap
+
+    @classmethod
+    def stats(cls):
+        """
+        Returns the cache counters.
+
+        :return: Dictionary in format {'hits':int, 'misses':int,
+                 'pixmaps':int}
+        """
+        return {
+            'hits': cls.hits,
+            'misses': cls.misses,
+            'pixmaps': len(cls.pixmaps),
+        }
+
+
+class LegalMoves:
+    """
+    The legal moves of a position, held as one 64 bit mask of target
+    squares for each source square.
+
+    Bit n of a mask stands for the square with index n in SQUARES.
+    """
+
+    def __init__(self, masks=None):
+        """
+        :param masks: List of 64 target square masks, indexed by source
+                      square, or None for no legal moves
+        """
+        self.masks = masks if masks is not None else [0] * 64
+
+    @staticmethod
+    def square_mask(squares):
+        """
+        Returns the mask of a set of squares, e.g. for
+        BoardScene.highlight_squares().
+
+        :param squares: Iterable of squares in algebraic notation, e.g.
+                        ['e2', 'e4']
+        :return: 64 bit mask of the squares
+        """
+        return sum(1 << SQUARE_INDICES[pos] for pos in set(squares))
+
+    def __contains__(self, pos):
+        """Checks whether a square has any legal moves from it."""
+        return self.masks[SQUARE_INDICES[pos]] != 0
+
+    def targets(self, pos):
+        """
+        Returns the legal targets of a square.
+
+        :param pos: Source square in algebraic notation, e.g. 'e2'
+        :return: List of target squares in algebraic notation
+        """
+        mask = self.masks[SQUARE_INDICES[pos]]
+        return [SQUARES[index] for index in range(64) if mask >> index & 1]
+
+
+class Analysis:
+    """
+    Engine analysis of a position: the first move of each principal
+    variation, best first, and the evaluation of the best one.
+
+    Evaluations are from white's point of view.
+    """
+
+    # Centipawns beyond which the eval bar is full
+    SCORE_LIMIT = 10000
+
+    def __init__(self, arrows=(), score=None, mate=None):
+        """
+        :param arrows: List of moves as (source, target) square indices
+        :param score: Evaluation in centipawns, or None
+        :param mate: Moves to mate, negative when black mates, or None
+        """
+        self.arrows = list(arrows)
+        self.score = score
+        self.mate = mate
+
+    def white_share(self):
+        """
+        Returns the share of the eval bar that is white's.
+
+        :return: Float from 0 to 1, or None if there is no evaluation
+        """
+        if self.mate is not None:
+            return 1.0 if self.mate > 0 else 0.0
+        if self.score is None:
+            return None
+        score = max(-self.SCORE_LIMIT, min(self.score, self.SCORE_LIMIT))
+        return 1 / (1 + math.exp(-score / 250))
+
+    def evaluation_text(self):
+        """Returns the evaluation as text, e.g. '+0.35' or '#-3'."""
+        if self.mate is not None:
+            return f'#{self.mate}'
+        if self.score is None:
+            return ''
+        return f'{self.score / 100:+.2f}'
 
 
 class BoardScene(QGraphicsScene):
-    """A chess board scene."""
+    """
+    A chess board scene.
+
+    The scene is laid out in fixed logical units, SQUARE_WIDTH per square,
+    whatever size it is shown at. Its images are pixmaps from PixmapCache,
+    rasterized for the size set by set_render_size() and scaled back to
+    logical units.
+    """
+
+    # Emits moves made on the board, in format 'e2e4'
+    move_signal = Signal(str)
 
     SQUARE_WIDTH = 45
     BOARD_WIDTH = SQUARE_WIDTH * 8
 
-    IMAGES = {
-        'P': 'graphics/white-pawn.svg',
-        'R': 'graphics/white-rook.svg',
-        'N': 'graphics/white-knight.svg',
-        'B': 'graphics/white-bishop.svg',
-        'Q': 'graphics/white-queen.svg',
-        'K': 'graphics/white-king.svg',
-        'p': 'graphics/black-pawn.svg',
-        'r': 'graphics/black-rook.svg',
-        'n': 'graphics/black-knight.svg',
-        'b': 'graphics/black-bishop.svg',
-        'q': 'graphics/black-queen.svg',
-        'k': 'graphics/black-king.svg',
-        'l': 'graphics/light.svg',
-        'd': 'graphics/dark.svg',
-        'h': 'graphics/highlight.svg',
-    }
+    IMAGES = {key: os.path.join(GRAPHICS_DIR, name) for (key, name) in {
+        'P': 'white-pawn.svg',
+        'R': 'white-rook.svg',
+        'N': 'white-knight.svg',
+        'B': 'white-bishop.svg',
+        'Q': 'white-queen.svg',
+        'K': 'white-king.svg',
+        'p': 'black-pawn.svg',
+        'r': 'black-rook.svg',
+        'n': 'black-knight.svg',
+        'b': 'black-bishop.svg',
+        'q': 'black-queen.svg',
+        'k': 'black-king.svg',
+        'l': 'light.svg',
+        'd': 'dark.svg',
+        'h': 'highlight.svg',
+    }.items()}
+
+    # Stacking order of the board layers
+    SQUARE_Z = 0
+    PIECE_Z = 1
+    HIGHLIGHT_Z = 2
+    ARROW_Z = 3
+    SNAPSHOT_Z = 4
+
+    # Arrows for the best principal variations, strongest first
+    ARROW_ALPHAS = (200, 150, 120, 100, 80)
+    EVAL_BAR_WIDTH = 6
+
+    # Item data role holding the IMAGES key of an image item
+    IMAGE_KEY = 0
+
+    # Square colors do not depend on the board orientation
+    LIGHT_SQUARES = frozenset(
+        file + rank
+        for (file_index, file) in enumerate('abcdefgh')
+        for (rank_index, rank) in enumerate('12345678')
+        if (file_index + rank_index) % 2 == 1)
 
     def __init__(self):
         QGraphicsScene.__init__(self)
+        self.setSceneRect(0, 0, self.BOARD_WIDTH, self.BOARD_WIDTH)
+        self.render_size = (self.SQUARE_WIDTH, 1.0)
+        self.geometry = {
+            False: self.__build_geometry(False),
+            True: self.__build_geometry(True),
+        }
+        (self.square_x_y, self.square_grid) = self.geometry[False]
         self.__add_squares()
-        self.piece_items = []
-        self.highlighted_square_items = []
-        self.legal_moves = {}
-        self.selected_pos = None
+        self.__add_highlights()
+        self.flipped = False
+        self.__add_overlay()
+        self.snapshot_item = QGraphicsPixmapItem()
+        self.snapshot_item.setZValue(self.SNAPSHOT_Z)
+        self.snapshot_item.setVisible(False)
+        self.addItem(self.snapshot_item)
+        self.pieces = {}
+        self.piece_items = {}
+        self.piece_items_created = 0
+        self.highlighted_squares = 0
+        self.legal_moves = LegalMoves()
+        self.selected_square = None
 
     def __add_squares(self):
         """Adds initial squares to the board view."""
-        for file in 'abcdefgh':
-            for rank in '12345678':
-                (x, y) = self.__pos_to_x_y(file + rank)
-                square = QGraphicsSvgItem(
-                    self.IMAGES['l'] if self.__is_light_square(file + rank)
-                    else self.IMAGES['d'])
-                square.setPos(x, y)
-                self.addItem(square)
+        for (pos, (x, y)) in self.square_x_y.items():
+            square = self.__new_image_item(
+                'l' if pos in self.LIGHT_SQUARES else 'd')
+            square.setPos(x, y)
+            square.setZValue(self.SQUARE_Z)
+            self.addItem(square)
+
+    def __add_highlights(self):
+        """
+        Adds a hidden highlight item over every square, so highlighting
+        only ever toggles visibility.
+        """
+        self.highlight_items = []
+        for pos in SQUARES:
+            item = self.__new_image_item('h')
+            item.setPos(*self.square_x_y[pos])
+            item.setZValue(self.HIGHLIGHT_Z)
+            item.setVisible(False)
+            self.addItem(item)
+            self.highlight_items += [item]
 
-    def __is_light_square(self, pos):
+    def __add_overlay(self):
         """
-        Determines if a square position is light or dark.
+        Adds a hidden pool of analysis arrows and an eval bar, so analysis
+        updates only ever reshape, show and hide them.
+        """
+        self.arrows = []
+        self.arrow_items = []
+        for alpha in self.ARROW_ALPHAS:
+            item = QGraphicsPathItem()
+            item.setPen(QPen(Qt.NoPen))
+            item.setBrush(QBrush(QColor(0, 128, 255, alpha)))
+            item.setZValue(self.ARROW_Z)
+            item.setVisible(False)
+            # Reshaping or resizing an arrow rasterizes it once, after which
+            # repaints draw the cached pixels
+            item.setCacheMode(QGraphicsItem.DeviceCoordinateCache)
+            self.addItem(item)
+            self.arrow_items += [item]
 
-        This method should only be called on a valid position.
+        self.eval_bar_item = QGraphicsRectItem(
+            0, 0, self.EVAL_BAR_WIDTH, self.BOARD_WIDTH)
+        self.eval_bar_item.setPen(QPen(Qt.NoPen))
+        self.eval_bar_item.setBrush(QBrush(QColor(40, 40, 40)))
+        self.eval_bar_item.setZValue(self.ARROW_Z)
+        self.eval_bar_item.setVisible(False)
+        self.eval_bar_item.setCacheMode(QGraphicsItem.DeviceCoordinateCache)
+        self.white_share_item = QGraphicsRectItem(self.eval_bar_item)
+        self.white_share_item.setPen(QPen(Qt.NoPen))
+        self.white_share_item.setBrush(QBrush(QColor(240, 240, 240)))
+        self.addItem(self.eval_bar_item)
+        self.analysis = Analysis()
 
-        :param pos: Square position in algebraic notation, e.g. 'e2'
-        :return: True of square is light, false if square is dark
+    def __arrow_path(self, source, target):
         """
-        pos_match = re.compile(r'([a-h])([1-8])').match(pos)
-        if not pos_match or pos_match.group() != pos:
-            raise ValueError
+        Builds the outline of an arrow between the centres of two squares.
 
-        if pos_match.group(1) in 'aceg':
-            return int(pos_match.group(2)) % 2 == 0
-        else:
-            return int(pos_match.group(2)) % 2 == 1
+        :param source: Source square index
+        :param target: Target square index
+        :return: QPainterPath
+        """
+        half_square = self.SQUARE_WIDTH / 2
+        (x1, y1) = self.square_x_y[SQUARES[source]]
+        (x2, y2) = self.square_x_y[SQUARES[target]]
+        (x1, y1, x2, y2) = (x1 + half_square, y1 + half_square,
+                            x2 + half_square, y2 + half_square)
+        length = math.hypot(x2 - x1, y2 - y1)
+        if length == 0:
+            return QPainterPath()
+        (dx, dy) = ((x2 - x1) / length, (y2 - y1) / length)
+        # Normal to the arrow, scaled to its shaft and head half widths
+        (shaft_x, shaft_y) = (-dy * self.SQUARE_WIDTH * 0.1,
+                              dx * self.SQUARE_WIDTH * 0.1)
+        (head_x, head_y) = (shaft_x * 2.5, shaft_y * 2.5)
+        head_length = min(self.SQUARE_WIDTH * 0.45, length / 2)
+        (x3, y3) = (x2 - dx * head_length, y2 - dy * head_length)
+
+        path = QPainterPath()
+        path.addPolygon(QPolygonF([
+            QPointF(x1 + shaft_x, y1 + shaft_y),
+            QPointF(x3 + shaft_x, y3 + shaft_y),
+            QPointF(x3 + head_x, y3 + head_y),
+            QPointF(x2, y2),
+            QPointF(x3 - head_x, y3 - head_y),
+            QPointF(x3 - shaft_x, y3 - shaft_y),
+            QPointF(x1 - shaft_x, y1 - shaft_y),
+        ]))
+        path.closeSubpath()
+        return path
+
+    def __new_image_item(self, key):
+        """
+        Creates an item drawing one of the board images.
 
-    def __pos_to_x_y(self, pos):
+        :param key: Key into IMAGES, e.g. 'P'
+        :return: QGraphicsPixmapItem drawing the image at the render size
         """
-        Converts a square position in algebraic notation to a scene
-        coordinate position.
+        item = QGraphicsPixmapItem()
+        item.setTransformationMode(Qt.SmoothTransformation)
+        self.__set_image(item, key)
+        return item
 
-        This method should only be called on a valid position.
+    def __set_image(self, item, key):
+        """
+        Sets the image an item draws, rasterized for the render size.
+
+        :param item: QGraphicsPixmapItem
+        :param key: Key into IMAGES, e.g. 'P'
+        """
+        (size, device_pixel_ratio) = self.render_size
+        item.setData(self.IMAGE_KEY, key)
+        item.setPixmap(PixmapCache.pixmap(
+            self.IMAGES[key], size, device_pixel_ratio))
+        item.setScale(self.SQUARE_WIDTH / size)
+
+    def set_render_size(self, square_size, device_pixel_ratio):
+        """
+        Rasterizes the board images for the size the board is shown at.
 
-        :param pos: Square position in algebraic notation (e.g. 'e2')
-        :return: Tuple containing (x, y) coordinates for the position
+        :param square_size: Side of a square on screen, in device
+                            independent pixels
+        :param device_pixel_ratio: Device pixels per device independent pixel
         """
-        pos_match = re.compile(r'([a-h])([1-8])').match(pos)
-        if not pos_match or pos_match.group() != pos:
-            raise ValueError
+        if (square_size, device_pixel_ratio) == self.render_size:
+            return
+        self.render_size = (square_size, device_pixel_ratio)
+        for item in self.items():
+            key = item.data(self.IMAGE_KEY)
+            if key is not None:
+                self.__set_image(item, key)
 
-        x = self.SQUARE_WIDTH * (ord(pos_match.group(1)) - ord('a'))
-        y = self.BOARD_WIDTH \
-            - self.SQUARE_WIDTH \
-            * int(pos_match.group(2))
+    def __build_geometry(self, flipped):
+        """
+        Builds the lookup tables between square positions and scene
+        coordinates for one board orientation.
 
-        return (x, y)
+        :param flipped: True for the board seen from black's side
+        :return: Tuple containing a dictionary in format {pos:(x, y)}, e.g.
+                 {'a8':(0, 0), ...}, and a list of the 64 positions indexed
+                 by row * 8 + column of the scene grid
+        """
+        square_x_y = {}
+        square_grid = [None] * 64
+        for (file_index, file) in enumerate('abcdefgh'):
+            for (rank_index, rank) in enumerate('12345678'):
+                column = 7 - file_index if flipped else file_index
+                row = rank_index if flipped else 7 - rank_index
+                square_x_y[file + rank] = (self.SQUARE_WIDTH * column,
+                                           self.SQUARE_WIDTH * row)
+                square_grid[row * 8 + column] = file + rank
+        return (square_x_y, square_grid)
 
     def __x_y_to_pos(self, x, y):
         """
@@ -117,49 +491,145 @@ class BoardScene(QGraphicsScene):
 
         :param x: x coordinate (float)
         :param y: y coordinate (float)
-        :return: String of chess position
+        :return: String of chess position, or None if off the board
         """
-        file = chr(ord('a') + (int(x) // self.SQUARE_WIDTH))
-        rank = chr(ord('8') - (int(y) // self.SQUARE_WIDTH))
-        return file + rank
+        column = int(x // self.SQUARE_WIDTH)
+        row = int(y // self.SQUARE_WIDTH)
+        if not (0 <= column < 8 and 0 <= row < 8):
+            return None
+        return self.square_grid[row * 8 + column]
+
+    def set_flipped(self, flipped):
+        """See BoardView.set_flipped()."""
+        (self.square_x_y, self.square_grid) = self.geometry[flipped]
+        self.flipped = flipped
+        for (pos, item) in self.piece_items.items():
+            item.setPos(*self.square_x_y[pos])
+        for (pos, item) in zip(SQUARES, self.highlight_items):
+            item.setPos(*self.square_x_y[pos])
+        # Reshape every arrow for the new orientation
+        self.arrows = []
+        self.set_analysis(self.analysis)
 
     def set_position(self, populated_squares):
         """See BoardView.set_position()."""
-        for item in self.highlighted_square_items:
-            self.removeItem(item)
-        self.highlighted_square_items = []
+        self.highlight_squares(0)
+        # Arrows of the previous position would point from the wrong
+        # squares; the eval bar stays until the next analysis
+        if self.arrows:
+            self.set_analysis(Analysis(score=self.analysis.score,
+                                       mate=self.analysis.mate))
+
+        # Keep every item whose square still holds the same piece. Items on
+        # squares that changed are set aside so they can be moved to another
+        # square, preferably one that needs the same piece, instead of being
+        # torn down.
+        pieces = {}
+        piece_items = {}
+        spare_items = {}
+        for pos, item in self.piece_items.items():
+            piece = self.pieces[pos]
+            if populated_squares.get(pos) == piece:
+                pieces[pos] = piece
+                piece_items[pos] = item
+            else:
+                spare_items.setdefault(piece, []).append(item)
+
+        unplaced = []
+        for pos, piece in populated_squares.items():
+            if pos in piece_items:
+                continue
+            if spare_items.get(piece):
+                item = spare_items[piece].pop()
+                item.setPos(*self.square_x_y[pos])
+                pieces[pos] = piece
+                piece_items[pos] = item
+            else:
+                unplaced += [(pos, piece)]
+
+        # Squares needing a piece nobody vacated take any leftover item and
+        # switch its image, or a new item once the leftovers run out
+        leftover_items = [item for items in spare_items.values()
+                          for item in items]
+        for (pos, piece) in unplaced:
+            if leftover_items:
+                item = leftover_items.pop()
+                self.__set_image(item, piece)
+            else:
+                item = self.__new_image_item(piece)
+                item.setZValue(self.PIECE_Z)
+                self.addItem(item)
+                self.piece_items_created += 1
+            item.setPos(*self.square_x_y[pos])
+            pieces[pos] = piece
+            piece_items[pos] = item
 
-        for item in self.piece_items:
+        # Whatever was not reused has left the board
+        for item in leftover_items:
             self.removeItem(item)
-        self.piece_items = []
 
-        for pos in populated_squares:
-            (x, y) = self.__pos_to_x_y(pos)
-            piece = QGraphicsSvgItem(self.IMAGES[populated_squares[pos]])
-            piece.setPos(x, y)
-            self.addItem(piece)
-            self.piece_items += [piece]
+        self.pieces = pieces
+        self.piece_items = piece_items
 
     def set_legal_moves(self, legal_moves):
         """See BoardView.set_legal_moves()."""
         self.legal_moves = legal_moves
 
+    def set_analysis(self, analysis):
+        """See BoardView.set_analysis()."""
+        arrows = analysis.arrows[:len(self.arrow_items)]
+        for (rank, item) in enumerate(self.arrow_items):
+            if rank >= len(arrows):
+                item.setVisible(False)
+                continue
+            # Only arrows that changed are reshaped
+            if rank >= len(self.arrows) or self.arrows[rank] != arrows[rank]:
+                item.setPath(self.__arrow_path(*arrows[rank]))
+            item.setVisible(True)
+        self.arrows = arrows
+
+        white_share = analysis.white_share()
+        if white_share is None:
+            self.eval_bar_item.setVisible(False)
+        else:
+            # White's share grows from white's side of the board
+            height = self.BOARD_WIDTH * white_share
+            self.white_share_item.setRect(
+                0, 0 if self.flipped else self.BOARD_WIDTH - height,
+                self.EVAL_BAR_WIDTH, height)
+            self.eval_bar_item.setToolTip(analysis.evaluation_text())
+            self.eval_bar_item.setVisible(True)
+        self.analysis = analysis
+
+    def show_snapshot(self, pixmap):
+        """See BoardView.show_snapshot()."""
+        self.selected_square = None
+        self.highlight_squares(0)
+        self.snapshot_item.setPixmap(pixmap)
+        # Snapshots are rendered at the size of the view, not the scene
+        self.snapshot_item.setScale(
+            self.BOARD_WIDTH * pixmap.devicePixelRatio() / pixmap.width())
+        self.snapshot_item.setVisible(True)
+
+    def hide_snapshot(self):
+        """See BoardView.hide_snapshot()."""
+        self.snapshot_item.setVisible(False)
+
     def highlight_squares(self, squares):
         """
-        Highlighted a list of squares on the board.
+        Highlights a set of squares on the board.
 
-        :param squares: List of squares to highlight.
+        :param squares: 64 bit mask of the squares to highlight, with bit n
+                        standing for the square with index n in SQUARES
         """
-        for item in self.highlighted_square_items:
-            self.removeItem(item)
-        self.highlighted_square_items = []
-
-        for pos in squares:
-            (x, y) = self.__pos_to_x_y(pos)
-            highlighted_square_item = QGraphicsSvgItem(self.IMAGES['h'])
-            highlighted_square_item.setPos(x, y)
-            self.addItem(highlighted_square_item)
-            self.highlighted_square_items += [highlighted_square_item]
+        # Only squares whose highlight changed need touching
+        changed = squares ^ self.highlighted_squares
+        self.highlighted_squares = squares
+        while changed:
+            lowest_square = changed & -changed
+            changed ^= lowest_square
+            self.highlight_items[lowest_square.bit_length() - 1].setVisible(
+                bool(squares & lowest_square))
 
     def mousePressEvent(self, event):
         """
@@ -167,40 +637,106 @@ class BoardScene(QGraphicsScene):
 
         :param event: QGraphicsSceneMouseEvent
         """
-        pos = self.__x_y_to_pos(event.scenePos().x(), event.scenePos().y())
-
-        if self.selected_pos is not None:
-            if pos == self.selected_pos:
-                self.selected_pos = None
-                self.highlight_squares([])
-            elif pos in self.legal_moves[self.selected_pos]:
-                print(f'Moved from {self.selected_pos} to {pos}')
-                self.selected_pos = None
-                self.legal_moves = {}
-                self.highlight_squares([])
-            elif pos in self.legal_moves:
-                self.selected_pos = pos
-                self.highlight_squares(list(self.legal_moves[pos]) + [pos])
+        # Moves can only be made on the live position
+        if self.snapshot_item.isVisible():
+            return
+        square = SQUARE_INDICES.get(
+            self.__x_y_to_pos(event.scenePos().x(), event.scenePos().y()))
+        masks = self.legal_moves.masks
+
+        if self.selected_square is not None:
+            if square == self.selected_square:
+                self.selected_square = None
+                self.highlight_squares(0)
+            elif square is not None \
+                    and masks[self.selected_square] >> square & 1:
+                self.move_signal.emit(
+                    SQUARES[self.selected_square] + SQUARES[square])
+                self.selected_square = None
+                self.legal_moves = LegalMoves()
+                self.highlight_squares(0)
+            elif square is not None and masks[square]:
+                self.selected_square = square
+                self.highlight_squares(masks[square] | 1 << square)
             else:
-                self.selected_pos = None
-                self.highlight_squares([])
+                self.selected_square = None
+                self.highlight_squares(0)
 
-        elif pos in self.legal_moves:
-            self.selected_pos = pos
-            self.highlight_squares(list(self.legal_moves[pos]) + [pos])
+        elif square is not None and masks[square]:
+            self.selected_square = square
+            self.highlight_squares(masks[square] | 1 << square)
 
 
 class BoardView(QGraphicsView):
-    """A widget representing a graphical view of a chess board."""
+    """
+    A widget representing a graphical view of a chess board.
 
-    def __init__(self, parent):
+    The board scales to fit the widget. Its images are rasterized for the
+    size and device pixel ratio it is painted at.
+    """
+
+    MINIMUM_WIDTH = BoardScene.BOARD_WIDTH // 2
+
+    painted_signal = Signal()
+    focused_signal = Signal()
+
+    def __init__(self, parent, defer_hidden_updates=False):
+        """
+        :param parent: Parent widget
+        :param defer_hidden_updates: True to hold back positions set while
+                                     the board is scrolled out of sight,
+                                     and the analysis set after them,
+                                     until it is next painted
+        """
         QGraphicsView.__init__(self, parent)
-        self.setMinimumSize(BoardScene.BOARD_WIDTH, BoardScene.BOARD_WIDTH)
-        self.setMaximumSize(BoardScene.BOARD_WIDTH, BoardScene.BOARD_WIDTH)
+        self.setMinimumSize(self.MINIMUM_WIDTH, self.MINIMUM_WIDTH)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setRenderHint(QPainter.SmoothPixmapTransform)
         self.scene = BoardScene()
         self.setScene(self.scene)
+        self.defer_hidden_updates = defer_hidden_updates
+        self.pending_position = None
+        self.pending_analysis = None
         self.show()
 
+    def paintEvent(self, event):
+        """Paints the board, then notifies listeners that it was painted."""
+        if self.pending_position is not None:
+            # The position arrived while the board was out of sight, and
+            # is applied before the analysis that followed it, which it
+            # would otherwise clear
+            self.scene.set_position(self.pending_position)
+            self.pending_position = None
+            if self.pending_analysis is not None:
+                self.scene.set_analysis(self.pending_analysis)
+                self.pending_analysis = None
+        # Catches resizes and moves to a screen of another pixel ratio
+        self.scene.set_render_size(*self.render_size())
+        QGraphicsView.paintEvent(self, event)
+        self.painted_signal.emit()
+
+    def resizeEvent(self, event):
+        """Scales the board to fit the new size of the widget."""
+        QGraphicsView.resizeEvent(self, event)
+        self.fitInView(self.scene.sceneRect(), Qt.KeepAspectRatio)
+
+    def render_size(self):
+        """
+        Returns the size the board is shown at.
+
+        :return: Tuple containing the side of a square on screen, in device
+                 independent pixels, and the device pixel ratio
+        """
+        square_size = max(1, round(
+            BoardScene.SQUARE_WIDTH * self.transform().m11()))
+        return (square_size, self.devicePixelRatioF())
+
+    def focusInEvent(self, event):
+        """Notifies listeners that the board was focused, e.g. clicked."""
+        QGraphicsView.focusInEvent(self, event)
+        self.focused_signal.emit()
+
     def set_position(self, populated_squares):
         """
         Sets the board view to a new position. Discards any square highlights.
@@ -208,18 +744,178 @@ class BoardView(QGraphicsView):
         :param populated_squares: Dictionary of non-empty squares, in format
                                   {pos:piece}, e.g. {'e2':'P', ...}
         """
+        if self.defer_hidden_updates and self.visibleRegion().isEmpty():
+            self.pending_position = populated_squares
+            if self.pending_analysis is not None:
+                # Its arrows were for an earlier position
+                self.pending_analysis = Analysis(
+                    score=self.pending_analysis.score,
+                    mate=self.pending_analysis.mate)
+            return
+        self.pending_position = None
+        if self.pending_analysis is not None:
+            self.scene.set_analysis(self.pending_analysis)
+            self.pending_analysis = None
         self.scene.set_position(populated_squares)
 
+    def show_snapshot(self, pixmap):
+        """
+        Covers the board with a rendered snapshot of another position, e.g.
+        an earlier ply of the game. The live position keeps updating
+        underneath.
+
+        :param pixmap: QPixmap from BoardSnapshots
+        """
+        self.scene.show_snapshot(pixmap)
+
+    def hide_snapshot(self):
+        """Uncovers the live position."""
+        self.scene.hide_snapshot()
+
+    def set_flipped(self, flipped):
+        """
+        Sets the board orientation.
+
+        :param flipped: True to show the board from black's side, False to
+                        show it from white's side
+        """
+        self.scene.set_flipped(flipped)
+
     def set_legal_moves(self, legal_moves):
         """
         Sets the legals moves for the board position. This will determine
         which squares get highlighted as a result of mouse clicks.
 
-        :param legal_moves: Dictionary with entries in form
-                            {src0:[target0, target1, ...], src1[target0, ...],}
+        :param legal_moves: LegalMoves
         """
         self.scene.set_legal_moves(legal_moves)
 
+    def set_analysis(self, analysis):
+        """
+        Shows engine analysis over the board: an arrow for the first move of
+        each principal variation, and an eval bar along the edge.
+
+        :param analysis: Analysis
+        """
+        if self.pending_position is not None:
+            self.pending_analysis = analysis
+            return
+        self.scene.set_analysis(analysis)
+
+
+class BoardGrid(QScrollArea):
+    """
+    A scrollable grid of boards, one per game, for monitoring many games at
+    once.
+
+    Boards scrolled out of sight defer their position updates until they are
+    next painted.
+    """
+
+    COLUMNS = 4
+
+    game_selected_signal = Signal(str)
+
+    def __init__(self, parent):
+        QScrollArea.__init__(self, parent)
+        self.boards = {}
+        self.flipped = False
+        self.grid_widget = QWidget()
+        self.grid_layout = QGridLayout(self.grid_widget)
+        self.setWidget(self.grid_widget)
+        self.setWidgetResizable(True)
+
+    def add_board(self, game_id):
+        """
+        Adds a board for a game to the grid.
+
+        :param game_id: Game id, shown as the title of the board
+        :return: BoardView of the game
+        """
+        box = QGroupBox(game_id, self.grid_widget)
+        box_layout = QVBoxLayout(box)
+        board = BoardView(box, defer_hidden_updates=True)
+        board.set_flipped(self.flipped)
+        board.focused_signal.connect(
+            lambda: self.game_selected_signal.emit(game_id))
+        box_layout.addWidget(board)
+
+        index = len(self.boards)
+        self.grid_layout.addWidget(
+            box, index // self.COLUMNS, index % self.COLUMNS)
+        self.boards[game_id] = board
+        return board
+
+    @Slot(bool)
+    def set_flipped(self, flipped):
+        """See BoardView.set_flipped()."""
+        self.flipped = flipped
+        for board in self.boards.values():
+            board.set_flipped(flipped)
+
+
+class BoardSnapshots:
+    """
+    Renders board positions into pixmaps, keeping the most recently used
+    ones, so stepping through a game does not rebuild any scene items.
+
+    Positions are rendered on a board scene of their own, which is never
+    shown, at the size of the board they are shown on. A board rendered at
+    the default size takes about half a megabyte, and a large one on a HiDPI
+    screen many times that, so the cache is bounded by bytes and holds the
+    plies around the one being viewed rather than whole games.
+    """
+
+    def __init__(self, cache_bytes=64 << 20):
+        """
+        :param cache_bytes: Most bytes of rendered boards to keep
+        """
+        self.cache_bytes = cache_bytes
+        self.cached_bytes = 0
+        self.cache = OrderedDict()
+        self.scene = BoardScene()
+        self.hits = 0
+        self.misses = 0
+
+    def pixmap(self, key, populated_squares, flipped,
+               square_size=BoardScene.SQUARE_WIDTH, device_pixel_ratio=1.0):
+        """
+        Returns a rendered board, from the cache if possible.
+
+        :param key: Hash identifying the position, e.g. from PositionStore
+        :param populated_squares: Dictionary in format {pos:piece}
+        :param flipped: True for the board seen from black's side
+        :param square_size: See BoardScene.set_render_size()
+        :param device_pixel_ratio: See BoardScene.set_render_size()
+        :return: QPixmap of the board
+        """
+        cache_key = (key, flipped, square_size, device_pixel_ratio)
+        pixmap = self.cache.get(cache_key)
+        if pixmap is not None:
+            self.hits += 1
+            self.cache.move_to_end(cache_key)
+            return pixmap
+
+        self.misses += 1
+        self.scene.set_flipped(flipped)
+        self.scene.set_position(populated_squares)
+        self.scene.set_render_size(square_size, device_pixel_ratio)
+        board_size = square_size * 8
+        pixels = max(1, round(board_size * device_pixel_ratio))
+        pixmap = QPixmap(pixels, pixels)
+        pixmap.setDevicePixelRatio(device_pixel_ratio)
+        painter = QPainter(pixmap)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        self.scene.render(painter, QRectF(0, 0, board_size, board_size))
+        painter.end()
+
+        self.cache[cache_key] = pixmap
+        self.cached_bytes += pixels * pixels * 4
+        while self.cached_bytes > self.cache_bytes and len(self.cache) > 1:
+            (_, evicted) = self.cache.popitem(last=False)
+            self.cached_bytes -= evicted.width() * evicted.height() * 4
+        return pixmap
+
 
 class GameStateView(QGraphicsView):
     """A widget displaying a view of the chess game state."""
@@ -247,338 +943,3539 @@ class GameStateView(QGraphicsView):
         self.text_item.setText(text)
 
 
-class MoveHistoryView(QGraphicsView):
-    """A widget containing a view of the move history."""
+class StatsView(QGraphicsView):
+    """A widget displaying the statistics of a LatencyTracer."""
 
-    def __init__(self, parent):
+    REFRESH_INTERVAL = 1000
+
+    def __init__(self, parent, tracer):
         QGraphicsView.__init__(self, parent)
-        self.setMinimumWidth(180)
-        self.setMaximumWidth(180)
+        self.setMinimumSize(260, 200)
+        self.tracer = tracer
         self.scene = QGraphicsScene()
         self.setScene(self.scene)
         self.text_item = QGraphicsSimpleTextItem()
         self.scene.addItem(self.text_item)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(self.REFRESH_INTERVAL)
         self.show()
 
-    def set_move_history(self, move_history):
-        """
-        Sets the move history according to a list of moves.
-
-        :param move_history: List of half moves
-        """
-        text = ''
-        half_move_number = 1
-        full_move_number = 1
-        for half_move in move_history:
-            if half_move_number % 2 == 1:
-                text += str(full_move_number) + '. ' + half_move
-                half_move_number += 1
-            else:
-                text += ' ' + half_move + '\n'
-                half_move_number += 1
-                full_move_number += 1
-
-        self.text_item.setText(text)
+    @Slot()
+    def refresh(self):
+        """Updates the view with the latest statistics, if it is visible."""
+        if self.isVisible():
+            self.text_item.setText(self.tracer.format_stats())
 
 
-class IOThread(QThread):
-    """Collects and validates input data, and updates views."""
+class MoveHistoryModel(QAbstractTableModel):
+    """
+    An append-only table model of the move history, with one row per full
+    move and one column per side.
 
-    FEN_REGEX = (
-        r'([PRNBQKprnbqk1-8]{1,8})/'  # Group 1:  Rank 8
-        r'([PRNBQKprnbqk1-8]{1,8})/'  # Group 2:  Rank 7
-        r'([PRNBQKprnbqk1-8]{1,8})/'  # Group 3:  Rank 6
-        r'([PRNBQKprnbqk1-8]{1,8})/'  # Group 4:  Rank 5
-        r'([PRNBQKprnbqk1-8]{1,8})/'  # Group 5:  Rank 4
-        r'([PRNBQKprnbqk1-8]{1,8})/'  # Group 6:  Rank 3
-        r'([PRNBQKprnbqk1-8]{1,8})/'  # Group 7:  Rank 2
-        r'([PRNBQKprnbqk1-8]{1,8}) '  # Group 8:  Rank 1
-        r'([wb]) '                    # Group 9:  Active color
-        r'(-|K?Q?k?q?) '              # Group 10: Castling availability
-        r'(-|([a-h])([1-8])) '        # Group 11: En passant target
-                                      # Group 12: En passant target, file
-                                      # Group 13: En passant target, rank
-        r'(0|[1-9][0-9]*) '           # Group 14: Half move clock (for draws)
-        r'([1-9][0-9]*)'              # Group 15: Full move number
-    )
+    Appending or undoing a half move only notifies views of the row it
+    touches, so the cost does not grow with the length of the game.
+    """
 
-    set_position_signal = Signal(dict)
-    set_legal_moves_signal = Signal(dict)
-    set_game_state_signal = Signal(dict)
-    set_move_history_signal = Signal(list)
-    quit_app_signal = Signal()
+    HEADERS = ('White', 'Black')
 
     def __init__(self):
-        QThread.__init__(self)
-        self.fen_parser = re.compile(self.FEN_REGEX)
-        self.move_history = []
-
-    def __is_minimally_valid_fen(self, fen_match):
-        """
-        Checks if a FEN is minimally valid, that is, valid enough to display.
-
-        This method does not necessarily determine whether the position is
-        fully legal.
-
-        :param fen_match Match object for the FEN
-        """
-        # For the ranks (groups 1-8), validate that:
-        # - There are never two numbers consecutively
-        # - The sum of pieces and empty squares adds to 8
-        for g in range(1, 9):
-            prev_was_number = False
-            sum_for_rank = 0
-            for c in fen_match.group(g):
-                if '1' <= c <= '8':
-                    # Number denotes empty square(s)
-                    if prev_was_number:
-                        return False
-                    sum_for_rank += int(c)
-                    prev_was_number = True
-                else:
-                    # Letter denotes a piece
-                    sum_for_rank += 1
-                    prev_was_number = False
-            if sum_for_rank != 8:
-                return False
-
-        # For the active color (group 9), no validation is
-        # needed beyond matching the regex.
+        QAbstractTableModel.__init__(self)
+        self.half_moves = []
 
-        # For castling availability (group 10), validate that it is not an
-        # empty string. The regex validates everything else.
-        if fen_match.group(10) == '':
-            return False
-
-        # For en passant target square (group 11, with file and rank
-        # separately as group 12 and 13), no validation is needed beyond
-        # matching the regex. The engine must make sure it is valid
-        # otherwise.
+    def rowCount(self, parent=QModelIndex()):
+        """Returns the number of full moves."""
+        if parent.isValid():
+            return 0
+        return (len(self.half_moves) + 1) // 2
 
-        # For half move clock (group 14), no additional validation is needed
-        # beyond matching the regex.
+    def columnCount(self, parent=QModelIndex()):
+        """Returns the number of sides."""
+        if parent.isValid():
+            return 0
+        return 2
 
-        # For the full move number (group 15), no additional validation is
-        # needed beyond matching the regex.
+    def data(self, index, role=Qt.DisplayRole):
+        """Returns the half move at a row and column."""
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        half_move_index = index.row() * 2 + index.column()
+        if half_move_index < len(self.half_moves):
+            return self.half_moves[half_move_index]
+        return None
 
-        return True
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        """Returns the side names and the full move numbers."""
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return str(section + 1) + '.'
 
-    def __fen_to_populated_squares(self, fen_match):
+    def set_move_history(self, move_history):
         """
-        Given a FEN Match object, returns a dictionary of populated squares.
+        Replaces the whole move history.
 
-        :param fen_match Match object for the FEN
-        :return: Dictionary in format {pos:piece}, e.g. {'e2':'P'}
+        :param move_history: List of half moves
         """
-        populated_squares = {}
-        for g in range(1, 9):
-            file = 'a'
-            rank = chr(ord('9') - g)
-            for c in fen_match.group(g):
-                if '1' <= c <= '8':
-                    # Empty square(s), so just increment the file
-                    file = chr(ord(file) + int(c))
-                else:
-                    # Populated square, so add the piece
-                    populated_squares[file + rank] = c
-                    file = chr(ord(file) + 1)
-        return populated_squares
+        self.beginResetModel()
+        self.half_moves = list(move_history)
+        self.endResetModel()
 
-    def run(self):
-        """Executes the IO thread."""
-        while True:
-            console_in = input('minae-chess-gui$ ')
-            try:
-                cmds = json.loads(console_in)
-            except json.JSONDecodeError as err:
-                print(err)
-                continue
+    def append_move_history(self, half_moves):
+        """
+        Appends half moves to the move history.
 
-            for cmd, val in cmds.items():
-
-                if cmd == 'set fen':
-                    fen_match = self.fen_parser.match(val)
-                    if fen_match \
-                            and fen_match.group() == val \
-                            and self.__is_minimally_valid_fen(fen_match):
-                        populated_squares = \
-                            self.__fen_to_populated_squares(fen_match)
-                        self.set_position_signal.emit(populated_squares)
-                        self.set_game_state_signal.emit({
-                            'Turn': fen_match.group(9),
-                            'Castling availability': fen_match.group(10),
-                            'En-passant target': fen_match.group(11),
-                            'Half move clock': fen_match.group(14),
-                            'Full move number': fen_match.group(15),
-                        })
-
-                elif cmd == 'append history':
-                    self.move_history += val
-                    self.set_move_history_signal.emit(self.move_history)
-
-                elif cmd == 'undo history':
-                    if len(self.move_history) > 0:
-                        self.move_history.pop()
-                        self.set_move_history_signal.emit(self.move_history)
-
-                elif cmd == 'set history':
-                    self.move_history = val
-                    self.set_move_history_signal.emit(self.move_history)
-
-                elif cmd == 'set legal moves':
-                    legal_moves = {}
-                    for move in val:
-                        move_match = re.compile(
-                            r'([a-h][1-8])([a-h][1-8])').match(move)
-                        if not move_match or move_match.group() != move:
-                            print(f'Unrecognized move: {move}')
-                            continue
-                        if move_match.group(1) in legal_moves:
-                            legal_moves[move_match.group(1)] \
-                                .add(move_match.group(2))
-                        else:
-                            legal_moves[move_match.group(1)] \
-                                = {move_match.group(2)}
-                    self.set_legal_moves_signal.emit(legal_moves)
-
-                elif cmd == 'quit':
-                    self.quit_app_signal.emit()
-                    return
+        :param half_moves: List of half moves
+        """
+        if not half_moves:
+            return
+        old_length = len(self.half_moves)
+        old_rows = self.rowCount()
+        new_rows = (old_length + len(half_moves) + 1) // 2
 
-                else:
-                    print('Error: Unrecognized command')
+        if new_rows > old_rows:
+            self.beginInsertRows(QModelIndex(), old_rows, new_rows - 1)
+        self.half_moves += half_moves
+        if new_rows > old_rows:
+            self.endInsertRows()
 
+        # The first half move may complete the last existing row
+        if old_length % 2 == 1:
+            index = self.index(old_rows - 1, 1)
+            self.dataChanged.emit(index, index)
 
+    def undo_move_history(self):
+        """Removes the last half move from the move history, if any."""
+        if not self.half_moves:
+            return
+        row = (len(self.half_moves) - 1) // 2
+        if len(self.half_moves) % 2 == 1:
+            # White's half move is alone on its row, so the row goes
+            self.beginRemoveRows(QModelIndex(), row, row)
+            self.half_moves.pop()
+            self.endRemoveRows()
+        else:
+            self.half_moves.pop()
+            index = self.index(row, 1)
+            self.dataChanged.emit(index, index)
 
-class MainWindow(QMainWindow):
 
-    """Main window for the application."""
-    def __init__(self):
-        QMainWindow.__init__(self)
+class MoveHistoryView(QTableView):
+    """A widget containing a view of the move history."""
 
-        # First initialize the underlying views
-        self.board_view = BoardView(self)
-        self.game_state_view = GameStateView(self)
-        self.move_history_view = MoveHistoryView(self)
+    ROW_HEIGHT = 20
 
-        # Next initialize the docks
-        self.game_state_dock = self.add_dock(
-            'GameState',
-            self.game_state_view,
-            hidden=True
-        )
-        self.move_history_dock = self.add_dock(
-            'Move History',
-            self.move_history_view,
-            hidden=True
-        )
+    # Emits the ply reached by the clicked half move, counting from 1
+    ply_selected_signal = Signal(int)
 
-        # Next initialize the menu and status bars
-        self.undo_action = QAction('Undo', self)
-        self.undo_action.setDisabled(True)
-        self.menu_bar = self.add_menu_bar({
-            'Minae': [
-                self.game_state_dock.toggleViewAction(),
-                self.move_history_dock.toggleViewAction(),
-                self.undo_action,
-            ],
-        })
-        self.status_bar = QStatusBar(self)
+    def __init__(self, parent, history_model=None):
+        """
+        :param parent: Parent widget
+        :param history_model: MoveHistoryModel to show, or None for a new
+                              empty one
+        """
+        QTableView.__init__(self, parent)
+        self.setMinimumWidth(180)
+        self.setMaximumWidth(180)
+        self.history_model = None
+        self.set_history_model(
+            history_model if history_model is not None
+            else MoveHistoryModel())
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.setShowGrid(False)
+        self.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
 
-        # Finally tie it all together
-        self.setCentralWidget(self.board_view)
-        self.addDockWidget(Qt.RightDockWidgetArea, self.game_state_dock)
-        self.addDockWidget(Qt.RightDockWidgetArea, self.move_history_dock)
-        self.setMenuBar(self.menu_bar)
-        self.setStatusBar(self.status_bar)
+        # Fixed row heights let the view lay out only the visible rows
+        # instead of measuring every move in the game
+        self.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.verticalHeader().setDefaultSectionSize(self.ROW_HEIGHT)
+        self.clicked.connect(self.__on_clicked)
         self.show()
 
-    def closeEvent(self, event):
-        """Handle closing of the main window."""
-        event.accept()
+    @Slot(QModelIndex)
+    def __on_clicked(self, index):
+        """Emits the ply of a clicked half move."""
+        ply = index.row() * 2 + index.column() + 1
+        if ply <= len(self.history_model.half_moves):
+            self.ply_selected_signal.emit(ply)
 
-    @Slot(dict)
-    def set_position(self, populated_squares):
+    def select_ply(self, ply):
         """
-        Sets to a new chess position.
+        Selects the half move reaching a ply, or nothing for ply 0.
 
-        :param populated_squares: Dictionary of non-empty squares, in format
-                                  {pos:piece}, e.g. {'e2':'P', ...}
+        :param ply: Ply, counting from 0 for the position before any moves
         """
-        self.board_view.set_position(populated_squares)
+        if ply == 0:
+            self.clearSelection()
+            return
+        index = self.history_model.index((ply - 1) // 2, (ply - 1) % 2)
+        self.setCurrentIndex(index)
+        self.scrollTo(index)
 
-    @Slot(dict)
-    def set_legal_moves(self, legal_moves):
+    def set_history_model(self, history_model):
         """
-        Sets the legals moves.
+        Switches the view to another move history, e.g. of another game.
 
-        :param legal_moves: Dictionary with entries in form
-            {src0:[target0, target1, ...], src1:[target0, ...],}
+        :param history_model: MoveHistoryModel
         """
-        self.board_view.set_legal_moves(legal_moves)
+        self.history_model = history_model
+        self.setModel(history_model)
+        self.scrollToBottom()
 
-    @Slot(dict)
-    def set_game_state(self, game_state):
+    def set_move_history(self, move_history):
         """
-        Sets the game state.
+        Sets the move history according to a list of moves.
 
-        :param game_state: Dictionary containing {topic:value} pairs
+        :param move_history: List of half moves
         """
-        self.game_state_view.set_game_state(game_state)
+        self.history_model.set_move_history(move_history)
+        self.scrollToBottom()
 
-    @Slot(list)
-    def set_move_history(self, move_history):
+    def append_move_history(self, half_moves):
         """
-        Sets the move history.
+        Appends half moves to the move history.
 
-        :param move_history: List of half moves
+        :param half_moves: List of half moves
         """
-        self.move_history_view.set_move_history(move_history)
+        self.history_model.append_move_history(half_moves)
+        self.scrollToBottom()
 
-    def add_dock(self, title, widget, hidden=True):
-        """Adds the move history dock to the main window."""
-        dock = QDockWidget(title, self)
-        dock.setWidget(widget)
-        if hidden:
-            dock.hide()
-        return dock
+    def undo_move_history(self):
+        """Removes the last half move from the move history, if any."""
+        self.history_model.undo_move_history()
 
-    def add_menu_bar(self, menus):
-        """Adds the menu bar to the main window."""
-        menu_bar = QMenuBar(self)
-        for menu, actions in menus.items():
-            menu = menu_bar.addMenu(menu)
-            for action in actions:
-                menu.addAction(action)
-        return menu_bar
 
+class FenParser:
+    """
+    Parses FEN strings into board positions and game states.
 
-class Minae:
+    Analysis feeds repeat the same positions heavily, so parsed piece
+    placements are kept in a bounded least recently used cache.
+    """
+
+    PIECES = frozenset('PRNBQKprnbqk')
+    EMPTY_SQUARES = {str(n): n for n in range(1, 9)}
+
+    # Castling availability is '-' or a non-empty subsequence of 'KQkq'
+    CASTLING = frozenset(
+        ['-'] + [''.join(rights)
+                 for n in range(1, 5)
+                 for rights in itertools.combinations('KQkq', n)])
+
+    EN_PASSANT = frozenset(
+        ['-'] + [file + rank for file in 'abcdefgh' for rank in '12345678'])
+
+    def __init__(self, cache_size=4096):
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def parse(self, fen):
+        """
+        Validates and parses a FEN in a single pass.
+
+        The FEN is validated as minimally valid, that is, valid enough to
+        display. This does not necessarily determine whether the position is
+        fully legal.
+
+        :param fen: FEN string
+        :return: Tuple containing a dictionary of populated squares in format
+                 {pos:piece}, e.g. {'e2':'P'}, and a game state dictionary
+                 containing {topic:value} pairs. The populated squares are
+                 shared with the cache and must not be modified.
+        :raises ValueError: If the FEN is invalid, naming the field at fault
+        """
+        if not isinstance(fen, str):
+            raise ValueError('FEN must be a string')
+
+        fields = fen.split(' ')
+        if len(fields) != 6:
+            raise ValueError(f'expected 6 fields, found {len(fields)}')
+        (placement, color, castling, en_passant, half_move_clock,
+         full_move_number) = fields
+
+        populated_squares = self.__parse_placement(placement)
+
+        if color != 'w' and color != 'b':
+            raise ValueError(f'active color must be w or b, not {color!r}')
+        if castling not in self.CASTLING:
+            raise ValueError(
+                f'castling availability must be - or a subset of KQkq in '
+                f'that order, not {castling!r}')
+        if en_passant not in self.EN_PASSANT:
+            raise ValueError(
+                f'en passant target must be - or a square, '
+                f'not {en_passant!r}')
+        if not self.__is_number(half_move_clock, allow_zero=True):
+            raise ValueError(
+                f'half move clock must be a number, not {half_move_clock!r}')
+        if not self.__is_number(full_move_number, allow_zero=False):
+            raise ValueError(
+                f'full move number must be a positive number, '
+                f'not {full_move_number!r}')
+
+        return (populated_squares, {
+            'Turn': color,
+            'Castling availability': castling,
+            'En-passant target': en_passant,
+            'Half move clock': half_move_clock,
+            'Full move number': full_move_number,
+        })
+
+    def __parse_placement(self, placement):
+        """
+        Validates and parses the piece placement field of a FEN, using the
+        cache when possible.
+
+        :param placement: Piece placement field, e.g. 'rnbqkbnr/pppppppp/...'
+        :return: Dictionary in format {pos:piece}, e.g. {'e2':'P'}
+        :raises ValueError: If the piece placement is invalid
+        """
+        populated_squares = self.cache.get(placement)
+        if populated_squares is not None:
+            self.hits += 1
+            self.cache.move_to_end(placement)
+            return populated_squares
+        self.misses += 1
+
+        ranks = placement.split('/')
+        if len(ranks) != 8:
+            raise ValueError(
+                f'piece placement must have 8 ranks, found {len(ranks)}')
+
+        populated_squares = {}
+        for (rank, rank_text) in zip('87654321', ranks):
+            file_index = 0
+            prev_was_number = False
+            for c in rank_text:
+                if c in self.EMPTY_SQUARES:
+                    # Number denotes empty square(s)
+                    if prev_was_number:
+                        raise ValueError(
+                            f'rank {rank} has two consecutive numbers')
+                    file_index += self.EMPTY_SQUARES[c]
+                    prev_was_number = True
+                elif c in self.PIECES:
+                    # Letter denotes a piece
+                    if file_index >= 8:
+                        raise ValueError(
+                            f'rank {rank} has more than 8 squares')
+                    populated_squares['abcdefgh'[file_index] + rank] = c
+                    file_index += 1
+                    prev_was_number = False
+                else:
+                    raise ValueError(
+                        f'rank {rank} has unrecognized character {c!r}')
+            if file_index != 8:
+                raise ValueError(
+                    f'rank {rank} has {file_index} squares instead of 8')
+
+        if self.cache_size > 0:
+            self.cache[placement] = populated_squares
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        return populated_squares
+
+    @staticmethod
+    def __is_number(text, allow_zero):
+        """
+        Checks that a FEN field is a decimal number without leading zeros.
+
+        :param text: Field text
+        :param allow_zero: True if '0' is acceptable
+        :return: True if the field is a valid number
+        """
+        if not (text.isascii() and text.isdigit()):
+            return False
+        if text[0] == '0':
+            return allow_zero and text == '0'
+        return True
+
+
+# Source of the random keys for hashing positions, seeded so hashes are
+# stable between runs
+ZOBRIST_RANDOM = random.Random(0x5eed)
+
+
+class PositionStore:
+    """
+    Remembers the position reached at every ply of every game, so that
+    earlier plies can be shown without the engine resending them.
+
+    Positions are keyed by a Zobrist hash, so a position repeated within a
+    game or across games is stored once, and is forgotten once no ply
+    refers to it. The store is written by the IO thread and read by the GUI
+    thread.
+    """
+
+    # Random keys per piece on a square, side to move, castling right and
+    # en-passant file
+    PIECE_KEYS = {(piece, pos): ZOBRIST_RANDOM.getrandbits(64)
+                  for piece in 'PRNBQKprnbqk' for pos in SQUARES}
+    BLACK_TO_MOVE_KEY = ZOBRIST_RANDOM.getrandbits(64)
+    CASTLING_KEYS = {right: ZOBRIST_RANDOM.getrandbits(64)
+                     for right in 'KQkq'}
+    EN_PASSANT_KEYS = {file: ZOBRIST_RANDOM.getrandbits(64)
+                       for file in 'abcdefgh'}
+
+    def __init__(self, max_plies=None):
+        """
+        :param max_plies: Number of most recent plies of each game to keep
+                          positions for, or None to keep every ply
+        """
+        self.lock = threading.Lock()
+        self.max_plies = max_plies
+        self.positions = {}
+        self.references = {}
+        self.plies = {}
+        self.first_plies = {}
+
+    def __release(self, entries):
+        """
+        Drops the references of forgotten plies to their positions, and
+        forgets positions no ply refers to any more.
+
+        :param entries: Ply entries, each (key, game_state) or None
+        """
+        for entry in entries:
+            if entry is None:
+                continue
+            key = entry[0]
+            self.references[key] -= 1
+            if not self.references[key]:
+                del self.references[key]
+                del self.positions[key]
+
+    @classmethod
+    def zobrist_hash(cls, populated_squares, game_state):
+        """
+        Hashes a position.
+
+        :param populated_squares: Dictionary in format {pos:piece}
+        :param game_state: Dictionary containing {topic:value} pairs
+        :return: 64 bit hash
+        """
+        key = 0
+        for pos_piece in populated_squares.items():
+            key ^= cls.PIECE_KEYS[pos_piece[::-1]]
+        if game_state.get('Turn') == 'b':
+            key ^= cls.BLACK_TO_MOVE_KEY
+        for right in game_state.get('Castling availability', '-'):
+            key ^= cls.CASTLING_KEYS.get(right, 0)
+        key ^= cls.EN_PASSANT_KEYS.get(
+            game_state.get('En-passant target', '-')[0], 0)
+        return key
+
+    def record(self, game_id, ply, populated_squares, game_state):
+        """
+        Records the position reached at a ply of a game. Any later plies are
+        forgotten, as the game has gone another way.
+
+        :param game_id: Game id
+        :param ply: Ply, counting from 0 for the position before any moves
+        :param populated_squares: Dictionary in format {pos:piece}
+        :param game_state: Dictionary containing {topic:value} pairs
+        """
+        key = self.zobrist_hash(populated_squares, game_state)
+        with self.lock:
+            self.positions.setdefault(key, populated_squares)
+            self.references[key] = self.references.get(key, 0) + 1
+            plies = self.plies.setdefault(game_id, [])
+            self.__release(plies[ply:])
+            del plies[ply:]
+            plies += [None] * (ply - len(plies)) + [(key, game_state)]
+
+            if self.max_plies is None:
+                return
+            # Plies fall out of the window from the front
+            first_ply = min(self.first_plies.get(game_id, 0), ply)
+            last_forgotten = len(plies) - self.max_plies
+            if last_forgotten > first_ply:
+                self.__release(plies[first_ply:last_forgotten])
+                plies[first_ply:last_forgotten] = \
+                    [None] * (last_forgotten - first_ply)
+                first_ply = last_forgotten
+            self.first_plies[game_id] = first_ply
+
+    def truncate(self, game_id, plies):
+        """
+        Forgets the positions of a game from a ply on.
+
+        :param game_id: Game id
+        :param plies: Number of plies to keep
+        """
+        with self.lock:
+            game_plies = self.plies.get(game_id, [])
+            self.__release(game_plies[plies:])
+            del game_plies[plies:]
+            if self.first_plies.get(game_id, 0) > plies:
+                self.first_plies[game_id] = plies
+
+    def position(self, game_id, ply):
+        """
+        Looks up the position reached at a ply of a game.
+
+        :param game_id: Game id
+        :param ply: Ply, counting from 0 for the position before any moves
+        :return: Tuple containing (key, populated_squares, game_state), or
+                 None if no position was recorded for the ply
+        """
+        with self.lock:
+            plies = self.plies.get(game_id, [])
+            if ply >= len(plies) or plies[ply] is None:
+                return None
+            (key, game_state) = plies[ply]
+            return (key, self.positions[key], game_state)
+
+
+def step_attacks(steps):
+    """
+    Builds a table of the squares one step away from each square.
+
+    :param steps: List of (file, rank) offsets, e.g. [(1, 2), (2, 1), ...]
+    :return: List of 64 bit masks, indexed by square
+    """
+    table = []
+    for square in range(64):
+        (file, rank) = (square % 8, square // 8)
+        mask = 0
+        for (file_step, rank_step) in steps:
+            if 0 <= file + file_step < 8 and 0 <= rank + rank_step < 8:
+                mask |= 1 << (square + file_step + 8 * rank_step)
+        table += [mask]
+    return table
+
+
+def ray_attacks(step):
+    """
+    Builds a table of the squares along a ray from each square, up to the
+    edge of the board.
+
+    :param step: (file, rank) offset of one step along the ray, e.g. (1, 1)
+    :return: List of 64 bit masks, indexed by square
+    """
+    (file_step, rank_step) = step
+    table = []
+    for square in range(64):
+        (file, rank) = (square % 8 + file_step, square // 8 + rank_step)
+        mask = 0
+        while 0 <= file < 8 and 0 <= rank < 8:
+            mask |= 1 << (rank * 8 + file)
+            (file, rank) = (file + file_step, rank + rank_step)
+        table += [mask]
+    return table
+
+
+class Position:
+    """
+    A chess position held as bitboards, i.e. one 64 bit mask per piece with
+    bit n standing for the square with index n in SQUARES, for generating
+    legal moves without the engine.
+
+    Knight, king and pawn attacks come from tables built once. Sliding
+    attacks come from rays, also built once, cut off at the first blocker.
+
+    Moves are tuples in format (source, target, promotion), with squares as
+    indices into SQUARES and the promotion piece as in FEN, or None.
+    """
+
+    KNIGHT_ATTACKS = step_attacks([(1, 2), (2, 1), (2, -1), (1, -2),
+                                   (-1, -2), (-2, -1), (-2, 1), (-1, 2)])
+    KING_ATTACKS = step_attacks([(1, 0), (1, 1), (0, 1), (-1, 1),
+                                 (-1, 0), (-1, -1), (0, -1), (1, -1)])
+    # Indexed by whether the pawn is white
+    PAWN_ATTACKS = {
+        True: step_attacks([(-1, 1), (1, 1)]),
+        False: step_attacks([(-1, -1), (1, -1)]),
+    }
+
+    # Rays, and whether they run towards higher square indices
+    BISHOP_RAYS = [(ray_attacks(step), step[1] > 0)
+                   for step in [(1, 1), (-1, 1), (1, -1), (-1, -1)]]
+    ROOK_RAYS = [(ray_attacks(step), step[1] > 0 or step[0] > 0)
+                 for step in [(1, 0), (0, 1), (-1, 0), (0, -1)]]
+
+    # Castling right: king source and target, rook source and target,
+    # squares that must be empty and squares the king must not be attacked
+    # on
+    CASTLING = {
+        'K': (4, 6, 7, 5, 0x60, (4, 5, 6)),
+        'Q': (4, 2, 0, 3, 0xe, (4, 3, 2)),
+        'k': (60, 62, 63, 61, 0x60 << 56, (60, 61, 62)),
+        'q': (60, 58, 56, 59, 0xe << 56, (60, 59, 58)),
+    }
+
+    # Castling rights lost by moving from or to a square
+    CASTLING_LOST = {4: 'KQ', 7: 'K', 0: 'Q', 60: 'kq', 63: 'k', 56: 'q'}
+
+    PROMOTIONS = {True: 'QRBN', False: 'qrbn'}
+
+    SAN = re.compile(
+        r'([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?[+#!?]*')
+    CASTLING_SAN = {'O-O': 2, 'O-O-O': -2, '0-0': 2, '0-0-0': -2}
+
+    def __init__(self, populated_squares, game_state):
+        """
+        :param populated_squares: Dictionary in format {pos:piece}, e.g. as
+                                  parsed by FenParser
+        :param game_state: Dictionary containing {topic:value} pairs, e.g.
+                           as parsed by FenParser
+        """
+        self.board = [None] * 64
+        self.bitboards = dict.fromkeys('PNBRQKpnbrqk', 0)
+        for (pos, piece) in populated_squares.items():
+            square = SQUARE_INDICES[pos]
+            self.board[square] = piece
+            self.bitboards[piece] |= 1 << square
+        self.white = game_state['Turn'] == 'w'
+        self.castling = game_state['Castling availability'].strip('-')
+        self.en_passant = SQUARE_INDICES.get(game_state['En-passant target'])
+        self.half_move_clock = int(game_state['Half move clock'])
+        self.full_move_number = int(game_state['Full move number'])
+
+    def populated_squares(self):
+        """
+        :return: Dictionary in format {pos:piece}, as parsed by FenParser
+        """
+        return {SQUARES[square]: piece
+                for (square, piece) in enumerate(self.board) if piece}
+
+    def game_state(self):
+        """
+        :return: Dictionary containing {topic:value} pairs, as parsed by
+                 FenParser
+        """
+        return {
+            'Turn': 'w' if self.white else 'b',
+            'Castling availability': self.castling or '-',
+            'En-passant target': '-' if self.en_passant is None
+            else SQUARES[self.en_passant],
+            'Half move clock': str(self.half_move_clock),
+            'Full move number': str(self.full_move_number),
+        }
+
+    def __sides(self):
+        """Returns masks of the squares of the side to move and the other."""
+        (white, black) = (0, 0)
+        for (piece, bitboard) in self.bitboards.items():
+            if piece.isupper():
+                white |= bitboard
+            else:
+                black |= bitboard
+        return (white, black) if self.white else (black, white)
+
+    @staticmethod
+    def __slide(square, occupied, rays):
+        """
+        Looks up the attacks of a sliding piece.
+
+        :param square: Square of the piece
+        :param occupied: Mask of the occupied squares
+        :param rays: BISHOP_RAYS or ROOK_RAYS
+        :return: Mask of the attacked squares
+        """
+        attacks = 0
+        for (ray_table, ascending) in rays:
+            ray = ray_table[square]
+            blockers = ray & occupied
+            if blockers:
+                if ascending:
+                    blocker = (blockers & -blockers).bit_length() - 1
+                else:
+                    blocker = blockers.bit_length() - 1
+                ray ^= ray_table[blocker]
+            attacks |= ray
+        return attacks
+
+    def is_attacked(self, square, by_white, occupied=None):
+        """
+        Checks whether a side attacks a square.
+
+        :param square: Square index
+        :param by_white: True to check white's attacks, False for black's
+        :param occupied: Mask of the occupied squares, if already known
+        :return: True if the square is attacked
+        """
+        bitboards = self.bitboards
+        (pawn, knight, bishop, rook, queen, king) = \
+            'PNBRQK' if by_white else 'pnbrqk'
+        if self.PAWN_ATTACKS[not by_white][square] & bitboards[pawn] \
+                or self.KNIGHT_ATTACKS[square] & bitboards[knight] \
+                or self.KING_ATTACKS[square] & bitboards[king]:
+            return True
+        if occupied is None:
+            occupied = sum(self.__sides())
+        queens = bitboards[queen]
+        return bool(
+            self.__slide(square, occupied, self.BISHOP_RAYS)
+            & (bitboards[bishop] | queens)
+            or self.__slide(square, occupied, self.ROOK_RAYS)
+            & (bitboards[rook] | queens))
+
+    def pseudo_legal_moves(self):
+        """
+        Generates the moves of the side to move, including those leaving its
+        king in check.
+
+        :return: List of moves
+        """
+        white = self.white
+        board = self.board
+        (own, other) = self.__sides()
+        occupied = own | other
+        moves = []
+
+        pieces = own
+        while pieces:
+            lowest = pieces & -pieces
+            pieces ^= lowest
+            source = lowest.bit_length() - 1
+            piece = board[source].upper()
+
+            if piece == 'P':
+                targets = self.PAWN_ATTACKS[white][source] & other
+                step = 8 if white else -8
+                # Only a pawn that has just made a double push can be
+                # captured en passant
+                if self.en_passant is not None \
+                        and 0 <= self.en_passant - step < 64 and board[
+                            self.en_passant - step] == ('p' if white else 'P'):
+                    targets |= self.PAWN_ATTACKS[white][source] \
+                        & 1 << self.en_passant
+                push = source + step
+                # Pawns on their last rank, e.g. in a malformed FEN, have
+                # nowhere to go
+                if 0 <= push < 64 and not occupied >> push & 1:
+                    targets |= 1 << push
+                    if source // 8 == (1 if white else 6) \
+                            and not occupied >> (push + step) & 1:
+                        targets |= 1 << (push + step)
+                if source // 8 == (6 if white else 1):
+                    while targets:
+                        lowest = targets & -targets
+                        targets ^= lowest
+                        moves += [(source, lowest.bit_length() - 1, promotion)
+                                  for promotion in self.PROMOTIONS[white]]
+                    continue
+            elif piece == 'N':
+                targets = self.KNIGHT_ATTACKS[source] & ~own
+            elif piece == 'B':
+                targets = self.__slide(source, occupied, self.BISHOP_RAYS) \
+                    & ~own
+            elif piece == 'R':
+                targets = self.__slide(source, occupied, self.ROOK_RAYS) \
+                    & ~own
+            elif piece == 'Q':
+                targets = (self.__slide(source, occupied, self.BISHOP_RAYS)
+                           | self.__slide(source, occupied, self.ROOK_RAYS)) \
+                    & ~own
+            else:
+                targets = self.KING_ATTACKS[source] & ~own
+
+            while targets:
+                lowest = targets & -targets
+                targets ^= lowest
+                moves += [(source, lowest.bit_length() - 1, None)]
+
+        (king, rook) = 'KR' if white else 'kr'
+        for right in self.castling:
+            if right.isupper() != white:
+                continue
+            (king_source, king_target, rook_source, _, empty, path) = \
+                self.CASTLING[right]
+            if board[king_source] == king and board[rook_source] == rook \
+                    and not occupied & empty \
+                    and not any(self.is_attacked(square, not white, occupied)
+                                for square in path):
+                moves += [(king_source, king_target, None)]
+        return moves
+
+    def legal_moves(self):
+        """
+        Generates the legal moves of the side to move.
+
+        :return: List of moves
+        """
+        moves = []
+        king = 'K' if self.white else 'k'
+        for move in self.pseudo_legal_moves():
+            position = self.make_move(move)
+            king_square = position.bitboards[king].bit_length() - 1
+            # Positions without a king only come from setups, so allow them
+            if king_square < 0 \
+                    or not position.is_attacked(king_square, not self.white):
+                moves += [move]
+        return moves
+
+    def legal_move_masks(self):
+        """
+        :return: LegalMoves of the side to move
+        """
+        masks = [0] * 64
+        for (source, target, _) in self.legal_moves():
+            masks[source] |= 1 << target
+        return LegalMoves(masks)
+
+    def make_move(self, move):
+        """
+        Makes a move, without checking that it is legal.
+
+        :param move: Move
+        :return: Position after the move
+        """
+        (source, target, promotion) = move
+        position = Position.__new__(Position)
+        board = position.board = list(self.board)
+        bitboards = position.bitboards = dict(self.bitboards)
+
+        piece = board[source]
+        captured = board[target]
+        placed = promotion or piece
+        bitboards[piece] ^= 1 << source
+        bitboards[placed] |= 1 << target
+        if captured:
+            bitboards[captured] ^= 1 << target
+        board[source] = None
+        board[target] = placed
+
+        moved = piece.upper()
+        if moved == 'P' and target == self.en_passant \
+                and (target - source) % 8 != 0:
+            # The captured pawn is beside the source, not on the target
+            square = target - 8 if self.white else target + 8
+            captured = board[square] if 0 <= square < 64 else None
+            if captured == ('p' if self.white else 'P'):
+                bitboards[captured] ^= 1 << square
+                board[square] = None
+        elif moved == 'K' and abs(target - source) == 2:
+            (rook_source, rook_target) = (source + 3, source + 1) \
+                if target > source else (source - 4, source - 1)
+            rook = board[rook_source]
+            bitboards[rook] ^= 1 << rook_source | 1 << rook_target
+            board[rook_source] = None
+            board[rook_target] = rook
+
+        position.white = not self.white
+        position.castling = self.castling
+        for square in (source, target):
+            lost = self.CASTLING_LOST.get(square)
+            if lost:
+                position.castling = ''.join(
+                    right for right in position.castling if right not in lost)
+        position.en_passant = (source + target) // 2 \
+            if moved == 'P' and abs(target - source) == 16 else None
+        position.half_move_clock = 0 if moved == 'P' or captured \
+            else self.half_move_clock + 1
+        position.full_move_number = self.full_move_number + (not self.white)
+        return position
+
+    def san_move(self, san):
+        """
+        Finds the legal move written in standard algebraic notation.
+
+        :param san: Move, e.g. 'Nbd2', 'exd5', 'e8=Q+' or 'O-O'
+        :return: Move
+        :raises ValueError: If no legal move, or more than one, matches
+        """
+        legal_moves = self.legal_moves()
+        castling = self.CASTLING_SAN.get(san.rstrip('+#!?'))
+        if castling is not None:
+            candidates = [
+                (source, target, promotion)
+                for (source, target, promotion) in legal_moves
+                if self.board[source].upper() == 'K'
+                and target - source == castling]
+        else:
+            match = self.SAN.fullmatch(san)
+            if match is None:
+                raise ValueError(f'Unrecognized move {san}')
+            (piece, file, rank, target, promotion) = match.groups()
+            piece = piece or 'P'
+            target = SQUARE_INDICES[target]
+            candidates = [
+                move for move in legal_moves
+                if move[1] == target
+                and self.board[move[0]].upper() == piece
+                and (file is None or SQUARES[move[0]][0] == file)
+                and (rank is None or SQUARES[move[0]][1] == rank)
+                and (move[2] or '').upper() == (promotion or '')]
+        if len(candidates) != 1:
+            raise ValueError(f'{"Ambiguous" if candidates else "Illegal"} '
+                             f'move {san}')
+        return candidates[0]
+
+    def perft(self, depth):
+        """
+        Counts the leaf nodes of the legal move tree, for checking the move
+        generator against published counts.
+
+        :param depth: Depth in plies
+        :return: Number of positions reached
+        """
+        if depth == 0:
+            return 1
+        moves = self.legal_moves()
+        if depth == 1:
+            return len(moves)
+        return sum(self.make_move(move).perft(depth - 1) for move in moves)
+
+
+class LatencyTracer:
+    """
+    Optional instrumentation that times position updates from the moment the
+    IO thread reads their command to the moment the board has been painted.
+
+    A position is stamped when it is read, when its signal is emitted, when
+    the MainWindow slot applies it and when the board paint finishes.
+    Positions superseded before they reach the board, e.g. by the
+    UpdateCoalescer, are only counted. Commands of every kind are counted
+    too.
+    """
+
+    STAGES = ('read to emit', 'emit to slot', 'slot to paint', 'total')
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, samples=1000):
+        """
+        :param samples: Number of most recent positions kept for percentiles
+        """
+        self.lock = threading.Lock()
+        self.commands = {}
+        self.superseded = 0
+        self.latencies = {
+            stage: deque(maxlen=samples) for stage in self.STAGES}
+
+        # The positions of a game are applied or superseded in the order
+        # they were emitted, so the oldest trace emitted for a game always
+        # belongs to its next position to arrive at the GUI thread. Games
+        # are coalesced independently, so each has its own queue.
+        self.emitted = {}
+        self.applied = {}
+
+    def command_read(self, cmd):
+        """
+        Counts a command read by the IO thread.
+
+        :param cmd: Command name, e.g. 'set fen'
+        """
+        with self.lock:
+            self.commands[cmd] = self.commands.get(cmd, 0) + 1
+
+    def position_emitted(self, game_id, read_time):
+        """
+        Stamps a position as its signal is emitted.
+
+        :param game_id: Game id of the position
+        :param read_time: time.perf_counter() when its command was read
+        """
+        with self.lock:
+            self.emitted.setdefault(game_id, deque()).append(
+                (read_time, time.perf_counter()))
+
+    def __pop_emitted(self, game_id):
+        """Returns the oldest emitted trace of a game, or None."""
+        emitted = self.emitted.get(game_id)
+        if not emitted:
+            return None
+        trace = emitted.popleft()
+        if not emitted:
+            del self.emitted[game_id]
+        return trace
+
+    def position_superseded(self, game_id):
+        """
+        Records that the oldest emitted position of a game will never be
+        shown.
+
+        :param game_id: Game id of the position
+        """
+        with self.lock:
+            if self.__pop_emitted(game_id) is not None:
+                self.superseded += 1
+
+    def position_applied(self, game_id):
+        """
+        Stamps the oldest emitted position of a game as applied to its
+        board.
+
+        :param game_id: Game id of the position
+        """
+        with self.lock:
+            trace = self.__pop_emitted(game_id)
+            if trace is not None:
+                self.applied.setdefault(game_id, []).append(
+                    trace + (time.perf_counter(),))
+
+    def painted(self, game_id=None):
+        """
+        Stamps the applied positions of a board as painted.
+
+        :param game_id: Game id of the board, or None for the single board
+                        every game is shown on
+        """
+        painted_time = time.perf_counter()
+        with self.lock:
+            if game_id is None:
+                applied = [trace for traces in self.applied.values()
+                           for trace in traces]
+                self.applied = {}
+            else:
+                applied = self.applied.pop(game_id, [])
+            for (read_time, emit_time, slot_time) in applied:
+                self.latencies['read to emit'].append(emit_time - read_time)
+                self.latencies['emit to slot'].append(slot_time - emit_time)
+                self.latencies['slot to paint'].append(
+                    painted_time - slot_time)
+                self.latencies['total'].append(painted_time - read_time)
+
+    def stats(self):
+        """
+        Returns the statistics gathered so far.
+
+        :return: Dictionary with per-command counters, the number of
+                 superseded positions and, for each stage, latency
+                 percentiles in milliseconds
+        """
+        with self.lock:
+            latencies = {stage: sorted(self.latencies[stage])
+                         for stage in self.STAGES}
+            stats = {
+                'commands': dict(self.commands),
+                'positions superseded': self.superseded,
+                'latency ms': {},
+            }
+
+        for (stage, samples) in latencies.items():
+            if not samples:
+                continue
+            stats['latency ms'][stage] = {
+                f'p{percentile}': 1000 * samples[min(
+                    len(samples) - 1, len(samples) * percentile // 100)]
+                for percentile in self.PERCENTILES}
+            stats['latency ms'][stage]['max'] = 1000 * samples[-1]
+        return stats
+
+    def format_stats(self):
+        """
+        Returns the statistics as text for display.
+
+        :return: String with one topic per line
+        """
+        stats = self.stats()
+        text = 'Latency (ms)\n'
+        for (stage, percentiles) in stats['latency ms'].items():
+            text += f'  {stage}: ' + ', '.join(
+                f'{name} {value:.2f}'
+                for (name, value) in percentiles.items()) + '\n'
+        text += f'Positions superseded: {stats["positions superseded"]}\n'
+        text += 'Commands\n'
+        for (cmd, count) in stats['commands'].items():
+            text += f'  {cmd}: {count}\n'
+        return text
+
+
+class PgnFile:
+    """
+    A PGN archive opened for random access to its games.
+
+    The archive is memory-mapped and scanned once for the offsets at which
+    games begin. The offsets go to a sidecar index file next to the archive,
+    which is memory-mapped in turn, so memory use does not grow with the
+    archive and reopening it skips the scan. The move text of a game is only
+    parsed when the game is opened.
+    """
+
+    START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+    INDEX_SUFFIX = '.idx'
+    INDEX_MAGIC = b'MINAEPG2'
+
+    # Magic, the size and modification time in nanoseconds of the archive
+    # the index was built from and the number of games, followed by one
+    # offset per game
+    INDEX_HEADER = struct.Struct('=8sQQQ')
+    OFFSETS_PER_WRITE = 65536
+
+    # A tag pair line after a blank line or move text begins a new game.
+    # Matching from the newline lets the scan skip ahead to newlines.
+    GAME_START = re.compile(rb'\n(?:\n|[^\[\n][^\n]*\n)(?=\[)')
+
+    TAG = re.compile(r'^\[(\w+)\s+"((?:[^"\\]|\\.)*)"\][^\n]*', re.M)
+
+    # Comments, annotation glyphs, move numbers and game results, none of
+    # which are moves
+    NON_MOVES = re.compile(
+        r'\{[^}]*\}|;[^\n]*|\$\d+|\d+\.+|1-0|0-1|1/2-1/2|\*')
+    VARIATION = re.compile(r'\([^()]*\)')
+    ANNOTATION = re.compile(r'[!?]+$')
+
+    def __init__(self, path):
+        """
+        Opens an archive, building its index if there is no up to date one.
+
+        :param path: Path of the PGN file
+        :raises OSError: If the archive cannot be read
+        """
+        self.path = path
+        with open(path, 'rb') as pgn_file:
+            self.stat = os.fstat(pgn_file.fileno())
+            # An empty file cannot be mapped, but has no games anyway
+            self.data = mmap.mmap(pgn_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ) \
+                if self.stat.st_size else b''
+        self.index = self.__open_index()
+        if self.index is None:
+            self.index = self.__build_index()
+        self.offsets = memoryview(self.index)[self.INDEX_HEADER.size:] \
+            .cast('Q')
+
+    def __len__(self):
+        """Returns the number of games."""
+        return len(self.offsets)
+
+    def close(self):
+        """Unmaps the archive and its index."""
+        self.offsets.release()
+        self.index.close()
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def __index_header(self, games):
+        """
+        Returns the header identifying an index of the archive.
+
+        :param games: Number of games in the index
+        """
+        return self.INDEX_HEADER.pack(
+            self.INDEX_MAGIC, self.stat.st_size, self.stat.st_mtime_ns, games)
+
+    def __open_index(self):
+        """
+        Maps the sidecar index of the archive.
+
+        :return: mmap of the index, or None if there is no index, it was
+                 built from another version of the archive or it is not
+                 complete
+        """
+        try:
+            with open(self.path + self.INDEX_SUFFIX, 'rb') as index_file:
+                index = mmap.mmap(index_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if len(index) >= self.INDEX_HEADER.size:
+            games = self.INDEX_HEADER.unpack_from(index)[-1]
+            if index[:self.INDEX_HEADER.size] == self.__index_header(games) \
+                    and len(index) == self.INDEX_HEADER.size + 8 * games:
+                return index
+        index.close()
+        return None
+
+    def __build_index(self):
+        """
+        Scans the archive for the offsets of its games, and writes them to
+        the sidecar index, or to a temporary file if the index cannot be
+        written.
+
+        The index is written to a temporary file next to the archive and
+        only renamed into place once complete, so an interrupted build never
+        leaves a partial index behind.
+
+        :return: mmap of the index
+        """
+        index_path = self.path + self.INDEX_SUFFIX
+        try:
+            (fd, temp_path) = tempfile.mkstemp(
+                prefix=os.path.basename(index_path) + '.',
+                dir=os.path.dirname(index_path) or None)
+            index_file = os.fdopen(fd, 'w+b')
+        except OSError:
+            (index_file, temp_path) = (tempfile.TemporaryFile(), None)
+        with index_file:
+            try:
+                self.__write_index(index_file)
+            except BaseException:
+                if temp_path is not None:
+                    os.unlink(temp_path)
+                raise
+            if temp_path is not None:
+                try:
+                    os.replace(temp_path, index_path)
+                except OSError:
+                    # Keep using the complete index as an unnamed file
+                    os.unlink(temp_path)
+            return mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __write_index(self, index_file):
+        """
+        Scans the archive for the offsets of its games, and writes the
+        header and offsets to an index file.
+
+        :param index_file: Empty binary file to write to
+        """
+        # The header is rewritten with the number of games at the end
+        index_file.write(self.__index_header(0))
+        games = 0
+        offsets = array.array('Q')
+        first = self.data.find(b'[')
+        if first != -1:
+            offsets.append(first)
+            for match in self.GAME_START.finditer(self.data, first):
+                offsets.append(match.end())
+                if len(offsets) == self.OFFSETS_PER_WRITE:
+                    offsets.tofile(index_file)
+                    games += len(offsets)
+                    del offsets[:]
+        offsets.tofile(index_file)
+        games += len(offsets)
+        index_file.seek(0)
+        index_file.write(self.__index_header(games))
+        index_file.flush()
+
+    def game(self, number):
+        """
+        Parses a game.
+
+        :param number: Game number, counting from 1
+        :return: Tuple containing a dictionary of the game's tags in format
+                 {name:value} and a list of its half moves in SAN, e.g.
+                 ({'White':'Kasparov', ...}, ['e4', 'c5', ...])
+        :raises IndexError: If there is no such game
+        """
+        if not 1 <= number <= len(self.offsets):
+            raise IndexError(f'No game {number}, the archive has '
+                             f'{len(self.offsets)} games')
+        start = self.offsets[number - 1]
+        end = self.offsets[number] if number < len(self.offsets) \
+            else len(self.data)
+        text = self.data[start:end].decode('utf-8', 'replace')
+
+        tags = {name: value.replace('\\"', '"').replace('\\\\', '\\')
+                for (name, value) in self.TAG.findall(text)}
+        move_text = self.NON_MOVES.sub(' ', self.TAG.sub('', text))
+        # Variations may nest, so remove the innermost ones until none are
+        # left
+        unnested = None
+        while unnested != move_text:
+            unnested = move_text
+            move_text = self.VARIATION.sub(' ', move_text)
+        moves = [self.ANNOTATION.sub('', move) for move in move_text.split()]
+        return (tags, moves)
+
+
+class BinaryProtocol:
+    """
+    A compact, length-prefixed binary alternative to the JSON commands, for
+    high rate engine feeds.
+
+    Each frame is a 32 bit big-endian length followed by that many bytes: a
+    one byte opcode and its payload. Opcodes map one-to-one onto the JSON
+    commands. Squares are numbered from a1 (0) to h8 (63).
+
+    SET_FEN          64 board bytes in square order, each an ASCII piece
+                     letter or '.' for an empty square, then the active
+                     color ('w' or 'b'), a castling bitmask (K=1, Q=2, k=4,
+                     q=8), the en passant target square (255 for none), and
+                     the half move clock and full move number as 16 bit
+                     big-endian integers
+    APPEND_HISTORY   Half moves, each a one byte length and UTF-8 text
+    UNDO_HISTORY     Empty
+    SET_HISTORY      As APPEND_HISTORY
+    SET_LEGAL_MOVES  Moves, each a source square byte and a target square
+                     byte
+    QUIT             Empty
+    GAME             UTF-8 game id that the following frames from the same
+                     client apply to, like the 'game' entry of a JSON
+                     command object. Empty for the default game.
+    SET_ANALYSIS     The evaluation of the best line: a kind byte (0 for
+                     none, 1 for a score in centipawns, 2 for moves to
+                     mate) and a 32 bit big-endian signed value, then the
+                     first move of each line, best first, as a source
+                     square byte and a target square byte
+    OPEN_PGN         UTF-8 path of the PGN file
+    OPEN_GAME        Game number as a 32 bit big-endian integer
+    STATS            Empty
+
+    Decoded boards are cached by their 64 board bytes, as FenParser caches
+    piece placements, so repeated positions are not decoded again.
+    """
+
+    SET_FEN = 1
+    APPEND_HISTORY = 2
+    UNDO_HISTORY = 3
+    SET_HISTORY = 4
+    SET_LEGAL_MOVES = 5
+    QUIT = 6
+    GAME = 7
+    SET_ANALYSIS = 8
+    OPEN_PGN = 9
+    OPEN_GAME = 10
+    STATS = 11
+
+    COMMANDS = {
+        SET_FEN: 'set fen',
+        APPEND_HISTORY: 'append history',
+        UNDO_HISTORY: 'undo history',
+        SET_HISTORY: 'set history',
+        SET_LEGAL_MOVES: 'set legal moves',
+        QUIT: 'quit',
+        GAME: 'game',
+        SET_ANALYSIS: 'set analysis',
+        OPEN_PGN: 'open pgn',
+        OPEN_GAME: 'open game',
+        STATS: 'stats',
+    }
+
+    HEADER = struct.Struct('>IB')
+    LENGTH = struct.Struct('>I')
+    POSITION = struct.Struct('>64scBBHH')
+    EVALUATION = struct.Struct('>Bi')
+    GAME_NUMBER = struct.Struct('>I')
+
+    EMPTY = ord('.')
+    PIECES = frozenset(b'PRNBQKprnbqk')
+    CASTLING = 'KQkq'
+    NO_SQUARE = 255
+    (NO_EVALUATION, SCORE, MATE) = range(3)
+
+    # Decoded boards, by their board bytes, shared by every decoder. The
+    # populated squares are shared with the cache and must not be modified.
+    BOARD_CACHE_SIZE = 4096
+    board_cache = OrderedDict()
+
+    @classmethod
+    def frame(cls, opcode, payload=b''):
+        """
+        Builds a frame.
+
+        :param opcode: Opcode, e.g. BinaryProtocol.SET_FEN
+        :param payload: Payload bytes
+        :return: Frame bytes
+        """
+        return cls.HEADER.pack(len(payload) + 1, opcode) + payload
+
+    @classmethod
+    def split_frames(cls, data):
+        """
+        Splits received bytes into complete frames.
+
+        :param data: Bytes received so far
+        :return: Tuple containing a list of (opcode, payload) tuples and the
+                 bytes of any incomplete frame left over
+        """
+        frames = []
+        offset = 0
+        while len(data) - offset >= cls.LENGTH.size:
+            (length,) = cls.LENGTH.unpack_from(data, offset)
+            end = offset + cls.LENGTH.size + length
+            if end > len(data):
+                break
+            if length == 0:
+                print('Error: Empty frame', file=sys.stderr)
+            else:
+                frames += [(data[offset + cls.LENGTH.size],
+                            data[offset + cls.LENGTH.size + 1:end])]
+            offset = end
+        return (frames, data[offset:])
+
+    @classmethod
+    def encode_fen(cls, fen):
+        """
+        Builds a SET_FEN frame.
+
+        :param fen: FEN string
+        :return: Frame bytes
+        :raises ValueError: If the FEN is invalid
+        """
+        (populated_squares, game_state) = FenParser(cache_size=0).parse(fen)
+        board = bytearray([cls.EMPTY] * 64)
+        for (pos, piece) in populated_squares.items():
+            board[SQUARE_INDICES[pos]] = ord(piece)
+        castling = 0
+        for (bit, right) in enumerate(cls.CASTLING):
+            if right in game_state['Castling availability']:
+                castling |= 1 << bit
+        en_passant = SQUARE_INDICES.get(
+            game_state['En-passant target'], cls.NO_SQUARE)
+        return cls.frame(cls.SET_FEN, cls.POSITION.pack(
+            bytes(board),
+            game_state['Turn'].encode(),
+            castling,
+            en_passant,
+            int(game_state['Half move clock']),
+            int(game_state['Full move number'])))
+
+    @classmethod
+    def decode_position(cls, payload):
+        """
+        Decodes and validates a SET_FEN payload.
+
+        :param payload: Payload bytes
+        :return: Tuple containing a dictionary of populated squares in format
+                 {pos:piece} and a game state dictionary containing
+                 {topic:value} pairs, as FenParser.parse() returns
+        :raises ValueError: If the payload is invalid
+        """
+        if len(payload) != cls.POSITION.size:
+            raise ValueError(
+                f'position must be {cls.POSITION.size} bytes, '
+                f'not {len(payload)}')
+        (board, color, castling, en_passant, half_move_clock,
+         full_move_number) = cls.POSITION.unpack(payload)
+
+        populated_squares = cls.board_cache.get(board)
+        if populated_squares is None:
+            populated_squares = {}
+            for (index, piece) in enumerate(board):
+                if piece == cls.EMPTY:
+                    continue
+                if piece not in cls.PIECES:
+                    raise ValueError(
+                        f'square {SQUARES[index]} has unrecognized piece '
+                        f'{piece}')
+                populated_squares[SQUARES[index]] = chr(piece)
+            cls.board_cache[board] = populated_squares
+            if len(cls.board_cache) > cls.BOARD_CACHE_SIZE:
+                cls.board_cache.popitem(last=False)
+        else:
+            cls.board_cache.move_to_end(board)
+
+        if color != b'w' and color != b'b':
+            raise ValueError(f'active color must be w or b, not {color!r}')
+        if castling > 0xf:
+            raise ValueError(f'castling bitmask {castling} out of range')
+        if en_passant != cls.NO_SQUARE and en_passant >= 64:
+            raise ValueError(f'en passant target {en_passant} out of range')
+        if full_move_number == 0:
+            raise ValueError('full move number must be positive')
+
+        return (populated_squares, {
+            'Turn': color.decode(),
+            'Castling availability': ''.join(
+                right for (bit, right) in enumerate(cls.CASTLING)
+                if castling & (1 << bit)) or '-',
+            'En-passant target': (
+                '-' if en_passant == cls.NO_SQUARE
+                else SQUARES[en_passant]),
+            'Half move clock': str(half_move_clock),
+            'Full move number': str(full_move_number),
+        })
+
+    @classmethod
+    def encode_history(cls, opcode, half_moves):
+        """
+        Builds an APPEND_HISTORY or SET_HISTORY frame.
+
+        :param opcode: BinaryProtocol.APPEND_HISTORY or SET_HISTORY
+        :param half_moves: List of half moves
+        :return: Frame bytes
+        """
+        payload = bytearray()
+        for half_move in half_moves:
+            text = half_move.encode()
+            payload += bytes([len(text)]) + text
+        return cls.frame(opcode, bytes(payload))
+
+    @classmethod
+    def decode_history(cls, payload):
+        """
+        Decodes an APPEND_HISTORY or SET_HISTORY payload.
+
+        :param payload: Payload bytes
+        :return: List of half moves
+        :raises ValueError: If the payload is invalid
+        """
+        half_moves = []
+        offset = 0
+        while offset < len(payload):
+            end = offset + 1 + payload[offset]
+            if end > len(payload):
+                raise ValueError('half move runs past the end of the frame')
+            half_moves += [payload[offset + 1:end].decode()]
+            offset = end
+        return half_moves
+
+    @classmethod
+    def encode_legal_moves(cls, moves):
+        """
+        Builds a SET_LEGAL_MOVES frame.
+
+        :param moves: List of moves in format 'e2e4'
+        :return: Frame bytes
+        """
+        return cls.frame(cls.SET_LEGAL_MOVES, bytes(
+            SQUARE_INDICES[move[i:i + 2]] for move in moves for i in (0, 2)))
+
+    @classmethod
+    def decode_legal_moves(cls, payload):
+        """
+        Decodes a SET_LEGAL_MOVES payload.
+
+        :param payload: Payload bytes
+        :return: LegalMoves
+        :raises ValueError: If the payload is invalid
+        """
+        if len(payload) % 2 != 0:
+            raise ValueError('legal moves must be pairs of squares')
+        masks = [0] * 64
+        for offset in range(0, len(payload), 2):
+            (src, target) = (payload[offset], payload[offset + 1])
+            if src >= 64 or target >= 64:
+                raise ValueError(f'move {src}-{target} out of range')
+            masks[src] |= 1 << target
+        return LegalMoves(masks)
+
+    @classmethod
+    def encode_analysis(cls, moves, score=None, mate=None):
+        """
+        Builds a SET_ANALYSIS frame.
+
+        :param moves: List of the first move of each line, best first, in
+                      format 'e2e4'
+        :param score: Evaluation of the best line in centipawns, or None
+        :param mate: Moves to mate in the best line, or None
+        :return: Frame bytes
+        """
+        if mate is not None:
+            evaluation = cls.EVALUATION.pack(cls.MATE, mate)
+        elif score is not None:
+            evaluation = cls.EVALUATION.pack(cls.SCORE, score)
+        else:
+            evaluation = cls.EVALUATION.pack(cls.NO_EVALUATION, 0)
+        return cls.frame(cls.SET_ANALYSIS, evaluation + bytes(
+            SQUARE_INDICES[move[i:i + 2]] for move in moves for i in (0, 2)))
+
+    @classmethod
+    def decode_analysis(cls, payload):
+        """
+        Decodes a SET_ANALYSIS payload.
+
+        :param payload: Payload bytes
+        :return: Analysis
+        :raises ValueError: If the payload is invalid
+        """
+        if len(payload) < cls.EVALUATION.size \
+                or (len(payload) - cls.EVALUATION.size) % 2 != 0:
+            raise ValueError('analysis must be an evaluation and pairs of '
+                             'squares')
+        (kind, value) = cls.EVALUATION.unpack_from(payload)
+        if kind > cls.MATE:
+            raise ValueError(f'unrecognized evaluation kind {kind}')
+        arrows = []
+        for offset in range(cls.EVALUATION.size, len(payload), 2):
+            (src, target) = (payload[offset], payload[offset + 1])
+            if src >= 64 or target >= 64:
+                raise ValueError(f'move {src}-{target} out of range')
+            arrows += [(src, target)]
+        return Analysis(arrows, value if kind == cls.SCORE else None,
+                        value if kind == cls.MATE else None)
+
+    @classmethod
+    def decode_game_number(cls, payload):
+        """
+        Decodes an OPEN_GAME payload.
+
+        :param payload: Payload bytes
+        :return: Game number
+        :raises ValueError: If the payload is invalid
+        """
+        if len(payload) != cls.GAME_NUMBER.size:
+            raise ValueError(f'game number must be {cls.GAME_NUMBER.size} '
+                             f'bytes, not {len(payload)}')
+        return cls.GAME_NUMBER.unpack(payload)[0]
+
+
+class CommandReader:
+    """
+    Reads newline-delimited JSON commands, or BinaryProtocol frames, from
+    stdin and from any number of clients connected to local listening
+    sockets.
+
+    All input available when the reader wakes up is drained in one pass and
+    returned as a batch. A blocked read can be interrupted with wake().
+    """
+
+    PROMPT = 'minae-chess-gui$ '
+    READ_SIZE = 65536
+
+    def __init__(self, stdin=True, unix_path=None, tcp_address=None,
+                 protocol='json', stdin_fd=None):
+        """
+        :param stdin: True to read commands from stdin
+        :param unix_path: Path of a Unix domain socket to listen on, or None
+        :param tcp_address: Tuple containing (host, port) to listen on, or
+                            None
+        :param protocol: 'json' for newline-delimited JSON commands, or
+                         'binary' for BinaryProtocol frames
+        :param stdin_fd: File descriptor to read stdin from, or None for
+                         sys.stdin's, e.g. a duplicate kept open for a worker
+                         process
+        :raises FileExistsError: If something other than a socket is at
+                                 unix_path
+        """
+        if stdin_fd is None:
+            stdin_fd = sys.stdin.fileno()
+        self.protocol = protocol
+        self.selector = selectors.DefaultSelector()
+        self.buffers = {}
+        # Binary frames are tagged with the stream they came from, as each
+        # stream selects its own game
+        self.sources = {}
+        self.source_ids = itertools.count(1)
+        self.unix_path = unix_path
+        self.interactive = \
+            stdin and protocol == 'json' and os.isatty(stdin_fd)
+
+        (self.wake_fd, self.wake_write_fd) = os.pipe()
+        self.selector.register(self.wake_fd, selectors.EVENT_READ, 'wake')
+
+        if stdin:
+            self.__add_stream(stdin_fd)
+        if unix_path is not None:
+            # Only a socket left behind by an earlier run is replaced
+            if os.path.exists(unix_path):
+                if not stat.S_ISSOCK(os.stat(unix_path).st_mode):
+                    raise FileExistsError(
+                        f'{unix_path} exists and is not a socket')
+                os.unlink(unix_path)
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            listener.bind(unix_path)
+            self.__add_listener(listener)
+        if tcp_address is not None:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind(tcp_address)
+            self.__add_listener(listener)
+
+    def __add_listener(self, listener):
+        """Starts accepting connections on a bound socket."""
+        listener.listen()
+        listener.setblocking(False)
+        self.selector.register(listener, selectors.EVENT_READ, 'listener')
+
+    def __add_stream(self, stream):
+        """Starts reading commands from a file descriptor or socket."""
+        self.buffers[stream] = b''
+        self.sources[stream] = next(self.source_ids)
+        self.selector.register(stream, selectors.EVENT_READ, 'stream')
+
+    def __remove_stream(self, stream):
+        """Stops reading commands from a file descriptor or socket."""
+        self.selector.unregister(stream)
+        del self.buffers[stream]
+        del self.sources[stream]
+        if isinstance(stream, socket.socket):
+            stream.close()
+
+    def read(self):
+        """
+        Waits for input, then returns every complete command available.
+
+        :return: List of commands, or None once the reader has been woken to
+                 shut down. JSON commands are dictionaries in format
+                 {cmd:val}, binary commands are tuples in format
+                 (opcode, payload, source), where source identifies the
+                 stream the frame was read from.
+        """
+        commands = []
+        while not commands:
+            if self.interactive:
+                print(self.PROMPT, end='', flush=True, file=sys.stderr)
+
+            for (key, _) in self.selector.select():
+                if key.data == 'wake':
+                    return None
+                elif key.data == 'listener':
+                    (connection, _) = key.fileobj.accept()
+                    connection.setblocking(False)
+                    self.__add_stream(connection)
+                else:
+                    commands += self.__read_stream(key.fileobj)
+
+        return commands
+
+    def __read_stream(self, stream):
+        """
+        Reads what is available from a ready stream.
+
+        :param stream: File descriptor or socket
+        :return: List of commands completed by the read
+        """
+        try:
+            if isinstance(stream, socket.socket):
+                data = stream.recv(self.READ_SIZE)
+            else:
+                data = os.read(stream, self.READ_SIZE)
+        except BlockingIOError:
+            return []
+        except OSError:
+            # A client that went away abruptly, e.g. with a reset, ends
+            # like one that closed its end, leaving the other inputs alone
+            data = b''
+
+        buffered = self.buffers[stream] + data
+        if self.protocol == 'binary':
+            (frames, self.buffers[stream]) = \
+                BinaryProtocol.split_frames(buffered)
+            source = self.sources[stream]
+            commands = [(opcode, payload, source)
+                        for (opcode, payload) in frames]
+            if not data:
+                # The stream's game is forgotten along with the stream
+                commands += [(BinaryProtocol.GAME, b'', source)]
+                self.__remove_stream(stream)
+            return commands
+
+        lines = buffered.split(b'\n')
+        if data:
+            # The last line is incomplete until its newline arrives
+            self.buffers[stream] = lines.pop()
+        else:
+            # End of input, so whatever is left is the final line
+            self.__remove_stream(stream)
+
+        commands = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                cmds = json.loads(line)
+            except ValueError as err:
+                # Covers invalid UTF-8 as well as invalid JSON
+                print(err, file=sys.stderr)
+                continue
+            if not isinstance(cmds, dict):
+                print('Error: Commands must be a JSON object', file=sys.stderr)
+                continue
+            commands += [cmds]
+        return commands
+
+    def wake(self):
+        """Interrupts read() from another thread, making it return None."""
+        os.write(self.wake_write_fd, b'\0')
+
+    def close(self):
+        """Closes the reader. It must not be reading at the time."""
+        for stream in list(self.buffers):
+            if isinstance(stream, socket.socket):
+                stream.close()
+        for key in list(self.selector.get_map().values()):
+            if key.data == 'listener':
+                key.fileobj.close()
+        self.selector.close()
+        os.close(self.wake_fd)
+        os.close(self.wake_write_fd)
+        if self.unix_path is not None and os.path.exists(self.unix_path) \
+                and stat.S_ISSOCK(os.stat(self.unix_path).st_mode):
+            os.unlink(self.unix_path)
+
+
+class CommandLog:
+    """
+    Records every batch of commands a session receives, with the time it
+    arrived, so the session can be replayed by CommandLogReader.
+
+    The file begins with MAGIC. Each batch is a BATCH header holding the
+    nanoseconds since recording began and the number of commands, followed
+    by each command: a COMMAND header holding its opcode, source and payload
+    length, then the payload. JSON command objects have opcode JSON and
+    source 0 and are stored as compact JSON; binary frames keep their
+    BinaryProtocol opcode, source and payload.
+    """
+
+    MAGIC = b'MINAELG2'
+    BATCH = struct.Struct('=QI')
+    COMMAND = struct.Struct('=BII')
+    JSON = 0
+
+    def __init__(self, path):
+        """
+        :param path: Path of the file to record to, replacing any existing
+                     file
+        """
+        self.file = open(path, 'wb')
+        self.file.write(self.MAGIC)
+        # Nothing stays buffered, so a forked worker can take over
+        self.file.flush()
+        self.start = time.monotonic_ns()
+
+    def record(self, batch):
+        """
+        Appends a batch of commands.
+
+        :param batch: List of command dictionaries or binary frames, as
+                      returned by CommandReader.read()
+        """
+        data = [self.BATCH.pack(time.monotonic_ns() - self.start, len(batch))]
+        for command in batch:
+            if isinstance(command, dict):
+                (opcode, payload, source) = (self.JSON, json.dumps(
+                    command, separators=(',', ':')).encode(), 0)
+            else:
+                (opcode, payload, source) = command
+            data += [self.COMMAND.pack(opcode, source, len(payload)), payload]
+        self.file.write(b''.join(data))
+        # A session that ends abruptly keeps every batch it handled
+        self.file.flush()
+
+    def close(self):
+        """Closes the file."""
+        self.file.close()
+
+
+class CommandLogReader:
+    """
+    Replays a file recorded by CommandLog in place of a CommandReader,
+    either at the pace it was recorded or as fast as it is read.
+    """
+
+    def __init__(self, path, realtime=True):
+        """
+        :param path: Path of the recorded file
+        :param realtime: True to return each batch when it is due relative
+                         to the first read(), False to return it at once
+        :raises ValueError: If the file is not a CommandLog recording
+        """
+        with open(path, 'rb') as file:
+            self.data = file.read()
+        if not self.data.startswith(CommandLog.MAGIC):
+            raise ValueError(f'{path} is not a command log')
+        self.realtime = realtime
+        self.offset = len(CommandLog.MAGIC)
+        self.start = None
+        self.woken = threading.Event()
+
+    def read(self):
+        """
+        Waits until the next batch is due, then returns it.
+
+        :return: List of commands as returned by CommandReader.read(), or
+                 None at the end of the recording or once woken
+        """
+        if self.offset >= len(self.data) or self.woken.is_set():
+            return None
+        (nanoseconds, count) = \
+            CommandLog.BATCH.unpack_from(self.data, self.offset)
+        self.offset += CommandLog.BATCH.size
+        batch = []
+        for _ in range(count):
+            (opcode, source, length) = \
+                CommandLog.COMMAND.unpack_from(self.data, self.offset)
+            self.offset += CommandLog.COMMAND.size
+            payload = self.data[self.offset:self.offset + length]
+            self.offset += length
+            if opcode == CommandLog.JSON:
+                batch += [json.loads(payload)]
+            else:
+                batch += [(opcode, payload, source)]
+
+        if self.start is None:
+            self.start = time.monotonic() - nanoseconds / 1e9
+        if self.realtime:
+            wait = self.start + nanoseconds / 1e9 - time.monotonic()
+            if wait > 0 and self.woken.wait(wait):
+                return None
+        return batch
+
+    def wake(self):
+        """Interrupts read() from another thread, making it return None."""
+        self.woken.set()
+
+    def close(self):
+        """Releases the recording."""
+        self.data = b''
+
+
+class EventWriter:
+    """
+    Writes outbound events, e.g. moves made on the board, as JSON lines from
+    a thread of its own, so a consumer that stops reading cannot block the
+    GUI.
+
+    Events wait in a bounded queue and are written in batches. When the
+    queue is full the oldest event is dropped, and the number dropped is
+    reported in a {"dropped events": n} line ahead of the next batch.
+
+    Nothing else is written to stdout, so its consumer only sees events:
+    errors, the prompt and command replies go to stderr.
+    """
+
+    def __init__(self, stream=None, max_events=1024):
+        """
+        :param stream: Text stream to write to, stdout by default
+        :param max_events: Number of events the queue holds
+        """
+        self.stream = sys.stdout if stream is None else stream
+        self.events = deque(maxlen=max_events)
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.unreported_drops = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def emit(self, event):
+        """
+        Queues an event without waiting for it to be written.
+
+        :param event: JSON serializable dictionary
+        """
+        line = json.dumps(event) + '\n'
+        with self.condition:
+            if len(self.events) == self.events.maxlen:
+                self.dropped += 1
+                self.unreported_drops += 1
+            self.events.append(line)
+            self.condition.notify()
+
+    def user_move(self, game_id, move):
+        """
+        Queues a move made on the board, in the format of an input command.
+
+        :param game_id: Game id of the board, or '' outside monitor mode
+        :param move: Move in format 'e2e4'
+        """
+        if game_id:
+            self.emit({'game': game_id, 'user move': move})
+        else:
+            self.emit({'user move': move})
+
+    def close(self, timeout=1.0):
+        """
+        Writes the queued events and stops the writer thread, giving up if
+        the consumer is not reading.
+
+        :param timeout: Seconds to wait for the writer thread
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join(timeout)
+
+    def __run(self):
+        """Writes batches of queued events until closed."""
+        while True:
+            with self.condition:
+                while not self.events and not self.closed:
+                    self.condition.wait()
+                if not self.events:
+                    return
+                lines = list(self.events)
+                self.events.clear()
+                if self.unreported_drops:
+                    lines.insert(0, json.dumps(
+                        {'dropped events': self.unreported_drops}) + '\n')
+                    self.unreported_drops = 0
+            try:
+                self.stream.write(''.join(lines))
+                self.stream.flush()
+            except (OSError, ValueError):
+                # The consumer has gone, so there is nobody left to tell
+                return
+
+
+class UpdateThread(QThread):
+    """
+    A thread delivering validated view updates to the GUI, whichever way
+    their commands were read and handled.
+    """
+
+    # Every update names the game it belongs to. Commands without a game id
+    # belong to the default game, ''.
+    #
+    # The view updates of a whole command object are emitted together, as
+    # one snapshot: a tuple of (name, args) pairs naming MainWindow slots,
+    # e.g. ('set_position', (game_id, populated_squares)). Analysis has a
+    # signal of its own, since it is applied at a rate of its own.
+    apply_updates_signal = Signal(object)
+    set_analysis_signal = Signal(str, object)
+    quit_app_signal = Signal()
+
+    def __init__(self, tracer=None):
+        """
+        :param tracer: LatencyTracer, or None to disable tracing
+        """
+        QThread.__init__(self)
+        self.tracer = tracer
+
+    def emit_update(self, update, *args):
+        """
+        Emits an update from a CommandProcessor.
+
+        :param update: Name of the update, e.g. 'apply_updates'
+        :param args: Arguments of the update's signal
+        """
+        if update == 'stats':
+            if self.tracer is None:
+                print('Error: Tracing is disabled, start with --trace',
+                      file=sys.stderr)
+            else:
+                print(json.dumps(self.tracer.stats()), file=sys.stderr)
+        else:
+            getattr(self, update + '_signal').emit(*args)
+
+
+class CommandProcessor:
+    """
+    Validates commands and turns them into view updates.
+
+    It does not use Qt, so it can run in the IO thread or in a worker
+    process. Updates are handed to a callback as the name of an
+    UpdateThread signal and its arguments.
+
+    The view updates of a JSON command object, or of a batch of binary
+    frames, are collected and handed over as one 'apply_updates' snapshot,
+    so the GUI applies them in one pass and never shows, e.g., a new
+    position with the legal moves of the old one.
+    """
+
+    # Updates handed over on their own, after any pending snapshot
+    UNBATCHED_UPDATES = ('set_analysis', 'stats', 'quit_app')
+
+    def __init__(self, emit, tracer=None, position_store=None,
+                 movegen=False, command_log=None):
+        """
+        :param emit: Callable taking the name of an update, e.g.
+                     'apply_updates', and its arguments
+        :param tracer: LatencyTracer, or None to disable tracing
+        :param position_store: PositionStore to record the position of
+                               every ply in, or None
+        :param movegen: True to generate the legal moves of every position,
+                        instead of waiting for the engine to set them
+        :param command_log: CommandLog to record every batch to, or None
+        """
+        self.deliver = emit
+        self.updates = []
+        self.tracer = tracer
+        self.position_store = position_store
+        self.movegen = movegen
+        self.command_log = command_log
+        self.pgn_file = None
+        self.read_time = 0
+        self.fen_parser = FenParser()
+        self.move_histories = {}
+        self.unrecorded_positions = {}
+        # Game selected by the GAME frames of each stream
+        self.frame_game_ids = {}
+
+    def handle_batch(self, batch):
+        """
+        Handles a batch of commands from CommandReader.read().
+
+        :param batch: List of command dictionaries or binary frames
+        :return: False if the commands asked to quit, otherwise True
+        """
+        if self.tracer is not None:
+            self.read_time = time.perf_counter()
+        if self.command_log is not None and batch:
+            self.command_log.record(batch)
+        for command in batch:
+            try:
+                if isinstance(command, dict):
+                    keep_running = self.handle_commands(command)
+                else:
+                    keep_running = self.__handle_frame(*command)
+            except Exception as err:
+                # A command no handler anticipated must not stop the input
+                # of every client
+                print(f'Error: Failed to handle {command!r}: {err!r}',
+                      file=sys.stderr)
+                continue
+            if not keep_running:
+                return False
+        self.flush_updates()
+        self.record_positions()
+        return True
+
+    def emit(self, update, *args):
+        """
+        Adds a view update to the pending snapshot. Updates that are not
+        part of snapshots are handed over at once, after the snapshot.
+
+        :param update: Name of the update, e.g. 'set_position'
+        :param args: Arguments of the update
+        """
+        if update in self.UNBATCHED_UPDATES:
+            self.flush_updates()
+            self.deliver(update, *args)
+        else:
+            self.updates.append((update, args))
+
+    def flush_updates(self):
+        """Hands over the pending view updates as one snapshot, if any."""
+        if self.updates:
+            self.deliver('apply_updates', tuple(self.updates))
+            self.updates = []
+
+    def close(self):
+        """Closes any open PGN file and the command log."""
+        if self.pgn_file is not None:
+            self.pgn_file.close()
+        if self.command_log is not None:
+            self.command_log.close()
+
+    def handle_commands(self, cmds):
+        """
+        Handles one JSON object of commands.
+
+        :param cmds: Dictionary in format {cmd:val}. The optional 'game'
+                     entry names the game the other commands apply to.
+        :return: False if the commands asked to quit, otherwise True
+        """
+        keep_running = self.__handle_commands(cmds)
+        self.flush_updates()
+        return keep_running
+
+    def __handle_commands(self, cmds):
+        """See handle_commands()."""
+        game_id = cmds.get('game', '')
+        if not isinstance(game_id, str):
+            print('Error: Game id must be a string', file=sys.stderr)
+            return True
+
+        for cmd, val in cmds.items():
+            if cmd == 'game':
+                continue
+            if self.tracer is not None:
+                self.tracer.command_read(cmd)
+
+            if cmd == 'set fen':
+                try:
+                    (populated_squares, game_state) = \
+                        self.fen_parser.parse(val)
+                except ValueError as err:
+                    print(f'Invalid FEN: {err}', file=sys.stderr)
+                    continue
+                self.__set_position(game_id, populated_squares, game_state)
+
+            elif cmd == 'append history':
+                if not self.__is_history(val):
+                    print('Error: History must be a list of half moves',
+                          file=sys.stderr)
+                    continue
+                self.__append_history(game_id, val)
+
+            elif cmd == 'undo history':
+                self.__undo_history(game_id)
+
+            elif cmd == 'set history':
+                if not self.__is_history(val):
+                    print('Error: History must be a list of half moves',
+                          file=sys.stderr)
+                    continue
+                self.__set_history(game_id, val)
+
+            elif cmd == 'set legal moves':
+                legal_moves = self.__parse_legal_moves(val)
+                self.emit('set_legal_moves', game_id, legal_moves)
+
+            elif cmd == 'set analysis':
+                self.emit('set_analysis', game_id,
+                          self.__parse_analysis(val))
+
+            elif cmd == 'open pgn':
+                self.__open_pgn(val)
+
+            elif cmd == 'open game':
+                self.__open_game(game_id, val)
+
+            elif cmd == 'stats':
+                self.emit('stats')
+
+            elif cmd == 'quit':
+                self.emit('quit_app')
+                return False
+
+            else:
+                print('Error: Unrecognized command', file=sys.stderr)
+
+        self.record_positions()
+        return True
+
+    def handle_frame(self, opcode, payload, source=0):
+        """
+        Handles one BinaryProtocol frame on its own. Frames read together
+        are handled by handle_batch(), as one snapshot.
+
+        :param opcode: Opcode, e.g. BinaryProtocol.SET_FEN
+        :param payload: Payload bytes
+        :param source: Identifier of the stream the frame was read from,
+                       whose GAME frames select the game it applies to
+        :return: False if the frame asked to quit, otherwise True
+        """
+        keep_running = self.__handle_frame(opcode, payload, source)
+        self.flush_updates()
+        return keep_running
+
+    def __handle_frame(self, opcode, payload, source=0):
+        """See handle_frame()."""
+        if self.tracer is not None:
+            self.tracer.command_read(
+                BinaryProtocol.COMMANDS.get(opcode, 'unrecognized'))
+        game_id = self.frame_game_ids.get(source, '')
+        try:
+            if opcode == BinaryProtocol.SET_FEN:
+                self.__set_position(
+                    game_id, *BinaryProtocol.decode_position(payload))
+            elif opcode == BinaryProtocol.APPEND_HISTORY:
+                self.__append_history(
+                    game_id, BinaryProtocol.decode_history(payload))
+            elif opcode == BinaryProtocol.UNDO_HISTORY:
+                self.__undo_history(game_id)
+            elif opcode == BinaryProtocol.SET_HISTORY:
+                self.__set_history(
+                    game_id, BinaryProtocol.decode_history(payload))
+            elif opcode == BinaryProtocol.SET_LEGAL_MOVES:
+                self.emit('set_legal_moves', game_id,
+                          BinaryProtocol.decode_legal_moves(payload))
+            elif opcode == BinaryProtocol.GAME:
+                if payload:
+                    self.frame_game_ids[source] = payload.decode()
+                else:
+                    self.frame_game_ids.pop(source, None)
+            elif opcode == BinaryProtocol.SET_ANALYSIS:
+                self.emit('set_analysis', game_id,
+                          BinaryProtocol.decode_analysis(payload))
+            elif opcode == BinaryProtocol.OPEN_PGN:
+                self.__open_pgn(payload.decode())
+            elif opcode == BinaryProtocol.OPEN_GAME:
+                self.__open_game(
+                    game_id, BinaryProtocol.decode_game_number(payload))
+            elif opcode == BinaryProtocol.STATS:
+                self.emit('stats')
+            elif opcode == BinaryProtocol.QUIT:
+                self.emit('quit_app')
+                return False
+            else:
+                print(f'Error: Unrecognized opcode {opcode}', file=sys.stderr)
+        except ValueError as err:
+            print(f'Invalid frame: {err}', file=sys.stderr)
+
+        return True
+
+    def record_positions(self):
+        """
+        Records the latest position of each game at the ply its move history
+        has reached.
+
+        Engines send a move and the resulting position together, in either
+        order, so positions are recorded once the whole command object, or
+        the whole batch of binary frames, has been handled.
+        """
+        if self.position_store is None:
+            return
+        for (game_id, (populated_squares, game_state)) in \
+                self.unrecorded_positions.items():
+            self.position_store.record(
+                game_id, len(self.move_histories.get(game_id, [])),
+                populated_squares, game_state)
+        self.unrecorded_positions.clear()
+
+    def __open_pgn(self, path):
+        """
+        Opens a PGN archive, replacing any open one, and reports its number
+        of games.
+
+        :param path: Path of the PGN file
+        """
+        # open() would take an integer for a file descriptor of ours
+        if not isinstance(path, str):
+            print('Error: PGN path must be a string', file=sys.stderr)
+            return
+        try:
+            pgn_file = PgnFile(path)
+        except OSError as err:
+            print(f'Error: Cannot open PGN: {err}', file=sys.stderr)
+            return
+        if self.pgn_file is not None:
+            self.pgn_file.close()
+        self.pgn_file = pgn_file
+        print(json.dumps({'pgn': path, 'games': len(pgn_file)}),
+              file=sys.stderr)
+
+    def __open_game(self, game_id, number):
+        """
+        Shows a game of the open PGN archive: its move history, and the
+        position after its last move. The positions of all its plies are
+        recorded in the position store.
+
+        :param game_id: Game id to show the game as
+        :param number: Game number, counting from 1
+        """
+        if self.pgn_file is None:
+            print('Error: No PGN file is open', file=sys.stderr)
+            return
+        if not isinstance(number, int):
+            print('Error: Game number must be an integer', file=sys.stderr)
+            return
+        try:
+            (tags, moves) = self.pgn_file.game(number)
+            (populated_squares, game_state) = self.fen_parser.parse(
+                tags.get('FEN', PgnFile.START_FEN))
+        except IndexError as err:
+            print(f'Error: {err}', file=sys.stderr)
+            return
+        except ValueError as err:
+            print(f'Invalid FEN tag: {err}', file=sys.stderr)
+            return
+
+        position = Position(populated_squares, game_state)
+        positions = [position]
+        for (ply, san) in enumerate(moves, 1):
+            try:
+                position = position.make_move(position.san_move(san))
+            except (ValueError, IndexError, KeyError) as err:
+                # Plies from here on keep their moves but not positions
+                print(f'Error: Game {number}, ply {ply}: {err}',
+                      file=sys.stderr)
+                break
+            positions += [position]
+
+        self.__set_history(game_id, moves)
+        self.__set_position(
+            game_id, position.populated_squares(), position.game_state())
+        # The replayed plies are all recorded below
+        self.unrecorded_positions.pop(game_id, None)
+        if self.position_store is not None:
+            for (ply, position) in enumerate(positions):
+                self.position_store.record(
+                    game_id, ply, position.populated_squares(),
+                    position.game_state())
+
+    def __parse_analysis(self, lines):
+        """
+        Parses the value of a 'set analysis' command.
+
+        Unrecognized lines are reported and skipped.
+
+        :param lines: List of principal variations, best first. Each is a
+                      dictionary with 'pv', a list of moves in format 'e2e4'
+                      or a single string of such moves separated by spaces,
+                      and 'score' in centipawns or 'mate' in moves, both
+                      from white's point of view.
+        :return: Analysis
+        """
+        if not isinstance(lines, list):
+            print('Error: Analysis must be a list of lines', file=sys.stderr)
+            return Analysis()
+        arrows = []
+        (score, mate) = (None, None)
+        for line in lines:
+            moves = line.get('pv') if isinstance(line, dict) else None
+            if isinstance(moves, str):
+                moves = moves.split()
+            move = moves[0] if isinstance(moves, list) and moves else None
+            if not isinstance(move, str) or len(move) not in (4, 5) \
+                    or move[:2] not in SQUARE_INDICES \
+                    or move[2:4] not in SQUARE_INDICES:
+                print(f'Unrecognized analysis line: {line}', file=sys.stderr)
+                continue
+            if not arrows:
+                (score, mate) = (line.get('score'), line.get('mate'))
+            arrows += [(SQUARE_INDICES[move[:2]], SQUARE_INDICES[move[2:4]])]
+
+        if not isinstance(score, (int, float)):
+            score = None
+        if not isinstance(mate, int):
+            mate = None
+        return Analysis(arrows, score, mate)
+
+    def __parse_legal_moves(self, moves):
+        """
+        Parses the value of a 'set legal moves' command.
+
+        Unrecognized moves are reported and skipped.
+
+        :param moves: List of moves in format 'e2e4', or 'e7e8q' for a
+                      promotion, or a single string of such moves separated
+                      by spaces. The promotion piece does not affect which
+                      squares can be moved to.
+        :return: LegalMoves
+        """
+        if isinstance(moves, str):
+            moves = moves.split()
+        elif not isinstance(moves, list):
+            print('Error: Legal moves must be a list of moves',
+                  file=sys.stderr)
+            return LegalMoves()
+        masks = [0] * 64
+        for move in moves:
+            if isinstance(move, str) and len(move) in (4, 5):
+                src = SQUARE_INDICES.get(move[:2])
+                target = SQUARE_INDICES.get(move[2:4])
+                if src is not None and target is not None:
+                    masks[src] |= 1 << target
+                    continue
+            print(f'Unrecognized move: {move}', file=sys.stderr)
+        return LegalMoves(masks)
+
+    def __set_position(self, game_id, populated_squares, game_state):
+        """
+        Updates the board and game state views of a game to a new position.
+
+        :param game_id: Game id
+        :param populated_squares: Dictionary in format {pos:piece}
+        :param game_state: Dictionary containing {topic:value} pairs
+        """
+        if self.tracer is not None:
+            self.tracer.position_emitted(game_id, self.read_time)
+        if self.position_store is not None:
+            self.unrecorded_positions[game_id] = \
+                (populated_squares, game_state)
+        self.emit('set_position', game_id, populated_squares)
+        self.emit('set_game_state', game_id, game_state)
+        if self.movegen:
+            try:
+                legal_moves = Position(
+                    populated_squares, game_state).legal_move_masks()
+            except (ValueError, IndexError, KeyError) as err:
+                # FenParser accepts setups no game can reach, which must
+                # not stop the input
+                print(f'Error: No legal moves generated: {err!r}',
+                      file=sys.stderr)
+                legal_moves = LegalMoves()
+            self.emit('set_legal_moves', game_id, legal_moves)
+
+    @staticmethod
+    def __is_history(half_moves):
+        """Checks whether a command value is a list of half moves."""
+        return isinstance(half_moves, list) \
+            and all(isinstance(half_move, str) for half_move in half_moves)
+
+    def __append_history(self, game_id, half_moves):
+        """
+        Appends to the move history of a game.
+
+        :param game_id: Game id
+        :param half_moves: List of half moves
+        """
+        self.move_histories.setdefault(game_id, []).extend(half_moves)
+        self.emit('append_move_history', game_id, half_moves)
+
+    def __undo_history(self, game_id):
+        """
+        Removes the last half move from the move history of a game, if any.
+
+        :param game_id: Game id
+        """
+        move_history = self.move_histories.get(game_id)
+        if move_history:
+            move_history.pop()
+            if self.position_store is not None:
+                self.position_store.truncate(game_id, len(move_history) + 1)
+            self.emit('undo_move_history', game_id)
+
+    def __set_history(self, game_id, half_moves):
+        """
+        Replaces the move history of a game.
+
+        :param game_id: Game id
+        :param half_moves: List of half moves
+        """
+        self.move_histories[game_id] = list(half_moves)
+        if self.position_store is not None:
+            # Positions of the replaced history no longer apply
+            self.position_store.truncate(game_id, 0)
+        self.emit('set_move_history', game_id, half_moves)
+
+
+class IOThread(UpdateThread):
+    """Collects and validates input data, and updates views."""
+
+    def __init__(self, reader, tracer=None, position_store=None,
+                 startup_commands=(), movegen=False, command_log=None):
+        """
+        :param reader: CommandReader, or a CommandLogReader to replay a
+                       recorded session
+        :param tracer: LatencyTracer, or None to disable tracing
+        :param position_store: PositionStore to record the position of
+                               every ply in, or None
+        :param startup_commands: List of command dictionaries to handle
+                                 before reading any input
+        :param movegen: True to generate the legal moves of every position,
+                        instead of waiting for the engine to set them
+        :param command_log: CommandLog to record every command to, or None
+        """
+        UpdateThread.__init__(self, tracer)
+        self.reader = reader
+        self.startup_commands = startup_commands
+        self.processor = CommandProcessor(
+            self.emit_update, tracer, position_store, movegen, command_log)
+
+    def run(self):
+        """Executes the IO thread."""
+        if not self.processor.handle_batch(list(self.startup_commands)):
+            return
+        while True:
+            batch = self.reader.read()
+            if batch is None or not self.processor.handle_batch(batch):
+                return
+
+    def stop(self):
+        """Stops the IO thread, waits for it to finish and closes its input."""
+        self.reader.wake()
+        self.wait()
+        self.reader.close()
+        self.processor.close()
+
+    def handle_commands(self, cmds):
+        """See CommandProcessor.handle_commands()."""
+        return self.processor.handle_commands(cmds)
+
+    def handle_frame(self, opcode, payload, source=0):
+        """See CommandProcessor.handle_frame()."""
+        return self.processor.handle_frame(opcode, payload, source)
+
+
+class PositionRecorder:
+    """
+    Stands in for the PositionStore in a worker process, passing what is
+    recorded on to the GUI process as updates.
+    """
+
+    def __init__(self, emit):
+        """
+        :param emit: Callable taking the name of an update and its arguments
+        """
+        self.emit = emit
+
+    def record(self, game_id, ply, populated_squares, game_state):
+        """See PositionStore.record()."""
+        self.emit('record_position', game_id, ply, populated_squares,
+                  game_state)
+
+    def truncate(self, game_id, plies):
+        """See PositionStore.truncate()."""
+        self.emit('truncate_positions', game_id, plies)
+
+
+class WorkerIOThread(UpdateThread):
+    """
+    Reads, decodes and validates commands in a separate worker process, so
+    that work does not compete with the GUI for the GIL, and emits the
+    updates the worker sends back.
+
+    The worker is forked before the QApplication exists, with start_worker(),
+    and sends its updates over a pipe, at most MESSAGE_SNAPSHOTS snapshots
+    per message. Messages that arrive together are merged into one snapshot
+    by PendingUpdates, as UpdateCoalescer would merge them, so a burst of
+    input costs the GUI thread one pass rather than one per command.
+    """
+
+    MESSAGE_SNAPSHOTS = 16
+
+    @staticmethod
+    def start_worker(reader_options, startup_commands=(), movegen=False,
+                     command_log=None, record_positions=True):
+        """
+        Forks the worker process. Must be called before any Qt object is
+        created.
+
+        :param reader_options: Dictionary of CommandReader arguments
+        :param startup_commands: List of command dictionaries to handle
+                                 before reading any input
+        :param movegen: See IOThread
+        :param command_log: CommandLog for the worker to record every
+                            command to, or None. It is closed in this
+                            process.
+        :param record_positions: Whether to send the position of each ply
+                                 for the GUI's PositionStore
+        :return: Tuple containing the process and the receiving end of its
+                 pipe
+        """
+        reader_options = dict(reader_options)
+        if reader_options.get('stdin', True):
+            # The worker's own stdin is closed by multiprocessing, so it
+            # reads a duplicate of ours instead
+            reader_options['stdin_fd'] = os.dup(sys.stdin.fileno())
+        (connection, worker_connection) = \
+            multiprocessing.get_context('fork').Pipe(duplex=False)
+        process = multiprocessing.get_context('fork').Process(
+            target=WorkerIOThread.run_worker,
+            args=(worker_connection, reader_options, startup_commands,
+                  movegen, command_log, record_positions),
+            daemon=True)
+        process.start()
+        worker_connection.close()
+        if command_log is not None:
+            command_log.close()
+        if 'stdin_fd' in reader_options:
+            os.close(reader_options['stdin_fd'])
+        return (process, connection)
+
+    @staticmethod
+    def run_worker(connection, reader_options, startup_commands, movegen,
+                   command_log, record_positions):
+        """
+        Runs in the worker process: handles commands until asked to quit,
+        sending their updates to the GUI process.
+
+        :param connection: Sending end of the pipe to the GUI process
+        :param reader_options: Dictionary of CommandReader arguments
+        :param startup_commands: List of command dictionaries to handle
+                                 before reading any input
+        :param movegen: See IOThread
+        :param command_log: CommandLog to record every command to, or None
+        :param record_positions: See start_worker()
+        """
+        updates = []
+        snapshots = 0
+
+        def emit(update, *args):
+            nonlocal snapshots
+            updates.append((update, args))
+            if update == 'apply_updates':
+                snapshots += 1
+                # A large batch goes out in parts, so the GUI process can
+                # start on it while the rest is handled
+                if snapshots == WorkerIOThread.MESSAGE_SNAPSHOTS:
+                    connection.send(updates)
+                    updates.clear()
+                    snapshots = 0
+
+        processor = CommandProcessor(
+            emit, None, PositionRecorder(emit) if record_positions else None,
+            movegen, command_log)
+        reader = CommandReader(**reader_options)
+        # stop() sends SIGTERM, which ends the loop below once the current
+        # batch is handled, so the command log is closed
+        signal.signal(signal.SIGTERM, lambda signum, frame: reader.wake())
+        keep_running = processor.handle_batch(list(startup_commands))
+        while keep_running:
+            if updates:
+                connection.send(updates)
+                updates.clear()
+                snapshots = 0
+            batch = reader.read()
+            keep_running = \
+                batch is not None and processor.handle_batch(batch)
+        if updates:
+            connection.send(updates)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        reader.close()
+        processor.close()
+        connection.close()
+
+    def __init__(self, process, connection, tracer=None,
+                 position_store=None):
+        """
+        :param process: Worker process from start_worker()
+        :param connection: Receiving end of the worker's pipe
+        :param tracer: LatencyTracer, or None to disable tracing. Latency is
+                       measured from when an update reaches the GUI process.
+        :param position_store: PositionStore to record the position of
+                               every ply in, or None
+        """
+        UpdateThread.__init__(self, tracer)
+        self.process = process
+        self.connection = connection
+        self.position_store = position_store
+
+    def run(self):
+        """Emits the updates sent by the worker until it exits."""
+        pending = PendingUpdates()
+        analyses = {}
+        while True:
+            try:
+                messages = [self.connection.recv()]
+            except (EOFError, OSError):
+                return
+            # Everything else that has arrived is merged in with it
+            closed = False
+            try:
+                while self.connection.poll():
+                    messages += [self.connection.recv()]
+            except (EOFError, OSError):
+                closed = True
+
+            receive_time = time.perf_counter()
+            for updates in messages:
+                for (update, args) in updates:
+                    if update == 'apply_updates':
+                        self.__merge_snapshot(
+                            pending, analyses, args[0], receive_time)
+                    elif update == 'set_analysis':
+                        analyses[args[0]] = args
+                    elif update == 'record_position':
+                        if self.position_store is not None:
+                            self.position_store.record(*args)
+                    elif update == 'truncate_positions':
+                        if self.position_store is not None:
+                            self.position_store.truncate(*args)
+                    else:
+                        self.__emit_pending(pending, analyses)
+                        self.emit_update(update, *args)
+            self.__emit_pending(pending, analyses)
+            if closed:
+                return
+
+    def __merge_snapshot(self, pending, analyses, snapshot, receive_time):
+        """
+        Merges a snapshot from the worker into the pending updates.
+
+        :param pending: PendingUpdates
+        :param analyses: See __emit_pending()
+        :param snapshot: Tuple of (name, args) pairs naming MainWindow slots
+        :param receive_time: time.perf_counter() when it was received
+        """
+        for (name, args) in snapshot:
+            if name == 'set_position':
+                if self.tracer is not None:
+                    self.tracer.command_read('set fen')
+                    self.tracer.position_emitted(args[0], receive_time)
+                # The arrows of earlier analysis would be cleared by the new
+                # position, so only its evaluation is kept
+                analysis = analyses.get(args[0], (None, None))[1]
+                if analysis is not None:
+                    analyses[args[0]] = (args[0], Analysis(
+                        score=analysis.score, mate=analysis.mate))
+            if pending.add(name, args) and name == 'set_position' \
+                    and self.tracer is not None:
+                self.tracer.position_superseded(args[0])
+
+    def __emit_pending(self, pending, analyses):
+        """
+        Emits the merged updates, as one snapshot and the latest analysis of
+        each game.
+
+        :param pending: PendingUpdates
+        :param analyses: Dictionary in format {game_id:args} of the latest
+                         'set_analysis' update of each game, emptied
+        """
+        if pending:
+            self.emit_update('apply_updates', pending.snapshot())
+        for args in analyses.values():
+            self.emit_update('set_analysis', *args)
+        analyses.clear()
+
+    def stop(self, timeout=1.0):
+        """
+        Asks the worker process to stop, kills it if it does not, and waits
+        for the thread to finish.
+
+        :param timeout: Seconds to wait for the worker to stop by itself
+        """
+        self.process.terminate()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.wait()
+        self.connection.close()
+
+
+class PendingUpdates:
+    """
+    The latest update for each view of each game, not yet applied.
+
+    An update replaces the pending one for its view and game. Move history
+    changes are deltas, so they are merged into the pending change instead.
+    It does not use Qt, so updates can be merged in any thread.
+    """
+
+    # Views in the order their pending updates are applied
+    VIEWS = (
+        'set_position',
+        'set_legal_moves',
+        'set_game_state',
+        'move_history',
+        'set_analysis',
+    )
+
+    # MainWindow slots changing the move history, with the change each one
+    # makes as (move_history, undos, half_moves) for the given arguments
+    MOVE_HISTORY_UPDATES = {
+        'set_move_history': lambda move_history: (move_history, 0, []),
+        'append_move_history': lambda half_moves: (None, 0, half_moves),
+        'undo_move_history': lambda: (None, 1, []),
+    }
 
     def __init__(self):
+        self.games = {}
+
+    def __len__(self):
+        """Returns the number of games with pending updates."""
+        return len(self.games)
+
+    def add(self, update, args):
+        """
+        Adds an update from a snapshot.
+
+        :param update: Name of the MainWindow slot, e.g. 'set_position'
+        :param args: Arguments of the slot, starting with the game id
+        :return: True if a pending update was replaced
+        """
+        game_id = args[0]
+        if update in self.MOVE_HISTORY_UPDATES:
+            return self.post(game_id, 'move_history', self.move_history(
+                game_id, *self.MOVE_HISTORY_UPDATES[update](*args[1:])))
+        return self.post(game_id, update, args[1])
+
+    def post(self, game_id, view, value):
+        """
+        Replaces the pending update for a view of a game.
+
+        :param game_id: Game id
+        :param view: Name of the MainWindow slot that applies the update
+        :param value: Value to pass to the slot
+        :return: True if a pending update was replaced
+        """
+        pending = self.games.setdefault(game_id, {})
+        replaced = view in pending
+        pending[view] = value
+        return replaced
+
+    def move_history(self, game_id, move_history, undos, half_moves):
+        """
+        Merges a move history change into the pending one.
+
+        A pending change is held as (move_history, undos, half_moves):
+        replace the history if move_history is not None, then undo the last
+        half move undos times, then append half_moves.
+
+        :param game_id: Game id
+        :param move_history: List of half moves replacing the history, or
+                             None to keep it
+        :param undos: Number of half moves to undo
+        :param half_moves: List of half moves to append
+        :return: The merged change
+        """
+        (pending_history, pending_undos, pending_half_moves) = \
+            self.games.get(game_id, {}).get('move_history', (None, 0, []))
+        if move_history is not None:
+            (pending_history, pending_undos, pending_half_moves) = \
+                (list(move_history), 0, [])
+        for _ in range(undos):
+            if pending_half_moves:
+                pending_half_moves = pending_half_moves[:-1]
+            elif pending_history:
+                pending_history.pop()
+            else:
+                pending_undos += 1
+        return (pending_history, pending_undos,
+                pending_half_moves + half_moves)
+
+    def take(self):
+        """
+        Removes every pending update.
+
+        :return: Dictionary in format {game_id:{view:value}}
+        """
+        (games, self.games) = (self.games, {})
+        return games
+
+    def snapshot(self):
+        """
+        Removes every pending update, as one snapshot for
+        MainWindow.apply_updates().
+
+        :return: Tuple of (name, args) pairs naming MainWindow slots
+        """
+        updates = []
+        for (game_id, pending_views) in self.take().items():
+            for view in self.VIEWS:
+                if view not in pending_views:
+                    continue
+                if view != 'move_history':
+                    updates += [(view, (game_id, pending_views[view]))]
+                    continue
+                (move_history, undos, half_moves) = pending_views[view]
+                if move_history is not None:
+                    updates += [('set_move_history', (game_id, move_history))]
+                updates += [('undo_move_history', (game_id,))] * undos
+                if half_moves:
+                    updates += [
+                        ('append_move_history', (game_id, half_moves))]
+        return tuple(updates)
+
+
+class UpdateCoalescer(QObject):
+    """
+    Sits between the IO thread and the main window, and applies at most one
+    update per view and game per display frame.
+
+    Only the latest pending update for each view of each game is kept.
+    Updates replaced before they were applied are counted as dropped.
+    """
+
+    VIEWS = PendingUpdates.VIEWS
+
+    def __init__(self, main_window, max_fps=60, report_drops=True):
+        """
+        :param main_window: MainWindow to apply updates to
+        :param max_fps: Maximum number of frames per second
+        :param report_drops: True to show the number of dropped updates in
+                             the status bar
+        """
+        QObject.__init__(self)
+        self.main_window = main_window
+        self.report_drops = report_drops
+        self.frame_interval = 1 / max_fps
+        self.pending = PendingUpdates()
+        self.dropped = dict.fromkeys(self.VIEWS, 0)
+        self.applied = dict.fromkeys(self.VIEWS, 0)
+        self.last_frame = 0
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.apply_pending)
+
+    def __post(self, game_id, view, value):
+        """
+        Queues an update for a view of a game, replacing any pending one, and
+        schedules it for the next frame.
+
+        :param game_id: Game id
+        :param view: Name of the MainWindow slot that applies the update
+        :param value: Value to pass to the slot
+        """
+        if self.pending.post(game_id, view, value):
+            self.dropped[view] += 1
+            if view == 'set_position' and self.main_window.tracer is not None:
+                self.main_window.tracer.position_superseded(game_id)
+
+        if not self.timer.isActive():
+            wait = self.last_frame + self.frame_interval - time.monotonic()
+            self.timer.start(max(0, int(wait * 1000)))
+
+    @Slot()
+    def apply_pending(self):
+        """Applies the latest pending update for each view of each game."""
+        self.last_frame = time.monotonic()
+        for (game_id, pending_views) in self.pending.take().items():
+            for view in self.VIEWS:
+                if view in pending_views:
+                    if view == 'move_history':
+                        self.__apply_move_history(
+                            game_id, *pending_views[view])
+                    else:
+                        getattr(self.main_window, view)(
+                            game_id, pending_views[view])
+                    self.applied[view] += 1
+
+        dropped = sum(self.dropped.values())
+        if dropped and self.report_drops:
+            self.main_window.status_bar.showMessage(
+                f'Skipped {dropped} superseded updates')
+
+    @Slot(object)
+    def apply_updates(self, updates):
+        """See MainWindow.apply_updates()."""
+        for (update, args) in updates:
+            getattr(self, update)(*args)
+
+    @Slot(str, dict)
+    def set_position(self, game_id, populated_squares):
+        """See MainWindow.set_position()."""
+        self.__post(game_id, 'set_position', populated_squares)
+
+    @Slot(str, object)
+    def set_legal_moves(self, game_id, legal_moves):
+        """See MainWindow.set_legal_moves()."""
+        self.__post(game_id, 'set_legal_moves', legal_moves)
+
+    @Slot(str, dict)
+    def set_game_state(self, game_id, game_state):
+        """See MainWindow.set_game_state()."""
+        self.__post(game_id, 'set_game_state', game_state)
+
+    @Slot(str, object)
+    def set_analysis(self, game_id, analysis):
+        """See MainWindow.set_analysis()."""
+        self.__post(game_id, 'set_analysis', analysis)
+
+    def __apply_move_history(self, game_id, move_history, undos, half_moves):
+        """
+        Applies a pending move history change.
+
+        :param game_id: Game id
+        :param move_history: List of half moves replacing the history, or
+                             None to keep it
+        :param undos: Number of half moves to undo
+        :param half_moves: List of half moves to append
+        """
+        if move_history is not None:
+            self.main_window.set_move_history(game_id, move_history)
+        for _ in range(undos):
+            self.main_window.undo_move_history(game_id)
+        if half_moves:
+            self.main_window.append_move_history(game_id, half_moves)
+
+    @Slot(str, list)
+    def set_move_history(self, game_id, move_history):
+        """See MainWindow.set_move_history()."""
+        self.__post(game_id, 'move_history', self.pending.move_history(
+            game_id, move_history, 0, []))
+
+    @Slot(str, list)
+    def append_move_history(self, game_id, half_moves):
+        """See MainWindow.append_move_history()."""
+        self.__post(game_id, 'move_history', self.pending.move_history(
+            game_id, None, 0, half_moves))
+
+    @Slot(str)
+    def undo_move_history(self, game_id):
+        """See MainWindow.undo_move_history()."""
+        self.__post(game_id, 'move_history', self.pending.move_history(
+            game_id, None, 1, []))
+
+
+class LazyDock(QDockWidget):
+    """
+    A dock that starts hidden and only builds its widget when it is first
+    shown, so docks that are never opened cost nothing at startup.
+    """
+
+    def __init__(self, title, parent, create_widget):
+        """
+        :param title: Dock title
+        :param parent: Parent widget
+        :param create_widget: Callable returning the dock's widget
+        """
+        QDockWidget.__init__(self, title, parent)
+        self.create_widget = create_widget
+        self.hide()
+
+    def showEvent(self, event):
+        """Builds the widget the first time the dock is shown."""
+        if self.widget() is None:
+            self.setWidget(self.create_widget())
+        QDockWidget.showEvent(self, event)
+
+
+class MainWindow(QMainWindow):
+
+    """Main window for the application."""
+
+    # Emits moves made on any board, with the game id of the board
+    user_move_signal = Signal(str, str)
+
+    def __init__(self, tracer=None, monitor=False, position_store=None):
+        """
+        :param tracer: LatencyTracer, or None to disable tracing
+        :param monitor: True to show a grid with a board per game instead of
+                        a single board
+        :param position_store: PositionStore filled by the IO thread, or None
+                               to disable stepping through earlier plies
+        """
+        QMainWindow.__init__(self)
+        self.tracer = tracer
+        self.position_store = position_store
+        # Earlier plies are rendered off screen, which only navigation needs
+        self.snapshots = BoardSnapshots() if position_store is not None \
+            else None
+
+        # In monitor mode the docks show the game last selected on the grid
+        self.game_states = {}
+        self.history_models = {}
+        self.current_game = None if monitor else ''
+
+        # Ply of the current game shown instead of the live position, if any
+        self.viewed_ply = None
+
+        # First initialize the underlying views
+        if monitor:
+            self.board_view = None
+            self.board_grid = BoardGrid(self)
+            self.board_grid.game_selected_signal.connect(self.select_game)
+            central_widget = self.board_grid
+        else:
+            self.board_view = BoardView(self)
+            self.board_view.scene.move_signal.connect(
+                lambda move: self.user_move_signal.emit('', move))
+            self.board_grid = None
+            central_widget = self.board_view
+
+        # Docks start hidden and build their views when first shown, so
+        # until then the game state and move history shown in them are
+        # only kept here
+        self.shown_game_state = {}
+        self.history_model = MoveHistoryModel() if monitor \
+            else self.__history_model(self.current_game)
+        self.game_state_view = None
+        self.move_history_view = None
+        self.game_state_dock = self.add_dock(
+            'GameState', self.__create_game_state_view)
+        self.move_history_dock = self.add_dock(
+            'Move History', self.__create_move_history_view)
+        if tracer is not None:
+            self.stats_dock = self.add_dock(
+                'Stats', lambda: StatsView(self, tracer))
+            if self.board_view is not None:
+                self.board_view.painted_signal.connect(tracer.painted)
+
+        # Next initialize the menu and status bars
+        self.flip_action = QAction('Flip Board', self)
+        self.flip_action.setCheckable(True)
+        self.flip_action.toggled.connect(central_widget.set_flipped)
+        self.flip_action.toggled.connect(self.__refresh_viewed_ply)
+        self.back_action = QAction('Back', self)
+        self.back_action.setShortcut(QKeySequence(Qt.Key_Left))
+        self.back_action.triggered.connect(self.view_previous_ply)
+        self.forward_action = QAction('Forward', self)
+        self.forward_action.setShortcut(QKeySequence(Qt.Key_Right))
+        self.forward_action.triggered.connect(self.view_next_ply)
+        if position_store is None:
+            self.back_action.setDisabled(True)
+            self.forward_action.setDisabled(True)
+        self.undo_action = QAction('Undo', self)
+        self.undo_action.setDisabled(True)
+        dock_actions = [
+            self.game_state_dock.toggleViewAction(),
+            self.move_history_dock.toggleViewAction(),
+        ]
+        if tracer is not None:
+            dock_actions += [self.stats_dock.toggleViewAction()]
+        self.menu_bar = self.add_menu_bar({
+            'Minae': dock_actions + [
+                self.flip_action,
+                self.back_action,
+                self.forward_action,
+                self.undo_action,
+            ],
+        })
+        self.status_bar = QStatusBar(self)
+
+        # Finally tie it all together
+        self.setCentralWidget(central_widget)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.game_state_dock)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.move_history_dock)
+        if tracer is not None:
+            self.addDockWidget(Qt.RightDockWidgetArea, self.stats_dock)
+        self.setMenuBar(self.menu_bar)
+        self.setStatusBar(self.status_bar)
+        self.show()
+
+    def closeEvent(self, event):
+        """Handle closing of the main window."""
+        event.accept()
+
+    def board(self, game_id):
+        """
+        Returns the board view of a game. In monitor mode, a board is added
+        for a game the first time it is seen, and the first game is selected.
+
+        :param game_id: Game id
+        :return: BoardView
+        """
+        if self.board_grid is None:
+            return self.board_view
+
+        board = self.board_grid.boards.get(game_id)
+        if board is None:
+            board = self.board_grid.add_board(game_id)
+            board.scene.move_signal.connect(
+                lambda move: self.user_move_signal.emit(game_id, move))
+            if self.tracer is not None:
+                board.painted_signal.connect(
+                    lambda: self.tracer.painted(game_id))
+            if self.current_game is None:
+                self.select_game(game_id)
+        return board
+
+    def __is_shown(self, game_id):
+        """Checks whether the docks show a game."""
+        return self.board_grid is None or game_id == self.current_game
+
+    def __history_model(self, game_id):
+        """Returns the move history model of a game."""
+        history_model = self.history_models.get(game_id)
+        if history_model is None:
+            history_model = MoveHistoryModel()
+            self.history_models[game_id] = history_model
+        return history_model
+
+    def __create_game_state_view(self):
+        """Builds the game state view, when its dock is first shown."""
+        self.game_state_view = GameStateView(self)
+        self.game_state_view.set_game_state(self.shown_game_state)
+        return self.game_state_view
+
+    def __create_move_history_view(self):
+        """Builds the move history view, when its dock is first shown."""
+        self.move_history_view = MoveHistoryView(self, self.history_model)
+        if self.position_store is not None:
+            self.move_history_view.ply_selected_signal.connect(self.view_ply)
+        if self.viewed_ply is not None:
+            self.move_history_view.select_ply(self.viewed_ply)
+        return self.move_history_view
+
+    def __show_game_state(self, game_state):
+        """
+        Shows a game state in the game state dock.
+
+        :param game_state: Dictionary containing {topic:value} pairs
+        """
+        self.shown_game_state = game_state
+        if self.game_state_view is not None:
+            self.game_state_view.set_game_state(game_state)
+
+    def __history_changed(self, game_id):
+        """Scrolls the move history view to a changed history it shows."""
+        if self.move_history_view is not None and self.__is_shown(game_id):
+            self.move_history_view.scrollToBottom()
+
+    @Slot(str)
+    def select_game(self, game_id):
+        """
+        Shows the game state and move history of a game in the docks, in
+        monitor mode.
+
+        :param game_id: Game id
+        """
+        self.view_live_position()
+        self.current_game = game_id
+        self.__show_game_state(self.game_states.get(game_id, {}))
+        self.history_model = self.__history_model(game_id)
+        if self.move_history_view is not None:
+            self.move_history_view.set_history_model(self.history_model)
+        self.game_state_dock.setWindowTitle(f'GameState - {game_id}')
+        self.move_history_dock.setWindowTitle(f'Move History - {game_id}')
+
+    @Slot(int)
+    def view_ply(self, ply):
+        """
+        Shows the position reached at a ply of the current game, from the
+        position store. Reaching the last ply returns to the live position.
+
+        :param ply: Ply, counting from 0 for the position before any moves
+        """
+        if self.position_store is None or self.current_game is None:
+            return
+        last_ply = len(self.history_model.half_moves)
+        ply = max(0, min(ply, last_ply))
+        if ply == last_ply:
+            self.view_live_position()
+            return
+
+        position = self.position_store.position(self.current_game, ply)
+        if position is None:
+            self.status_bar.showMessage(f'No position recorded for ply {ply}')
+            return
+        (key, populated_squares, game_state) = position
+        self.viewed_ply = ply
+        board = self.board(self.current_game)
+        board.show_snapshot(self.snapshots.pixmap(
+            key, populated_squares, self.flip_action.isChecked(),
+            *board.render_size()))
+        self.__show_game_state(game_state)
+        if self.move_history_view is not None:
+            self.move_history_view.select_ply(ply)
+        self.status_bar.showMessage(f'Viewing ply {ply} of {last_ply}')
+
+    @Slot()
+    def view_previous_ply(self):
+        """Steps back one ply in the current game."""
+        if self.viewed_ply is not None:
+            self.view_ply(self.viewed_ply - 1)
+        else:
+            self.view_ply(len(self.history_model.half_moves) - 1)
+
+    @Slot()
+    def view_next_ply(self):
+        """Steps forward one ply in the current game."""
+        if self.viewed_ply is not None:
+            self.view_ply(self.viewed_ply + 1)
+
+    @Slot()
+    def view_live_position(self):
+        """Stops showing an earlier ply of the current game, if any."""
+        if self.viewed_ply is None:
+            return
+        self.viewed_ply = None
+        self.board(self.current_game).hide_snapshot()
+        self.__show_game_state(self.game_states.get(self.current_game, {}))
+        if self.move_history_view is not None:
+            self.move_history_view.clearSelection()
+        self.status_bar.clearMessage()
+
+    @Slot(bool)
+    def __refresh_viewed_ply(self, flipped):
+        """Redraws the viewed ply in the new board orientation."""
+        if self.viewed_ply is not None:
+            self.view_ply(self.viewed_ply)
+
+    @Slot(object)
+    def apply_updates(self, updates):
+        """
+        Applies a snapshot of updates in one pass, so nothing is painted in
+        between.
+
+        :param updates: Tuple of (name, args) pairs, each naming one of the
+                        slots below and its arguments
+        """
+        for (update, args) in updates:
+            getattr(self, update)(*args)
+
+    @Slot(str, dict)
+    def set_position(self, game_id, populated_squares):
+        """
+        Sets to a new chess position.
+
+        :param game_id: Game id
+        :param populated_squares: Dictionary of non-empty squares, in format
+                                  {pos:piece}, e.g. {'e2':'P', ...}
+        """
+        board = self.board(game_id)
+        board.set_position(populated_squares)
+        if self.tracer is not None:
+            self.tracer.position_applied(game_id)
+            # Paint even if nothing moved, so the trace completes
+            board.viewport().update()
+
+    @Slot(str, object)
+    def set_legal_moves(self, game_id, legal_moves):
+        """
+        Sets the legals moves.
+
+        :param game_id: Game id
+        :param legal_moves: LegalMoves
+        """
+        self.board(game_id).set_legal_moves(legal_moves)
+
+    @Slot(str, object)
+    def set_analysis(self, game_id, analysis):
+        """
+        Sets the engine analysis overlay.
+
+        :param game_id: Game id
+        :param analysis: Analysis
+        """
+        self.board(game_id).set_analysis(analysis)
+
+    @Slot(str, dict)
+    def set_game_state(self, game_id, game_state):
+        """
+        Sets the game state.
+
+        :param game_id: Game id
+        :param game_state: Dictionary containing {topic:value} pairs
+        """
+        self.board(game_id)
+        self.game_states[game_id] = game_state
+        # While an earlier ply is viewed, the docks keep showing its state
+        if self.__is_shown(game_id) and self.viewed_ply is None:
+            self.__show_game_state(game_state)
+
+    @Slot(str, list)
+    def set_move_history(self, game_id, move_history):
+        """
+        Sets the move history.
+
+        :param game_id: Game id
+        :param move_history: List of half moves
+        """
+        self.board(game_id)
+        self.__history_model(game_id).set_move_history(move_history)
+        self.__history_changed(game_id)
+
+    @Slot(str, list)
+    def append_move_history(self, game_id, half_moves):
+        """
+        Appends to the move history.
+
+        :param game_id: Game id
+        :param half_moves: List of half moves
+        """
+        self.board(game_id)
+        self.__history_model(game_id).append_move_history(half_moves)
+        self.__history_changed(game_id)
+
+    @Slot(str)
+    def undo_move_history(self, game_id):
+        """
+        Removes the last half move from the move history.
+
+        :param game_id: Game id
+        """
+        self.board(game_id)
+        self.__history_model(game_id).undo_move_history()
+
+    def add_dock(self, title, create_widget):
+        """
+        Adds a hidden dock to the main window.
+
+        :param title: Dock title
+        :param create_widget: Callable building the dock's widget when the
+                              dock is first shown
+        :return: LazyDock
+        """
+        return LazyDock(title, self, create_widget)
+
+    def add_menu_bar(self, menus):
+        """Adds the menu bar to the main window."""
+        menu_bar = QMenuBar(self)
+        for menu, actions in menus.items():
+            menu = menu_bar.addMenu(menu)
+            for action in actions:
+                menu.addAction(action)
+        return menu_bar
+
+
+class Minae:
+
+    def __init__(self, options):
+        startup_commands = []
+        if options.pgn is not None:
+            startup_commands += [{'open pgn': options.pgn, 'open game': 1}]
+        reader_options = {
+            'stdin': not options.no_stdin,
+            'unix_path': options.listen_unix,
+            'tcp_address': options.listen_tcp,
+            'protocol': options.protocol,
+        }
+
+        command_log = None
+        if options.record is not None:
+            command_log = CommandLog(options.record)
+
+        # Only sessions that step through earlier plies keep their positions
+        if options.history_plies > 0:
+            self.position_store = PositionStore(options.history_plies)
+        elif options.pgn is not None:
+            self.position_store = PositionStore()
+        else:
+            self.position_store = None
+
+        # The worker is forked before Qt starts any threads of its own
+        if options.worker_process:
+            worker = WorkerIOThread.start_worker(
+                reader_options, startup_commands, options.movegen,
+                command_log, self.position_store is not None)
+
         self.app = QApplication()
-        self.main_window = MainWindow()
-        self.io_thread = IOThread()
-
-        self.io_thread.set_position_signal.connect(
-            self.main_window.set_position)
-        self.io_thread.set_legal_moves_signal.connect(
-            self.main_window.set_legal_moves)
-        self.io_thread.set_game_state_signal.connect(
-            self.main_window.set_game_state)
-        self.io_thread.set_move_history_signal.connect(
-            self.main_window.set_move_history)
+        self.tracer = LatencyTracer() if options.trace else None
+        self.main_window = MainWindow(
+            self.tracer, options.monitor, self.position_store)
+        if options.worker_process:
+            self.io_thread = WorkerIOThread(
+                *worker, self.tracer, self.position_store)
+        else:
+            self.io_thread = IOThread(
+                CommandReader(**reader_options), self.tracer,
+                self.position_store, startup_commands, options.movegen,
+                command_log)
+
+        # Without a frame rate cap, updates go straight to the main window
+        if options.max_fps > 0:
+            self.coalescer = UpdateCoalescer(
+                self.main_window, options.max_fps)
+            views = self.coalescer
+        else:
+            self.coalescer = None
+            views = self.main_window
+
+        self.io_thread.apply_updates_signal.connect(views.apply_updates)
         self.io_thread.quit_app_signal.connect(
             self.app.quit, Qt.QueuedConnection)
 
+        # Analysis arrives far more often than positions, so it is applied
+        # at a lower rate of its own, and never delays position updates
+        if options.analysis_fps > 0:
+            self.analysis_coalescer = UpdateCoalescer(
+                self.main_window, options.analysis_fps, report_drops=False)
+            self.io_thread.set_analysis_signal.connect(
+                self.analysis_coalescer.set_analysis)
+        else:
+            self.analysis_coalescer = None
+            self.io_thread.set_analysis_signal.connect(
+                self.main_window.set_analysis)
+
+        # Moves made on the board go out on a thread of their own
+        self.event_writer = EventWriter()
+        self.main_window.user_move_signal.connect(
+            self.event_writer.user_move)
+
     def start(self):
         self.io_thread.start()
         self.app.exec_()
+        self.io_thread.stop()
+        self.event_writer.close()
+
+
+def parse_tcp_address(text):
+    """
+    Parses a TCP address option.
+
+    :param text: Address in format [HOST:]PORT, e.g. '9000'
+    :return: Tuple containing (host, port)
+    """
+    (host, _, port) = text.rpartition(':')
+    try:
+        return (host or '127.0.0.1', int(port))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid port: {port!r}')
+
+
+def parse_options(args):
+    """
+    Parses command line options.
+
+    :param args: List of command line arguments, excluding the program name
+    :return: argparse.Namespace of options
+    """
+    parser = argparse.ArgumentParser(description='Minae Chess GUI')
+    parser.add_argument(
+        '--max-fps', type=int, default=60, metavar='FPS',
+        help='apply updates at most this many times per second, keeping '
+             'only the latest of each kind (0 applies every update)')
+    parser.add_argument(
+        '--analysis-fps', type=int, default=10, metavar='FPS',
+        help='apply engine analysis at most this many times per second, '
+             'independently of --max-fps (0 applies every update)')
+    parser.add_argument(
+        '--listen-unix', metavar='PATH',
+        help='also accept commands from clients of a Unix domain socket')
+    parser.add_argument(
+        '--listen-tcp', type=parse_tcp_address, metavar='[HOST:]PORT',
+        help='also accept commands from clients of a TCP port, on localhost '
+             'unless a host is given')
+    parser.add_argument(
+        '--no-stdin', action='store_true',
+        help='do not read commands from stdin')
+    parser.add_argument(
+        '--protocol', choices=('json', 'binary'), default='json',
+        help='command protocol of every input: newline-delimited JSON '
+             '(default) or length-prefixed binary frames')
+    parser.add_argument(
+        '--pgn', metavar='FILE',
+        help='open a PGN archive and show its first game; other games are '
+             'opened with the open game command')
+    parser.add_argument(
+        '--history-plies', type=int, default=0, metavar='N',
+        help='keep the positions of the last N plies of each game, for '
+             'stepping back through them (default: off, or every ply of a '
+             '--pgn game)')
+    parser.add_argument(
+        '--movegen', action='store_true',
+        help='generate the legal moves of every position instead of waiting '
+             'for set legal moves from the engine')
+    parser.add_argument(
+        '--record', metavar='FILE',
+        help='record every command received, with its arrival time, for '
+             'replaying with benchmark.py --replay')
+    parser.add_argument(
+        '--worker-process', action='store_true',
+        help='read, decode and validate commands in a separate process, '
+             'keeping that work off the GUI process (Unix only)')
+    parser.add_argument(
+        '--monitor', action='store_true',
+        help='show a grid with a board for every game id seen in the '
+             'commands, for watching many games at once')
+    parser.add_argument(
+        '--trace', action='store_true',
+        help='time updates from command receipt to painted board, shown by '
+             'the stats command and the Stats dock')
+    return parser.parse_args(args)
 
 
 def main(argv):
 
-    minae = Minae()
+    minae = Minae(parse_options(argv[1:]))
     minae.start()
 
 